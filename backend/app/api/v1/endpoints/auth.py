@@ -2,7 +2,7 @@
 Authentication API endpoints
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
@@ -12,7 +12,11 @@ from app.core.database import get_db
 from app.core.config import settings
 from app.core.exceptions import AuthenticationError
 from app.models.user import User
-from app.schemas.user import UserCreate, UserResponse, Token
+from app.schemas.user import UserCreate, UserResponse, Token, RefreshRequest
+from app.services import refresh_tokens
+from app.services.passwords import login_limiter, password_hasher
+from app.services.token_cache import verified_tokens
+from app.services.user_cache import user_cache
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -25,9 +29,6 @@ async def register_user(
 ):
     """Register a new user"""
     from sqlalchemy import select
-    from passlib.context import CryptContext
-    
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     
     # Check if user already exists
     existing_user = await db.execute(
@@ -40,7 +41,7 @@ async def register_user(
         )
     
     # Create new user
-    hashed_password = pwd_context.hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     user = User(
         username=user_data.username,
         email=user_data.email,
@@ -57,57 +58,87 @@ async def register_user(
 
 @router.post("/login", response_model=Token)
 async def login_user(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)
 ):
     """Login user and return access token"""
     from sqlalchemy import select
-    from passlib.context import CryptContext
-    from jose import JWTError, jwt
-    
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     
-    # Get user by username or email
-    user = await db.execute(
-        select(User).where(
-            (User.username == form_data.username) | 
-            (User.email == form_data.username)
+    client_ip = request.client.host if request.client else None
+    with login_limiter.attempt(form_data.username, client_ip):
+        # Get user by username or email
+        user = await db.execute(
+            select(User).where(
+                (User.username == form_data.username) | 
+                (User.email == form_data.username)
+            )
         )
-    )
-    user = user.scalar_one_or_none()
-    
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
-        raise AuthenticationError("Invalid username or password")
+        user = user.scalar_one_or_none()
+        
+        if not user or not await password_hasher.verify(form_data.password, user.hashed_password):
+            raise AuthenticationError("Invalid username or password")
     
     if not user.is_active:
         raise AuthenticationError("User account is disabled")
     
-    # Create access token
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(user.id)}, 
-        expires_delta=access_token_expires
-    )
+    # Start a refresh token family for this client
+    refresh_token = refresh_tokens.issue(db, user.id)
+    await refresh_tokens.prune(db, user.id)
     
     # Update last login
     user.last_login = datetime.utcnow()
     await db.commit()
+    await user_cache.invalidate(user.id)
+    
+    return token_response(user.id, refresh_token)
+
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(
+    refresh_data: RefreshRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Exchange a refresh token for a new access token and refresh token
+
+    No password is checked; the refresh token is spent with one indexed
+    update and can't be used again.
+    """
+    from sqlalchemy import select
+    
+    user_id, refresh_token = await refresh_tokens.rotate(db, refresh_data.refresh_token)
+    
+    user = await user_cache.get(user_id)
+    if user is None:
+        user = await db.execute(select(User).where(User.id == user_id))
+        user = user.scalar_one_or_none()
+        if user is not None:
+            await user_cache.set(user)
+    
+    if user is None or not user.is_active:
+        raise AuthenticationError("User account is disabled")
+    
+    await db.commit()
+    return token_response(user_id, refresh_token)
+
+
+def token_response(user_id: int, refresh_token: str) -> dict:
+    """New access token for ``user_id`` alongside ``refresh_token``"""
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": str(user_id)}, 
+        expires_delta=access_token_expires
+    )
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": refresh_token,
+        "refresh_expires_in": int(refresh_tokens.refresh_token_lifetime().total_seconds())
     }
 
 
-@router.get("/me", response_model=UserResponse)
-async def get_current_user(
-    current_user: User = Depends(get_current_user_from_token)
-):
-    """Get current user information"""
-    return current_user
-
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     from jose import jwt
@@ -127,9 +158,13 @@ async def get_current_user_from_token(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
 ) -> User:
-    """Get current user from JWT token"""
+    """Get current user from JWT token
+
+    A token verified before comes from ``verified_tokens`` without another
+    signature check. The user comes from ``user_cache`` when possible, as a
+    detached copy; load it into the request's session before changing it.
+    """
     from sqlalchemy import select
-    from jose import JWTError, jwt
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -137,18 +172,44 @@ async def get_current_user_from_token(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+    payload = await verified_tokens.verify(token)
+    user_id: Optional[str] = payload.get("sub") if payload is not None else None
+    if user_id is None:
         raise credentials_exception
     
-    user = await db.execute(select(User).where(User.id == int(user_id)))
-    user = user.scalar_one_or_none()
-    
+    user = await user_cache.get(int(user_id))
     if user is None:
+        user = await db.execute(select(User).where(User.id == int(user_id)))
+        user = user.scalar_one_or_none()
+        
+        if user is None:
+            raise credentials_exception
+        await user_cache.set(user)
+    
+    if not user.is_active:
         raise credentials_exception
     
     return user
+
+
+@router.get("/me", response_model=UserResponse)
+async def get_current_user(
+    current_user: User = Depends(get_current_user_from_token)
+):
+    """Get current user information"""
+    return current_user
+
+
+@router.post("/logout")
+async def logout_user(
+    refresh_data: Optional[RefreshRequest] = None,
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user_from_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Revoke the access token used for this request, and the refresh token if given"""
+    await verified_tokens.revoke(token)
+    if refresh_data is not None:
+        await refresh_tokens.revoke_family(db, refresh_data.refresh_token, current_user.id)
+        await db.commit()
+    return {"message": "Logged out"}
@@ -2,80 +2,184 @@
 Media management API endpoints
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Header, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from urllib.parse import urlencode
 import os
+import asyncio
 import hashlib
-import aiofiles
+import shutil
 from pathlib import Path
 
 from app.core.database import get_db
 from app.core.config import settings
-from app.models.media import MediaFile, MediaMetadata
+from app.models.media import MediaFile, TranscodedFile
 from app.schemas.media import (
     MediaFile as MediaFileSchema,
     MediaFileWithMetadata,
+    MediaFacets,
     MediaSearchRequest,
     MediaSearchResponse,
-    MediaUploadResponse
+    MediaUploadResponse,
+    UploadSessionCreate,
+    UploadSessionResponse,
+    LibraryScanResponse,
+    TranscodedFile as TranscodedFileSchema,
+    TranscodeRequest
 )
-from app.core.exceptions import MediaFileNotFound, UnsupportedMediaFormat
+from app.core.exceptions import MediaFileNotFound, MediaProcessingError, ValidationError
+from app.services.uploads import get_media_type, stream_upload_to_temp, discard_temp
+from app.services.resumable_uploads import UploadSession, UploadSessionStore, DEFAULT_CHUNK_SIZE
+from app.services.scanner import library_scanner
+from app.services.live_transcode import live_transcoder
+from app.services.hls import PLAYLIST_MEDIA_TYPE, SEGMENT_MEDIA_TYPE, hls_packager, master_playlist, media_playlist, variant_qualities
+from app.services.cache import (
+    MEDIA_FACETS,
+    MEDIA_FILES,
+    MEDIA_LISTS,
+    cached_response,
+    invalidate_media,
+    media_file_key,
+    response_cache
+)
+from app.services.facets import facet_aggregator
+from app.services.metadata import probe_media
+from app.services.pagination import CountCache, Cursor, decode_cursor, encode_cursor, encode_offset_cursor
+from app.services.search import apply_filters, join_metadata, needs_metadata, resolve_sort, sort_columns
+from app.services.streaming import build_file_response, build_offload_response
+from app.services.thumbnails import IMAGE_FORMATS, POSTER, THUMBNAIL, derivative_size, thumbnail_generator
+from app.services.transcoding import PRIORITY_USER, PROFILES, enqueue
 
 router = APIRouter()
+upload_sessions = UploadSessionStore(settings.UPLOAD_SPOOL_ROOT, max_file_size=settings.MAX_FILE_SIZE)
+media_counts = CountCache(settings.MEDIA_COUNT_CACHE_TTL)
 
 
 @router.get("/", response_model=MediaSearchResponse)
 async def get_media_files(
+    request: Request,
     query: Optional[str] = Query(None, description="Search query"),
     media_type: Optional[str] = Query(None, description="Media type filter"),
     genre: Optional[str] = Query(None, description="Genre filter"),
     year: Optional[int] = Query(None, description="Year filter"),
-    page: int = Query(1, ge=1, description="Page number"),
+    tags: Optional[List[str]] = Query(None, description="Only files with all of these tags"),
+    sort_by: Optional[str] = Query(None, description="relevance, created_at, title, year or file_size"),
+    sort_order: Optional[str] = Query(None, description="asc or desc"),
+    page: int = Query(1, ge=1, description="Page number (ignored when a cursor is given)"),
     page_size: int = Query(20, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    include_total: bool = Query(True, description="Include a cached total count"),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get media files with optional filtering and pagination"""
-    # This is a simplified implementation
-    # In a real application, you would implement proper filtering and pagination
-    from sqlalchemy import select, func
+    """Search and filter media files with pagination
+
+    ``query`` matches titles, descriptions, cast, tags and filenames. On
+    PostgreSQL it is answered from full-text and trigram indexes, so
+    misspelt words still match, and results are ranked by relevance.
+    Without a query files are listed newest first.
+
+    Pass ``next_cursor`` back as ``cursor`` to get the following page. When
+    sorted by creation time this seeks on (created_at, id), so each page
+    costs the same however deep the scroll goes. ``page`` is still
+    honoured without a cursor for older clients, at offset cost.
+    """
+    params = urlencode(sorted(request.query_params.multi_items()))
+    key = "media:list:" + hashlib.sha1(params.encode()).hexdigest()
+    body = await response_cache.get_or_set(key, [MEDIA_LISTS], lambda: _list_media_files(
+        db, query, media_type, genre, year, tags, sort_by, sort_order, page, page_size, cursor, include_total
+    ))
+    return cached_response(body)
+
+
+async def _list_media_files(
+    db: AsyncSession,
+    query: Optional[str],
+    media_type: Optional[str],
+    genre: Optional[str],
+    year: Optional[int],
+    tags: Optional[List[str]],
+    sort_by: Optional[str],
+    sort_order: Optional[str],
+    page: int,
+    page_size: int,
+    cursor: Optional[str],
+    include_total: bool
+) -> MediaSearchResponse:
+    from sqlalchemy import select, func, tuple_
     from sqlalchemy.orm import selectinload
     
+    query = query.strip() if query else None
+    sort_by, sort_order = resolve_sort(query, sort_by, sort_order)
+    dialect = db.bind.dialect.name
+    filters = dict(query=query, media_type=media_type, genre=genre, year=year, tags=tags)
+    
     # Build query
     stmt = select(MediaFile).options(selectinload(MediaFile.media_metadata))
+    count_stmt = select(func.count(MediaFile.id)).select_from(MediaFile)
+    if needs_metadata(query, genre, year, tags, sort_by):
+        stmt = join_metadata(stmt)
+    if needs_metadata(query, genre, year, tags):
+        count_stmt = join_metadata(count_stmt)
     
     # Apply filters
-    if media_type:
-        stmt = stmt.where(MediaFile.media_type == media_type)
-    
-    # Get total count
-    count_stmt = select(func.count(MediaFile.id))
-    if media_type:
-        count_stmt = count_stmt.where(MediaFile.media_type == media_type)
+    stmt = apply_filters(stmt, dialect, **filters)
+    count_stmt = apply_filters(count_stmt, dialect, **filters)
     
-    total_result = await db.execute(count_stmt)
-    total = total_result.scalar()
-    
-    # Apply pagination
-    offset = (page - 1) * page_size
-    stmt = stmt.offset(offset).limit(page_size)
+    stmt = stmt.order_by(*sort_columns(sort_by, sort_order, query, dialect))
+    position = decode_cursor(cursor) if cursor else Cursor(offset=(page - 1) * page_size)
+    keyset = sort_by == "created_at"
+    if position.is_keyset and keyset:
+        # Compare against the stored value while the row exists, since SQLite
+        # keeps timestamps as text that may not match the cursor's rendering
+        anchor = func.coalesce(
+            select(MediaFile.created_at).where(MediaFile.id == position.id).scalar_subquery(),
+            position.created_at
+        )
+        after = tuple_(MediaFile.created_at, MediaFile.id)
+        bound = tuple_(anchor, position.id)
+        stmt = stmt.where(after > bound if sort_order == "asc" else after < bound)
+    elif position.is_keyset:
+        raise ValidationError("Cursor does not match sort_by")
+    elif position.offset:
+        stmt = stmt.offset(position.offset)
     
-    # Execute query
-    result = await db.execute(stmt)
+    # One extra row tells whether there is a next page without counting
+    result = await db.execute(stmt.limit(page_size + 1))
     media_files = result.scalars().all()
+    next_cursor = None
+    if len(media_files) > page_size:
+        media_files = media_files[:page_size]
+        if keyset:
+            next_cursor = encode_cursor(media_files[-1].created_at, media_files[-1].id)
+        else:
+            next_cursor = encode_offset_cursor(position.offset + page_size)
     
-    # Calculate total pages
-    total_pages = (total + page_size - 1) // page_size
+    total = total_pages = None
+    if include_total:
+        count_key = (query, media_type, genre and genre.lower(), year, tuple(sorted(tags or ())))
+        total = await media_counts.count(db, count_key, count_stmt)
+        total_pages = (total + page_size - 1) // page_size
     
     return MediaSearchResponse(
         items=media_files,
         total=total,
         page=page,
         page_size=page_size,
-        total_pages=total_pages
+        total_pages=total_pages,
+        next_cursor=next_cursor
     )
 
 
+@router.get("/facets", response_model=MediaFacets)
+async def get_media_facets(db: AsyncSession = Depends(get_db)):
+    """Counts of available files per media type, genre, year, codec and resolution"""
+    async def load():
+        return MediaFacets(facets=await facet_aggregator.get(db))
+    
+    return cached_response(await response_cache.get_or_set("media:facets", [MEDIA_FACETS], load))
+
+
 @router.get("/{file_id}", response_model=MediaFileWithMetadata)
 async def get_media_file(
     file_id: int,
@@ -85,14 +189,23 @@ async def get_media_file(
     from sqlalchemy import select
     from sqlalchemy.orm import selectinload
     
-    stmt = select(MediaFile).options(selectinload(MediaFile.media_metadata)).where(MediaFile.id == file_id)
-    result = await db.execute(stmt)
-    media_file = result.scalar_one_or_none()
-    
-    if not media_file:
-        raise MediaFileNotFound(str(file_id))
+    async def load():
+        stmt = select(MediaFile).options(selectinload(MediaFile.media_metadata)).where(MediaFile.id == file_id)
+        result = await db.execute(stmt)
+        media_file = result.scalar_one_or_none()
+        
+        if not media_file:
+            raise MediaFileNotFound(str(file_id))
+        
+        return MediaFileWithMetadata.model_validate(media_file)
     
-    return media_file
+    return cached_response(await response_cache.get_or_set(media_file_key(file_id), [MEDIA_FILES], load))
+
+
+@router.post("/scan", response_model=LibraryScanResponse)
+async def scan_library():
+    """Scan the library roots and index new, changed and missing files"""
+    return await library_scanner.scan()
 
 
 @router.post("/upload", response_model=MediaUploadResponse)
@@ -103,67 +216,168 @@ async def upload_media_file(
     """Upload a new media file"""
     # Validate file type
     file_extension = Path(file.filename).suffix.lower()
-    supported_formats = (
-        settings.SUPPORTED_VIDEO_FORMATS +
-        settings.SUPPORTED_AUDIO_FORMATS +
-        settings.SUPPORTED_IMAGE_FORMATS
+    media_type = get_media_type(file_extension)
+    
+    # Stream the upload to a temporary file, hashing as we go
+    temp_path, file_size, file_hash = await stream_upload_to_temp(file)
+    
+    media_file = await store_uploaded_file(
+        db,
+        temp_path=temp_path,
+        filename=file.filename,
+        file_size=file_size,
+        file_hash=file_hash,
+        mime_type=file.content_type,
+        media_type=media_type
     )
     
-    if file_extension not in supported_formats:
-        raise UnsupportedMediaFormat(file_extension)
+    return MediaUploadResponse(
+        file_id=media_file.id,
+        filename=media_file.filename,
+        status="uploaded",
+        message="File uploaded successfully"
+    )
+
+
+@router.post("/uploads", response_model=UploadSessionResponse)
+async def create_upload_session(
+    session_data: UploadSessionCreate
+):
+    """Start a resumable upload"""
+    get_media_type(Path(session_data.filename).suffix.lower())
     
-    # Determine media type
-    if file_extension in settings.SUPPORTED_VIDEO_FORMATS:
-        media_type = "video"
-    elif file_extension in settings.SUPPORTED_AUDIO_FORMATS:
-        media_type = "audio"
-    else:
-        media_type = "image"
+    session = upload_sessions.create(
+        filename=session_data.filename,
+        file_size=session_data.file_size,
+        mime_type=session_data.mime_type or "application/octet-stream"
+    )
+    return _upload_session_response(session)
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str):
+    """Get the byte ranges received so far for a resumable upload"""
+    return _upload_session_response(upload_sessions.get(upload_id))
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Byte offset of this chunk"),
+    chunk_sha256: str = Header(..., alias="X-Chunk-SHA256", description="SHA-256 of the chunk body")
+):
+    """Write one chunk of a resumable upload at the given offset"""
+    session = upload_sessions.get(upload_id)
+    session = await upload_sessions.write_chunk(session, offset, request.stream(), chunk_sha256)
+    return _upload_session_response(session)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=MediaUploadResponse)
+async def complete_upload_session(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Finish a resumable upload and create its media file record"""
+    session = upload_sessions.get(upload_id)
+    media_type = get_media_type(Path(session.filename).suffix.lower())
+    file_hash = await upload_sessions.finalize(session)
     
-    # Create file path
-    file_path = os.path.join(settings.MEDIA_ROOT, file.filename)
+    try:
+        media_file = await store_uploaded_file(
+            db,
+            temp_path=upload_sessions.data_path(upload_id),
+            filename=session.filename,
+            file_size=session.file_size,
+            file_hash=file_hash,
+            mime_type=session.mime_type,
+            media_type=media_type
+        )
+    except HTTPException:
+        # Duplicate content, the data file has already been removed
+        upload_sessions.discard(session)
+        raise
     
-    # Save file
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+    # The data file now lives at its final path, only drop the session state
+    upload_sessions.discard(session, keep_data=True)
     
-    # Calculate file hash
-    file_hash = hashlib.sha256(content).hexdigest()
+    return MediaUploadResponse(
+        file_id=media_file.id,
+        filename=media_file.filename,
+        status="uploaded",
+        message="File uploaded successfully"
+    )
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    """Abort a resumable upload and remove its data"""
+    upload_sessions.discard(upload_sessions.get(upload_id))
+    return {"message": "Upload aborted"}
+
+
+async def store_uploaded_file(
+    db: AsyncSession,
+    temp_path: str,
+    filename: str,
+    file_size: int,
+    file_hash: str,
+    mime_type: Optional[str],
+    media_type: str
+) -> MediaFile:
+    """Move a fully received upload into MEDIA_ROOT and record it"""
+    from sqlalchemy import select
     
     # Check if file already exists
-    from sqlalchemy import select
     existing_file = await db.execute(
         select(MediaFile).where(MediaFile.file_hash == file_hash)
     )
     if existing_file.scalar_one_or_none():
         # File already exists, delete the uploaded file
-        os.remove(file_path)
+        discard_temp(temp_path)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="File with this content already exists"
         )
     
+    # Move the file into place only once it has been accepted; a rename
+    # unless it comes from an upload spool on another filesystem
+    file_path = os.path.join(settings.MEDIA_ROOT, filename)
+    await asyncio.to_thread(shutil.move, temp_path, file_path)
+    
     # Create database record
     media_file = MediaFile(
-        filename=file.filename,
-        original_filename=file.filename,
+        filename=filename,
+        original_filename=filename,
         file_path=file_path,
-        file_size=len(content),
+        file_size=file_size,
+        file_mtime=os.stat(file_path).st_mtime,
         file_hash=file_hash,
-        mime_type=file.content_type or "application/octet-stream",
+        mime_type=mime_type or "application/octet-stream",
         media_type=media_type
     )
     
-    db.add(media_file)
+    async with facet_aggregator.track(db, MediaFile.file_path == file_path):
+        db.add(media_file)
     await db.commit()
     await db.refresh(media_file)
+    media_counts.invalidate()
+    await facet_aggregator.invalidate()
+    await invalidate_media()
     
-    return MediaUploadResponse(
-        file_id=media_file.id,
-        filename=media_file.filename,
-        status="uploaded",
-        message="File uploaded successfully"
+    return media_file
+
+
+def _upload_session_response(session: UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        upload_id=session.upload_id,
+        filename=session.filename,
+        file_size=session.file_size,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        bytes_received=session.bytes_received,
+        received=session.received,
+        created_at=session.created_at,
+        updated_at=session.updated_at
     )
 
 
@@ -188,19 +402,23 @@ async def delete_media_file(
         os.remove(media_file.file_path)
     
     # Delete database record
-    await db.delete(media_file)
+    async with facet_aggregator.track(db, MediaFile.id == file_id):
+        await db.delete(media_file)
     await db.commit()
+    media_counts.invalidate()
+    await facet_aggregator.invalidate()
+    await invalidate_media([file_id])
     
     return {"message": "Media file deleted successfully"}
 
 
-@router.get("/{file_id}/stream")
+@router.api_route("/{file_id}/stream", methods=["GET", "HEAD"])
 async def stream_media_file(
     file_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db)
 ):
-    """Stream a media file"""
-    from fastapi.responses import FileResponse
+    """Stream a media file, honouring Range and conditional request headers"""
     from sqlalchemy import select
     
     # Get media file
@@ -211,14 +429,298 @@ async def stream_media_file(
     if not media_file:
         raise MediaFileNotFound(str(file_id))
     
-    if not os.path.exists(media_file.file_path):
+    try:
+        stat_result = os.stat(media_file.file_path)
+    except FileNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Media file not found on disk"
         )
     
-    return FileResponse(
-        path=media_file.file_path,
+    if settings.X_ACCEL_REDIRECT_ENABLED:
+        # nginx serves the bytes once we have found and authorized the file
+        response = build_offload_response(
+            media_file.file_path,
+            settings.MEDIA_ROOT,
+            settings.X_ACCEL_MEDIA_PREFIX,
+            media_type=media_file.mime_type,
+            filename=media_file.filename
+        )
+        if response is not None:
+            return response
+    
+    return build_file_response(
+        media_file.file_path,
+        stat_result,
+        request.headers,
+        method=request.method,
         media_type=media_file.mime_type,
         filename=media_file.filename
     )
+
+
+@router.get("/{file_id}/live")
+async def stream_live_transcode(
+    file_id: int,
+    quality: str = Query("720p", description="Profile name, e.g. 720p"),
+    start: float = Query(0, ge=0, description="Seek offset in seconds"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Transcode on the fly from ``start`` and stream fragmented MP4
+
+    Requests close to the start of a running session for the same file and
+    quality share it; X-Transcode-Start gives the offset the stream actually
+    begins at.
+    """
+    from sqlalchemy import select
+    from fastapi.responses import StreamingResponse
+    
+    stmt = select(MediaFile).where(MediaFile.id == file_id)
+    result = await db.execute(stmt)
+    media_file = result.scalar_one_or_none()
+    
+    if not media_file:
+        raise MediaFileNotFound(str(file_id))
+    if media_file.media_type != "video":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only video files can be transcoded"
+        )
+    
+    session = await live_transcoder.open(media_file, quality, start)
+    await session.wait_started()
+    
+    return StreamingResponse(
+        session.stream(),
+        media_type="video/mp4",
+        headers={
+            "x-transcode-session": session.id,
+            "x-transcode-start": f"{session.start:.3f}",
+            "cache-control": "no-store"
+        }
+    )
+
+
+@router.delete("/live/{session_id}")
+async def stop_live_transcode(session_id: str):
+    """Stop a live transcode session, e.g. when the player seeks elsewhere"""
+    if not await live_transcoder.close(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Live transcode session not found"
+        )
+    return {"message": "Live transcode session stopped"}
+
+
+@router.api_route("/{file_id}/thumbnail", methods=["GET", "HEAD"])
+async def get_media_thumbnail(
+    file_id: int,
+    request: Request,
+    variant: str = Query(THUMBNAIL, pattern=f"^({THUMBNAIL}|{POSTER})$", description="thumbnail or poster"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Serve a thumbnail or poster, rendering it first if it is not cached"""
+    from sqlalchemy import select
+    
+    stmt = select(MediaFile).where(MediaFile.id == file_id)
+    result = await db.execute(stmt)
+    media_file = result.scalar_one_or_none()
+    
+    if not media_file:
+        raise MediaFileNotFound(str(file_id))
+    
+    keys = await _ensure_artwork(db, media_file)
+    return _artwork_response(request, keys[variant], "image/jpeg")
+
+
+@router.api_route("/{file_id}/image", methods=["GET", "HEAD"])
+async def get_media_image(
+    file_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=settings.IMAGE_MAX_DIMENSION, description="Maximum width"),
+    h: Optional[int] = Query(None, ge=1, le=settings.IMAGE_MAX_DIMENSION, description="Maximum height"),
+    fmt: Optional[str] = Query(None, pattern="^(jpeg|webp)$", description="jpeg or webp; negotiated from Accept if omitted"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Serve the artwork resized to fit w x h, rendering and caching it on first request"""
+    from sqlalchemy import select
+    
+    stmt = select(MediaFile).where(MediaFile.id == file_id)
+    result = await db.execute(stmt)
+    media_file = result.scalar_one_or_none()
+    
+    if not media_file:
+        raise MediaFileNotFound(str(file_id))
+    
+    image_format = fmt or ("webp" if "image/webp" in request.headers.get("accept", "") else "jpeg")
+    size = derivative_size(w, h) if w or h else tuple(settings.THUMBNAIL_SIZE)
+    
+    await _ensure_artwork(db, media_file)
+    try:
+        key = await thumbnail_generator.derivative(media_file, size, image_format)
+    except MediaProcessingError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No artwork available for this media file"
+        )
+    
+    response = _artwork_response(request, key, IMAGE_FORMATS[image_format][2])
+    if fmt is None:
+        response.headers["vary"] = "Accept"
+    return response
+
+
+async def _ensure_artwork(db: AsyncSession, media_file: MediaFile) -> dict:
+    """Render missing thumbnail/poster renditions and record their cache keys"""
+    try:
+        keys = await thumbnail_generator.ensure(media_file)
+    except MediaProcessingError:
+        # e.g. audio without cover art
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No artwork available for this media file"
+        )
+    
+    if media_file.thumbnail_path != keys[THUMBNAIL] or media_file.poster_path != keys[POSTER]:
+        media_file.thumbnail_path = keys[THUMBNAIL]
+        media_file.poster_path = keys[POSTER]
+        await db.commit()
+        await invalidate_media([media_file.id])
+    return keys
+
+
+def _artwork_response(request: Request, key: str, media_type: str):
+    path = thumbnail_generator.cache.path(key)
+    if settings.X_ACCEL_REDIRECT_ENABLED:
+        response = build_offload_response(
+            path,
+            settings.THUMBNAILS_ROOT,
+            settings.X_ACCEL_THUMBNAILS_PREFIX,
+            media_type=media_type
+        )
+        if response is not None:
+            return response
+    
+    return build_file_response(
+        path,
+        os.stat(path),
+        request.headers,
+        method=request.method,
+        media_type=media_type
+    )
+
+
+@router.post("/{file_id}/transcodes", response_model=TranscodedFileSchema)
+async def request_transcode(
+    file_id: int,
+    transcode_request: TranscodeRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Queue a rendition ahead of background backfill jobs"""
+    from sqlalchemy import select
+    
+    stmt = select(MediaFile.id, MediaFile.media_type).where(MediaFile.id == file_id)
+    media_file = (await db.execute(stmt)).one_or_none()
+    
+    if not media_file:
+        raise MediaFileNotFound(str(file_id))
+    if media_file.media_type != "video":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only video files can be transcoded"
+        )
+    
+    return await enqueue(db, file_id, transcode_request.quality, transcode_request.format, priority=PRIORITY_USER)
+
+
+@router.get("/{file_id}/transcodes", response_model=List[TranscodedFileSchema])
+async def get_transcodes(
+    file_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """List the renditions of a media file with their queue status and progress"""
+    from sqlalchemy import select
+    
+    stmt = select(TranscodedFile).where(TranscodedFile.original_file_id == file_id).order_by(TranscodedFile.id)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+@router.get("/{file_id}/hls/master.m3u8")
+async def get_hls_master_playlist(
+    file_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """HLS master playlist listing one variant per offered quality"""
+    media_file = await _get_hls_source(db, file_id)
+    return Response(master_playlist(media_file), media_type=PLAYLIST_MEDIA_TYPE)
+
+
+@router.get("/{file_id}/hls/{quality}/index.m3u8")
+async def get_hls_media_playlist(
+    file_id: int,
+    quality: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """HLS media playlist with fixed-length segments covering the whole file"""
+    media_file = await _get_hls_source(db, file_id, quality)
+    return Response(media_playlist(media_file.duration), media_type=PLAYLIST_MEDIA_TYPE)
+
+
+@router.get("/{file_id}/hls/{quality}/{segment}.ts")
+async def get_hls_segment(
+    file_id: int,
+    quality: str,
+    segment: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """One MPEG-TS segment, from the segment cache or rendered on demand"""
+    media_file = await _get_hls_source(db, file_id, quality)
+    key = await hls_packager.segment(db, media_file, quality, segment)
+    path = hls_packager.cache.path(key)
+    return build_file_response(
+        path,
+        os.stat(path),
+        request.headers,
+        method=request.method,
+        media_type=SEGMENT_MEDIA_TYPE
+    )
+
+
+async def _get_hls_source(db: AsyncSession, file_id: int, quality: Optional[str] = None) -> MediaFile:
+    """Load a video for HLS, probing its duration if metadata extraction has not run yet
+
+    With ``quality``, also check it is one of the variants the master
+    playlist offers for this video.
+    """
+    from sqlalchemy import select
+    
+    if quality is not None and quality not in PROFILES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown HLS quality {quality}")
+    
+    stmt = select(MediaFile).where(MediaFile.id == file_id)
+    result = await db.execute(stmt)
+    media_file = result.scalar_one_or_none()
+    
+    if not media_file:
+        raise MediaFileNotFound(str(file_id))
+    if media_file.media_type != "video":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only video files can be streamed with HLS"
+        )
+    
+    if not media_file.duration:
+        metadata = await probe_media(media_file.file_path)
+        if not metadata["duration"]:
+            raise MediaProcessingError("Cannot determine the duration of this media file")
+        media_file.duration = metadata["duration"]
+        media_file.width = media_file.width or metadata["width"]
+        media_file.height = media_file.height or metadata["height"]
+        await db.commit()
+        await invalidate_media([media_file.id])
+    
+    if quality is not None and quality not in variant_qualities(media_file.height):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Quality {quality} is not offered for this video")
+    return media_file
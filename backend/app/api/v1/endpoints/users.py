@@ -11,6 +11,7 @@ from app.core.exceptions import UserNotFound
 from app.models.user import User
 from app.schemas.user import UserResponse, UserUpdate
 from app.api.v1.endpoints.auth import get_current_user_from_token
+from app.services.user_cache import user_cache
 
 router = APIRouter()
 
@@ -30,20 +31,24 @@ async def update_current_user(
     db: AsyncSession = Depends(get_db)
 ):
     """Update current user information"""
+    # The authenticated user may be a cached copy outside this session
+    user = await db.get(User, current_user.id)
+    
     # Update user fields
     if user_update.username is not None:
-        current_user.username = user_update.username
+        user.username = user_update.username
     if user_update.email is not None:
-        current_user.email = user_update.email
+        user.email = user_update.email
     if user_update.full_name is not None:
-        current_user.full_name = user_update.full_name
+        user.full_name = user_update.full_name
     if user_update.is_active is not None:
-        current_user.is_active = user_update.is_active
+        user.is_active = user_update.is_active
     
     await db.commit()
-    await db.refresh(current_user)
+    await db.refresh(user)
+    await user_cache.invalidate(user.id)
     
-    return current_user
+    return user
 
 
 @router.get("/{user_id}", response_model=UserResponse)
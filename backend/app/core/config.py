@@ -32,6 +32,23 @@ class Settings(BaseSettings):
     THUMBNAILS_ROOT: str = "/app/thumbnails"
     TRANSCODED_ROOT: str = "/app/transcoded"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024 * 1024  # 10GB
+    UPLOAD_SPOOL_ROOT: str = "/app/uploads"  # resumable uploads in progress, never served; best on MEDIA_ROOT's filesystem
+    
+    # Streaming offload: FastAPI authorizes, nginx sends the bytes (X-Accel-Redirect)
+    X_ACCEL_REDIRECT_ENABLED: bool = False
+    X_ACCEL_MEDIA_PREFIX: str = "/_protected/media/"
+    X_ACCEL_THUMBNAILS_PREFIX: str = "/_protected/thumbnails/"
+    X_ACCEL_TRANSCODED_PREFIX: str = "/_protected/transcoded/"
+    
+    # Library Scanner (empty LIBRARY_ROOTS scans MEDIA_ROOT)
+    LIBRARY_ROOTS: List[str] = []
+    LIBRARY_SCAN_INTERVAL: int = 3600  # seconds, 0 disables periodic scans
+    LIBRARY_SCAN_BATCH_SIZE: int = 500
+    
+    # Live Library Watcher (inotify, with polling fallback)
+    WATCHER_ENABLED: bool = True
+    WATCHER_DEBOUNCE_SECONDS: float = 2.0
+    WATCHER_POLL_INTERVAL: int = 30  # seconds, used when inotify is unavailable
     
     # Supported Media Formats
     SUPPORTED_VIDEO_FORMATS: List[str] = [
@@ -47,26 +64,87 @@ class Settings(BaseSettings):
     # FFmpeg Settings
     FFMPEG_PATH: str = "ffmpeg"
     FFPROBE_PATH: str = "ffprobe"
+    FFPROBE_TIMEOUT: int = 30  # seconds per file
+    
+    # Metadata Extraction
+    METADATA_WORKERS: int = 0  # concurrent ffprobe processes, 0 uses the CPU count
+    METADATA_BATCH_SIZE: int = 200
+    METADATA_POLL_INTERVAL: int = 10  # seconds to wait when nothing is pending
+    
+    # Library Facets
+    FACETS_REBUILD_INTERVAL: int = 3600  # seconds between full recounts that repair drift in the incremental counts
     
     # Thumbnail Settings
     THUMBNAIL_SIZE: tuple = (320, 180)
+    POSTER_SIZE: tuple = (1280, 720)
     THUMBNAIL_QUALITY: int = 85
+    THUMBNAIL_WORKERS: int = 0  # concurrent renders, 0 uses the CPU count
+    THUMBNAIL_BATCH_SIZE: int = 50
+    THUMBNAIL_TIMEOUT: int = 60  # seconds per ffmpeg frame grab
+    THUMBNAIL_CACHE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024  # 5GB, 0 disables pruning
+    IMAGE_MAX_DIMENSION: int = 2048  # largest width/height served by /media/{id}/image
+    IMAGE_SIZE_STEPS: List[int] = [160, 320, 480, 640, 960, 1280, 1920, 2048]  # requested sizes round up to these
     
     # Transcoding Settings
     TRANSCODE_QUALITY: str = "medium"  # low, medium, high
     TRANSCODE_FORMAT: str = "mp4"
+    TRANSCODE_WORKERS: int = 0  # concurrent ffmpeg jobs, 0 uses a quarter of the CPU count
+    TRANSCODE_PROFILES: List[str] = ["720p", "1080p"]  # backfilled for larger videos, empty disables
+    TRANSCODE_MAX_ATTEMPTS: int = 3
+    TRANSCODE_POLL_INTERVAL: int = 30  # seconds between queue checks when idle
+    TRANSCODE_PROGRESS_INTERVAL: float = 2.0  # seconds between progress writes
+    TRANSCODE_LEASE_TIMEOUT: int = 120  # seconds without a heartbeat before a running job is requeued
+    TRANSCODE_BACKFILL_INTERVAL: int = 600
+    TRANSCODE_BACKFILL_BATCH_SIZE: int = 100
+    
+    # HLS Packaging
+    HLS_SEGMENT_SECONDS: int = 6
+    HLS_CACHE_ROOT: str = ""  # empty uses TRANSCODED_ROOT/hls
+    HLS_CACHE_MAX_BYTES: int = 20 * 1024 * 1024 * 1024  # 20GB, 0 disables pruning
+    HLS_WORKERS: int = 0  # concurrent segment renders, 0 uses half the CPU count
+    HLS_PREFETCH_SEGMENTS: int = 2  # segments rendered ahead of the player
+    HLS_SEGMENT_TIMEOUT: int = 120
+    
+    # Live Transcoding
+    LIVE_TRANSCODE_MAX_SESSIONS: int = 0  # per host, 0 uses half the CPU count
+    LIVE_TRANSCODE_IDLE_TIMEOUT: int = 30  # seconds without a reader before ffmpeg is killed
+    LIVE_TRANSCODE_REUSE_WINDOW: int = 30  # seconds after a session start that can join it
+    LIVE_TRANSCODE_MAX_AHEAD_BYTES: int = 32 * 1024 * 1024  # output buffered ahead of the furthest reader
     
     # Authentication
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 15  # short-lived; clients renew through POST /auth/refresh
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     ALGORITHM: str = "HS256"
+    PASSWORD_HASH_WORKERS: int = 0  # threads hashing passwords, 0 uses half the CPU count
+    PASSWORD_HASH_MAX_PENDING: int = 64  # hashes queued or running before logins are refused
+    LOGIN_MAX_CONCURRENT_PER_USER: int = 2
+    LOGIN_MAX_CONCURRENT_PER_IP: int = 8
+    TOKEN_VERIFY_CACHE_TTL: int = 60  # seconds a worker reuses a verified token, bounds cross-worker logout delay
+    TOKEN_VERIFY_CACHE_MAX_ENTRIES: int = 10000
     
     # Pagination
     DEFAULT_PAGE_SIZE: int = 20
     MAX_PAGE_SIZE: int = 100
+    MEDIA_COUNT_CACHE_TTL: int = 30  # seconds a list total may lag behind scans
     
     # Cache
     CACHE_TTL: int = 3600  # 1 hour
+    RESPONSE_CACHE_ENABLED: bool = True
+    CACHE_LOCAL_MAX_ENTRIES: int = 2048  # per-process fallback while Redis is down
+    CACHE_REDIS_TIMEOUT: float = 0.25  # seconds before a Redis call counts as failed
+    CACHE_RETRY_INTERVAL: int = 30  # seconds to skip Redis after a failure
+    USER_CACHE_TTL: int = 60  # seconds a worker reuses an authenticated user
+    USER_CACHE_MAX_ENTRIES: int = 1024
+    USER_CACHE_SHARED: bool = True  # also share cached users through Redis
+    USER_CACHE_SHARED_TTL: int = 300
+    
+    # Lightweight server storage (media_main.py)
+    STORE_BACKEND: str = "log"  # log persists users, tokens and media; memory forgets them on restart
+    STORE_ROOT: str = "/app/data"
+    STORE_COMMIT_INTERVAL: float = 0.05  # seconds of changes gathered into one fsync
+    STORE_COMPACT_MIN_BYTES: int = 16 * 1024 * 1024  # log size before it may be folded into the snapshot
+    TOKEN_SWEEP_INTERVAL: int = 60  # seconds between removals of expired login tokens
+    TOKEN_MAX_PER_USER: int = 20  # logging in once more revokes the user's oldest token
     
     # Background Tasks
     CELERY_BROKER_URL: str = "redis://localhost:6379/0"
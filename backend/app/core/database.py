@@ -2,9 +2,14 @@
 Database configuration and session management
 """
 
+from sqlalchemy import BigInteger, Integer, UniqueConstraint, bindparam, inspect, literal, text, update
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Create async engine
 engine = create_async_engine(
@@ -26,6 +31,115 @@ class Base(DeclarativeBase):
     pass
 
 
+# Run once, right after the column is added to a table that already had rows
+COLUMN_BACKFILLS = {
+    # Renditions from before the job queue: finished ones must not be transcoded again
+    ("transcoded_files", "status"): "UPDATE transcoded_files SET status = CASE WHEN is_ready THEN 'completed' ELSE 'queued' END",
+}
+
+
+def create_schema(connection):
+    """Create extensions, tables, and indexes added to models after their table existed"""
+    if connection.dialect.name == "postgresql":
+        # Trigram indexes for typo-tolerant search
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    Base.metadata.create_all(connection)
+    upgrade_tables(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def upgrade_tables(connection):
+    """Bring tables created by older versions up to their models
+
+    create_all never alters an existing table, so columns added to a model
+    later are added here (with the model's default for existing rows),
+    Integer columns since made BigInteger are widened, columns since made
+    NOT NULL get their server default where empty and the constraint, and
+    missing unique constraints are created as unique indexes. Each step
+    checks the live
+    schema first, so this is safe to run on every startup.
+    """
+    inspector = inspect(connection)
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        table_name = preparer.format_table(table)
+        existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            column_name = preparer.format_column(column)
+            if current is None:
+                ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+                    ddl += f" DEFAULT {default}"
+                connection.execute(text(ddl))
+                backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                if backfill:
+                    connection.execute(text(backfill))
+                logger.info("Added column %s.%s", table.name, column.name)
+            elif (
+                dialect.name == "postgresql"
+                and isinstance(column.type, BigInteger)
+                and isinstance(current["type"], Integer)
+                and not isinstance(current["type"], BigInteger)
+            ):
+                connection.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE {column.type.compile(dialect=dialect)}"))
+                logger.info("Widened column %s.%s to %s", table.name, column.name, column.type)
+            elif (
+                dialect.name == "postgresql"
+                and not column.nullable
+                and current["nullable"]
+                and column.server_default is not None
+            ):
+                with connection.begin_nested():
+                    connection.execute(update(table).where(column.is_(None)).values({column.name: column.server_default.arg}))
+                    connection.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL"))
+                logger.info("Made column %s.%s NOT NULL", table.name, column.name)
+
+        unique_names = {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+        unique_names |= {index["name"] for index in inspector.get_indexes(table.name) if index.get("unique")}
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or constraint.name is None or constraint.name in unique_names:
+                continue
+            columns = ", ".join(preparer.format_column(column) for column in constraint.columns)
+            try:
+                # Savepoint, so rows that already violate it do not abort the rest of the upgrade
+                with connection.begin_nested():
+                    connection.execute(text(f"CREATE UNIQUE INDEX {preparer.quote(constraint.name)} ON {table_name} ({columns})"))
+            except DBAPIError as e:
+                logger.warning("Could not add unique constraint %s: %s", constraint.name, e)
+
+
+def dialect_insert(db: AsyncSession, table):
+    """INSERT for ``table`` with the dialect's ON CONFLICT clauses"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+async def update_rows(db: AsyncSession, model, rows: list):
+    """UPDATE rows by ``id`` from dicts of column values; the caller commits
+
+    Unlike the ORM bulk update, ids that no longer exist (deleted while a
+    batch was in flight) are skipped instead of failing the whole batch.
+    Rows are grouped by the columns they set, one executemany per group.
+    """
+    table = model.__table__
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(key for key in row if key != "id")), []).append(row)
+    for columns, group in groups.items():
+        await db.execute(
+            update(table).where(table.c.id == bindparam("row_id")),
+            [{"row_id": row["id"], **{column: row[column] for column in columns}} for row in group]
+        )
+
+
 async def get_db() -> AsyncSession:
     """Dependency to get database session"""
     async with AsyncSessionLocal() as session:
@@ -37,6 +37,39 @@ class UnsupportedMediaFormat(Watch1Exception):
         )
 
 
+class FileTooLarge(Watch1Exception):
+    """Raised when an upload exceeds the configured size limit"""
+    
+    def __init__(self, max_size: int):
+        super().__init__(
+            detail=f"File exceeds maximum upload size of {max_size} bytes",
+            error_code="FILE_TOO_LARGE",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+
+
+class UploadSessionNotFound(Watch1Exception):
+    """Raised when a resumable upload session is not found"""
+    
+    def __init__(self, upload_id: str):
+        super().__init__(
+            detail=f"Upload session {upload_id} not found",
+            error_code="UPLOAD_SESSION_NOT_FOUND",
+            status_code=status.HTTP_404_NOT_FOUND
+        )
+
+
+class UploadChunkRejected(Watch1Exception):
+    """Raised when a resumable upload chunk or finalize request is invalid"""
+    
+    def __init__(self, detail: str):
+        super().__init__(
+            detail=detail,
+            error_code="UPLOAD_CHUNK_REJECTED",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
 class MediaProcessingError(Watch1Exception):
     """Raised when media processing fails"""
     
@@ -48,6 +81,17 @@ class MediaProcessingError(Watch1Exception):
         )
 
 
+class TranscodeCapacityReached(Watch1Exception):
+    """Raised when every live transcode slot is busy"""
+    
+    def __init__(self, max_sessions: int):
+        super().__init__(
+            detail=f"All {max_sessions} live transcode sessions are in use, try again shortly",
+            error_code="TRANSCODE_CAPACITY_REACHED",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+
 class UserNotFound(Watch1Exception):
     """Raised when user is not found"""
     
@@ -59,6 +103,17 @@ class UserNotFound(Watch1Exception):
         )
 
 
+class UserAlreadyExists(Watch1Exception):
+    """Raised when a username or email is already registered"""
+    
+    def __init__(self, detail: str = "User already registered"):
+        super().__init__(
+            detail=detail,
+            error_code="USER_ALREADY_EXISTS",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
 class AuthenticationError(Watch1Exception):
     """Raised when authentication fails"""
     
@@ -70,6 +125,17 @@ class AuthenticationError(Watch1Exception):
         )
 
 
+class TooManyLoginAttempts(Watch1Exception):
+    """Raised when too many logins are already in progress"""
+    
+    def __init__(self, detail: str = "Too many login attempts in progress, try again shortly"):
+        super().__init__(
+            detail=detail,
+            error_code="TOO_MANY_LOGIN_ATTEMPTS",
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+
 class AuthorizationError(Watch1Exception):
     """Raised when authorization fails"""
     
@@ -2,7 +2,7 @@
 Media file models for the media library
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, Float, ForeignKey, JSON, Index, UniqueConstraint, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -12,12 +12,28 @@ class MediaFile(Base):
     """Media file model"""
     
     __tablename__ = "media_files"
+    __table_args__ = (
+        # Keyset pagination of the library, newest first (created_at is NOT
+        # NULL so plain ASC/DESC orders match these indexes both ways)
+        Index("ix_media_files_created_at_id", "created_at", "id"),
+        Index("ix_media_files_type_created_at_id", "media_type", "created_at", "id"),
+        # Typo-tolerant and substring filename search (pg_trgm)
+        Index(
+            "ix_media_files_filename_trgm", "filename",
+            postgresql_using="gin", postgresql_ops={"filename": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_media_files_original_filename_trgm", "original_filename",
+            postgresql_using="gin", postgresql_ops={"original_filename": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
     original_filename = Column(String(255), nullable=False)
     file_path = Column(String(500), nullable=False, unique=True)
-    file_size = Column(Integer, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    file_mtime = Column(Float)  # st_mtime when last scanned, for incremental rescans
     file_hash = Column(String(64), unique=True, index=True)  # SHA-256 hash
     mime_type = Column(String(100), nullable=False)
     media_type = Column(String(20), nullable=False)  # video, audio, image
@@ -40,7 +56,7 @@ class MediaFile(Base):
     processing_status = Column(String(20), default="pending")  # pending, processing, completed, failed
     
     # Timestamps
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     last_accessed = Column(DateTime(timezone=True))
     
@@ -52,10 +68,26 @@ class MediaFile(Base):
     playlist_items = relationship("PlaylistItem", back_populates="media_file")
 
 
+# Full-text document for library search; queries must use this exact
+# expression for PostgreSQL to answer them from ix_media_metadata_search
+MEDIA_INFO_DOCUMENT = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '') || ' ' "
+    "|| coalesce(\"cast\"::text, '') || ' ' || coalesce(tags::text, ''))"
+)
+
+
 class MediaInfo(Base):
     """Media information model"""
     
     __tablename__ = "media_metadata"
+    __table_args__ = (
+        Index("ix_media_metadata_search", text(MEDIA_INFO_DOCUMENT), postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index(
+            "ix_media_metadata_title_trgm", "title",
+            postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+        Index("ix_media_metadata_tags", text("(tags::jsonb)"), postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     media_file_id = Column(Integer, ForeignKey("media_files.id"), unique=True)
@@ -87,17 +119,31 @@ class MediaInfo(Base):
     media_file = relationship("MediaFile", back_populates="media_metadata")
 
 
+class MediaFacetCount(Base):
+    """Number of available media files per facet value, rebuilt after library changes"""
+    
+    __tablename__ = "media_facet_counts"
+    
+    facet = Column(String(20), primary_key=True)  # media_type, genre, year, codec, resolution
+    value = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
 class TranscodedFile(Base):
     """Transcoded media file model"""
     
     __tablename__ = "transcoded_files"
+    __table_args__ = (
+        UniqueConstraint("original_file_id", "quality", "format", name="uq_transcoded_rendition"),
+        Index("ix_transcoded_files_queue", "status", "priority", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     original_file_id = Column(Integer, ForeignKey("media_files.id"))
     file_path = Column(String(500), nullable=False)
     quality = Column(String(20), nullable=False)  # 720p, 1080p, 4k, etc.
     format = Column(String(20), nullable=False)  # mp4, webm, etc.
-    file_size = Column(Integer)
+    file_size = Column(BigInteger)
     duration = Column(Float)
     width = Column(Integer)
     height = Column(Integer)
@@ -107,8 +153,17 @@ class TranscodedFile(Base):
     is_ready = Column(Boolean, default=False)
     processing_progress = Column(Integer, default=0)  # 0-100
     
+    # Job queue
+    status = Column(String(20), default="queued")  # queued, running, completed, failed
+    priority = Column(Integer, default=0)  # higher runs first
+    attempts = Column(Integer, default=0)
+    error_message = Column(Text)
+    worker_id = Column(String(100))  # process holding the job while it runs
+    heartbeat_at = Column(DateTime(timezone=True))  # lease renewed by that process
+    
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
     completed_at = Column(DateTime(timezone=True))
     
     # Relationships
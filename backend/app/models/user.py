@@ -2,7 +2,7 @@
 User model for authentication and authorization
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -30,3 +30,18 @@ class User(Base):
     playlists = relationship("Playlist", back_populates="owner")
     watch_history = relationship("WatchHistory", back_populates="user")
     ratings = relationship("Rating", back_populates="user")
+
+
+class RefreshToken(Base):
+    """Refresh token; each use spends it and issues the next in its family"""
+    
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)  # SHA-256 of the token
+    family_id = Column(String(32), index=True, nullable=False)  # shared by every rotation of one login
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used_at = Column(DateTime(timezone=True))  # set when rotated
+    revoked_at = Column(DateTime(timezone=True))  # set for the whole family on logout or reuse
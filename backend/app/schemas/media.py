@@ -33,7 +33,7 @@ class MediaFile(MediaFileBase):
     """Schema for media file response"""
     id: int
     file_path: str
-    file_hash: str
+    file_hash: Optional[str] = None
     duration: Optional[float] = None
     width: Optional[int] = None
     height: Optional[int] = None
@@ -120,13 +120,23 @@ class TranscodedFile(TranscodedFileBase):
     file_path: str
     is_ready: bool
     processing_progress: int
+    status: str
+    priority: int
+    error_message: Optional[str] = None
     created_at: datetime
+    started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
 
+class TranscodeRequest(BaseModel):
+    """Schema for requesting a transcoded rendition"""
+    quality: str = Field(..., description="Profile name, e.g. 720p or 1080p")
+    format: Optional[str] = Field(None, description="mp4 or webm, defaults to TRANSCODE_FORMAT")
+
+
 class MediaSearchRequest(BaseModel):
     """Schema for media search request"""
     query: Optional[str] = None
@@ -143,10 +153,22 @@ class MediaSearchRequest(BaseModel):
 class MediaSearchResponse(BaseModel):
     """Schema for media search response"""
     items: List[MediaFileWithMetadata]
-    total: int
+    total: Optional[int] = None
     page: int
     page_size: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+
+class FacetValue(BaseModel):
+    """Schema for one facet value and how many files have it"""
+    value: str
+    count: int
+
+
+class MediaFacets(BaseModel):
+    """Schema for library facet counts, keyed by facet name"""
+    facets: Dict[str, List[FacetValue]]
 
 
 class MediaUploadResponse(BaseModel):
@@ -155,3 +177,33 @@ class MediaUploadResponse(BaseModel):
     filename: str
     status: str
     message: str
+
+
+class UploadSessionCreate(BaseModel):
+    """Schema for starting a resumable upload"""
+    filename: str
+    file_size: int = Field(ge=0)
+    mime_type: Optional[str] = None
+
+
+class UploadSessionResponse(BaseModel):
+    """Schema for resumable upload state"""
+    upload_id: str
+    filename: str
+    file_size: int
+    chunk_size: int
+    bytes_received: int
+    received: List[List[int]]
+    created_at: datetime
+    updated_at: datetime
+
+
+class LibraryScanResponse(BaseModel):
+    """Schema for library scan results"""
+    roots: List[str]
+    scanned: int
+    added: int
+    updated: int
+    unchanged: int
+    missing: int
+    duration: float
@@ -46,6 +46,13 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: Optional[str] = None
+    refresh_expires_in: Optional[int] = None
+
+
+class RefreshRequest(BaseModel):
+    """Schema for exchanging or revoking a refresh token"""
+    refresh_token: str
 
 
 class TokenData(BaseModel):
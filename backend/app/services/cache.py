@@ -0,0 +1,310 @@
+"""
+Caching: an in-process LRU, a shared Redis cache, and tagged response caching on top
+"""
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Set
+import json
+import time
+import asyncio
+import logging
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """In-process mapping bounded by entry count, with per-entry expiry"""
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CacheUnavailable(Exception):
+    """The shared cache could not be reached"""
+
+
+class SharedCache:
+    """Redis shared by every worker, stepping aside while it is unreachable
+
+    After a failed call the cache reports itself unavailable for
+    CACHE_RETRY_INTERVAL seconds instead of making every request wait on a
+    connection timeout. ``client`` can be any object with the async
+    get/mget/set/incr/delete methods of ``redis.asyncio.Redis``, such as a
+    fake for tests.
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None, retry_interval: Optional[float] = None):
+        self.url = url or settings.REDIS_URL
+        self.retry_interval = settings.CACHE_RETRY_INTERVAL if retry_interval is None else retry_interval
+        self._client = client
+        self._down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = Redis.from_url(
+                self.url,
+                socket_timeout=settings.CACHE_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.CACHE_REDIS_TIMEOUT
+            )
+        return self._client
+
+    async def _call(self, method: str, *args, **kwargs):
+        if not self.available:
+            raise CacheUnavailable()
+        try:
+            return await getattr(self._get_client(), method)(*args, **kwargs)
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            if self.available:
+                logger.warning("Shared cache unavailable, retrying in %ss: %s", self.retry_interval, e)
+            self._down_until = time.monotonic() + self.retry_interval
+            raise CacheUnavailable() from e
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._call("get", key)
+
+    async def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return await self._call("mget", keys)
+
+    async def set(self, key: str, value, ttl: Optional[float] = None, only_if_missing: bool = False) -> bool:
+        px = int(ttl * 1000) if ttl else None
+        return bool(await self._call("set", key, value, px=px, nx=only_if_missing))
+
+    async def incr(self, key: str) -> int:
+        return await self._call("incr", key)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._call("delete", *keys)
+
+    async def close(self):
+        if self._client is not None:
+            try:
+                await self._client.aclose()
+            except (RedisError, OSError, AttributeError):
+                pass
+
+
+def cached_response(body: bytes) -> Response:
+    """Send an already serialized JSON body as is"""
+    return Response(content=body, media_type="application/json")
+
+
+def serialize(value: Any) -> bytes:
+    if isinstance(value, BaseModel):
+        return value.model_dump_json().encode()
+    return json.dumps(jsonable_encoder(value), separators=(",", ":")).encode()
+
+
+class ResponseCache:
+    """Serialized responses shared through Redis, with tag invalidation
+
+    Each response is serialized once and stored with the versions its tags
+    had when it was computed; invalidating a tag increments its version, so
+    a lookup (one MGET of the entry and its tag versions) treats older
+    entries as misses without having to find and delete them. Specific
+    entries can also be dropped by key.
+
+    Only one request per process computes a missing entry, and across
+    workers a short Redis lock makes the others wait for its result rather
+    than all querying the database at once. While Redis is down, entries
+    and tag versions live in a per-process LRU, and invalidations are
+    replayed to Redis once it is back so it never serves what was dropped
+    in the meantime.
+    """
+
+    lock_timeout = 5.0
+    lock_poll_interval = 0.05
+
+    def __init__(
+        self,
+        shared: Optional[SharedCache] = None,
+        ttl: Optional[float] = None,
+        local_max_entries: Optional[int] = None,
+        prefix: str = "cache:",
+        enabled: Optional[bool] = None
+    ):
+        self.shared = shared or SharedCache()
+        self.ttl = ttl or settings.CACHE_TTL
+        self.local = LRUCache(local_max_entries or settings.CACHE_LOCAL_MAX_ENTRIES, self.ttl)
+        self.prefix = prefix
+        self.enabled = settings.RESPONSE_CACHE_ENABLED if enabled is None else enabled
+        self._flights = SingleFlight()
+        self._local_versions: Dict[str, int] = {}
+        self._pending_tags: Set[str] = set()
+        self._pending_keys: Set[str] = set()
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}tag:{tag}"
+
+    async def get_or_set(
+        self,
+        key: str,
+        tags: Iterable[str],
+        produce: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None
+    ) -> bytes:
+        """Cached serialized body for ``key``, calling ``produce`` on a miss"""
+        if not self.enabled:
+            return serialize(await produce())
+        tags = sorted(tags)
+        body = await self._lookup(key, tags)
+        if body is not None:
+            return body
+        return await self._flights.do(key, lambda: self._fill(key, tags, produce, ttl or self.ttl))
+
+    async def _lookup(self, key: str, tags: List[str]) -> Optional[bytes]:
+        await self._replay_invalidations()
+        try:
+            values = await self.shared.mget([self.prefix + key] + [self._tag_key(tag) for tag in tags])
+        except CacheUnavailable:
+            entry = self.local.get(key)
+            if entry is not None and entry[0] == self._current_local_versions(tags):
+                return entry[1]
+            return None
+        if self.local:
+            # Kept during an outage only; other workers' invalidations since
+            # then never reached it
+            self.local.clear()
+        stored, versions = values[0], [int(version or 0) for version in values[1:]]
+        if stored is None:
+            return None
+        header, _, body = stored.partition(b"\n")
+        return body if header == _version_header(versions) else None
+
+    async def _shared_versions(self, tags: List[str]) -> List[int]:
+        values = await self.shared.mget([self._tag_key(tag) for tag in tags]) if tags else []
+        return [int(version or 0) for version in values]
+
+    def _current_local_versions(self, tags: List[str]) -> List[int]:
+        return [self._local_versions.get(tag, 0) for tag in tags]
+
+    async def _fill(self, key: str, tags: List[str], produce, ttl: float) -> bytes:
+        lock_key = f"{self.prefix}lock:{key}"
+        locked = False
+        try:
+            locked = await self.shared.set(lock_key, b"1", ttl=self.lock_timeout, only_if_missing=True)
+            if not locked:
+                # Another worker is computing it; wait for its result
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(self.lock_poll_interval)
+                    body = await self._lookup(key, tags)
+                    if body is not None:
+                        return body
+            # Versions are read before computing, so an invalidation racing
+            # with the computation leaves the stored entry already stale
+            versions = await self._shared_versions(tags)
+        except CacheUnavailable:
+            versions = None
+
+        try:
+            local_versions = self._current_local_versions(tags)
+            body = serialize(await produce())
+            if versions is not None:
+                try:
+                    await self.shared.set(self.prefix + key, _version_header(versions) + b"\n" + body, ttl=ttl)
+                    return body
+                except CacheUnavailable:
+                    pass
+            self.local.set(key, (local_versions, body), ttl)
+            return body
+        finally:
+            if locked:
+                try:
+                    await self.shared.delete(lock_key)
+                except CacheUnavailable:
+                    pass
+
+    async def invalidate(self, tags: Iterable[str] = (), keys: Iterable[str] = ()):
+        """Make entries carrying any of ``tags``, and the entries ``keys``, misses"""
+        tags, keys = set(tags), set(keys)
+        for tag in tags:
+            self._local_versions[tag] = self._local_versions.get(tag, 0) + 1
+        for key in keys:
+            self.local.delete(key)
+        self._pending_tags |= tags
+        self._pending_keys |= keys
+        await self._replay_invalidations()
+
+    async def _replay_invalidations(self):
+        if not (self._pending_tags or self._pending_keys) or not self.shared.available:
+            return
+        tags, keys = self._pending_tags, self._pending_keys
+        self._pending_tags, self._pending_keys = set(), set()
+        try:
+            for tag in tags:
+                await self.shared.incr(self._tag_key(tag))
+            await self.shared.delete(*(self.prefix + key for key in keys))
+        except CacheUnavailable:
+            self._pending_tags |= tags
+            self._pending_keys |= keys
+
+    async def close(self):
+        await self.shared.close()
+
+
+def _version_header(versions: List[int]) -> bytes:
+    return ",".join(map(str, versions)).encode()
+
+
+shared_cache = SharedCache()
+response_cache = ResponseCache(shared_cache)
+
+# Tags and keys of cached media responses
+MEDIA_FILES = "media:files"
+MEDIA_LISTS = "media:lists"
+MEDIA_FACETS = "media:facets"
+
+
+def media_file_key(file_id: int) -> str:
+    return f"media:file:{file_id}"
+
+
+async def invalidate_media(file_ids: Iterable[int] = (), every_file: bool = False):
+    """Drop cached listings, and the details of ``file_ids`` or of every file"""
+    await response_cache.invalidate(
+        tags=[MEDIA_LISTS, MEDIA_FILES] if every_file else [MEDIA_LISTS],
+        keys=[media_file_key(file_id) for file_id in file_ids]
+    )
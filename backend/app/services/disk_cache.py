@@ -0,0 +1,86 @@
+"""
+Size-bounded on-disk cache of generated files, evicted least recently used first
+"""
+
+from typing import List, Optional, Tuple
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """Generated files under ``root`` addressed by relative keys
+
+    Recency is the later of a file's atime and mtime. Cache hits touch the
+    file, and reads through a static mount or nginx update atime on
+    ``relatime`` mounts at least once a day, which is enough granularity for
+    evicting files nobody has requested. Once the cache grows past
+    ``max_bytes`` (0 means unbounded) it is pruned to ``low_watermark`` of it.
+    """
+
+    low_watermark = 0.9
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def lookup(self, key: str) -> bool:
+        """Whether ``key`` is cached, marking it as recently used"""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def added(self, key: str):
+        """Account for a newly written file and prune when over budget"""
+        if not self.max_bytes:
+            return
+        if self._size is None:
+            self._size = sum(size for _path, size, _used in self._entries())
+        else:
+            try:
+                self._size += os.path.getsize(self.path(key))
+            except OSError:
+                pass
+        if self._size > self.max_bytes:
+            self.prune()
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        for directory, _dirs, files in os.walk(self.root):
+            for name in files:
+                # Hidden files are renders still being written
+                if name.startswith("."):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat_result.st_size, max(stat_result.st_atime, stat_result.st_mtime)))
+        return entries
+
+    def prune(self) -> int:
+        """Evict least recently used files down to the low watermark; returns bytes freed"""
+        entries = self._entries()
+        total = sum(size for _path, size, _used in entries)
+        target = self.max_bytes * self.low_watermark
+        freed = 0
+        for path, size, _used in sorted(entries, key=lambda entry: entry[2]):
+            if total - freed <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            freed += size
+        self._size = total - freed
+        if freed:
+            logger.info("Pruned %d bytes from %s", freed, self.root)
+        return freed
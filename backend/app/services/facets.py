@@ -0,0 +1,148 @@
+"""
+Library facets: counts per media type, genre, year, codec and resolution
+"""
+
+from collections import Counter
+from contextlib import asynccontextmanager
+from sqlalchemy import case, delete, func, insert, select
+from typing import Dict, List, Optional
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, dialect_insert
+from app.models.media import MediaFacetCount, MediaFile, MediaInfo
+from app.services.cache import MEDIA_FACETS, response_cache
+
+logger = logging.getLogger(__name__)
+
+FACETS = ("media_type", "genre", "year", "codec", "resolution")
+
+# Smallest height of each bucket, largest first; anything lower is "sd"
+RESOLUTION_BUCKETS = ((2160, "2160p"), (1440, "1440p"), (1080, "1080p"), (720, "720p"), (480, "480p"))
+
+
+def resolution_bucket():
+    return case(
+        *((MediaFile.height >= height, label) for height, label in RESOLUTION_BUCKETS),
+        else_="sd"
+    )
+
+
+def facet_query(facet: str):
+    """Group-by producing (value, count) rows for one facet over available files"""
+    value = {
+        "media_type": MediaFile.media_type,
+        "genre": MediaInfo.genre,
+        "year": MediaInfo.year,
+        "codec": MediaFile.codec,
+        "resolution": resolution_bucket()
+    }[facet]
+    stmt = select(value, func.count(MediaFile.id)).select_from(MediaFile)
+    if facet in ("genre", "year"):
+        stmt = stmt.join(MediaInfo, MediaInfo.media_file_id == MediaFile.id)
+    stmt = stmt.where(MediaFile.is_available.is_(True))
+    if facet == "resolution":
+        stmt = stmt.where(MediaFile.media_type == "video", MediaFile.height.is_not(None))
+    return stmt.group_by(value)
+
+
+async def facet_counts(db, condition=None) -> Counter:
+    """(facet, value) -> number of available files, of those matching ``condition`` if given"""
+    counts = Counter()
+    for facet in FACETS:
+        stmt = facet_query(facet)
+        if condition is not None:
+            stmt = stmt.where(condition)
+        for value, count in (await db.execute(stmt)).all():
+            if value not in (None, ""):
+                counts[(facet, str(value))] += count
+    return counts
+
+
+class FacetAggregator:
+    """Keeps the media_facet_counts table in step with the library
+
+    Reading facets is then a scan of one row per facet value instead of
+    group-bys over the whole library on every page load. Writers that add,
+    remove or re-probe files wrap the change in ``track``, which counts the
+    affected rows before and after and adds the difference to the stored
+    counts in the same transaction, so a batch costs work in proportion to
+    the batch, not the library. A full rebuild runs at startup and every
+    FACETS_REBUILD_INTERVAL seconds to repair drift, e.g. from two
+    processes changing the same files at once.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = settings.FACETS_REBUILD_INTERVAL if interval is None else interval
+
+    @asynccontextmanager
+    async def track(self, db, condition):
+        """Apply the facet changes of the rows matching ``condition``; the caller commits
+
+        The condition must select the same rows before and after the
+        change, so key it on ids or paths rather than on changed columns.
+        """
+        before = await facet_counts(db, condition)
+        yield
+        delta = await facet_counts(db, condition)
+        delta.subtract(before)
+        changes = [
+            {"facet": facet, "value": value, "count": count}
+            for (facet, value), count in delta.items() if count
+        ]
+        if not changes:
+            return
+        table = MediaFacetCount.__table__
+        stmt = dialect_insert(db, table)
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[table.c.facet, table.c.value],
+                set_={"count": table.c.count + stmt.excluded["count"]}
+            ),
+            changes
+        )
+        await db.execute(delete(MediaFacetCount).where(MediaFacetCount.count <= 0))
+
+    async def invalidate(self):
+        """Drop cached facet responses; call after committing tracked changes"""
+        await response_cache.invalidate(tags=[MEDIA_FACETS])
+
+    async def rebuild(self):
+        """Recount every facet and replace the stored counts"""
+        async with AsyncSessionLocal() as db:
+            rows = [
+                {"facet": facet, "value": value, "count": count}
+                for (facet, value), count in (await facet_counts(db)).items()
+            ]
+            await db.execute(delete(MediaFacetCount))
+            if rows:
+                await db.execute(insert(MediaFacetCount), rows)
+            await db.commit()
+        await self.invalidate()
+        logger.info("Facet counts rebuilt: %d values", len(rows))
+
+    async def get(self, db) -> Dict[str, List[dict]]:
+        """Stored counts per facet, most common values first"""
+        result = await db.execute(
+            select(MediaFacetCount.facet, MediaFacetCount.value, MediaFacetCount.count)
+            .order_by(MediaFacetCount.facet, MediaFacetCount.count.desc(), MediaFacetCount.value)
+        )
+        facets: Dict[str, List[dict]] = {facet: [] for facet in FACETS}
+        for facet, value, count in result.all():
+            facets.setdefault(facet, []).append({"value": value, "count": count})
+        return facets
+
+    async def run_forever(self):
+        """Rebuild at startup and then every FACETS_REBUILD_INTERVAL seconds"""
+        while True:
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Rebuilding facet counts failed")
+            await asyncio.sleep(self.interval)
+
+
+facet_aggregator = FacetAggregator()
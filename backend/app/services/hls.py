@@ -0,0 +1,223 @@
+"""
+HLS packaging: multi-rendition playlists with segments cut or encoded on demand
+"""
+
+from sqlalchemy import select
+from hashlib import md5
+from typing import List, Optional, Set
+import os
+import math
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.exceptions import MediaProcessingError, ValidationError
+from app.models.media import TranscodedFile
+from app.services.disk_cache import DiskCache
+from app.services.singleflight import SingleFlight
+from app.services.transcoding import PROFILES, QUALITY_PRESETS, encoder_args
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPE = "video/mp2t"
+
+# H.264 High profile and AAC-LC, as produced by encoder_args for mp4
+STREAM_CODECS = "avc1.640028,mp4a.40.2"
+
+
+def get_worker_count() -> int:
+    """Number of segments allowed to render at once"""
+    return settings.HLS_WORKERS or max(1, (os.cpu_count() or 1) // 2)
+
+
+def get_cache_root() -> str:
+    return settings.HLS_CACHE_ROOT or os.path.join(settings.TRANSCODED_ROOT, "hls")
+
+
+def source_version(media_file) -> str:
+    """Changes whenever the source file does, so stale segments are never served"""
+    return md5(f"{media_file.file_size}-{media_file.file_mtime}".encode(), usedforsecurity=False).hexdigest()[:12]
+
+
+def segment_count(duration: float) -> int:
+    return max(1, math.ceil(duration / settings.HLS_SEGMENT_SECONDS))
+
+
+def segment_bounds(duration: float, index: int):
+    """Start time and length of segment ``index``"""
+    start = index * settings.HLS_SEGMENT_SECONDS
+    return start, min(settings.HLS_SEGMENT_SECONDS, duration - start)
+
+
+def variant_qualities(height: Optional[int]) -> List[str]:
+    """Profiles offered for a source of the given height, smallest first
+
+    Profiles above the source are left out; a source smaller than every
+    profile (or of unknown height) still gets the smallest one, at its own
+    resolution.
+    """
+    qualities = [quality for quality, profile in PROFILES.items() if height and profile["height"] <= height]
+    return qualities or [next(iter(PROFILES))]
+
+
+def master_playlist(media_file) -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for quality in variant_qualities(media_file.height):
+        profile = PROFILES[quality]
+        attributes = [f"BANDWIDTH={profile['bandwidth']}", f'CODECS="{STREAM_CODECS}"']
+        if media_file.width and media_file.height:
+            height = min(profile["height"], media_file.height)
+            width = round(media_file.width * height / media_file.height / 2) * 2
+            attributes.append(f"RESOLUTION={width}x{height}")
+        lines.append("#EXT-X-STREAM-INF:" + ",".join(attributes))
+        lines.append(f"{quality}/index.m3u8")
+    return "\n".join(lines) + "\n"
+
+
+def media_playlist(duration: float) -> str:
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{settings.HLS_SEGMENT_SECONDS}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD"
+    ]
+    for index in range(segment_count(duration)):
+        _start, length = segment_bounds(duration, index)
+        lines.append(f"#EXTINF:{length:.3f},")
+        lines.append(f"{index:05d}.ts")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class HLSPackager:
+    """Produces MPEG-TS segments for HLS playback
+
+    A segment is cut from a finished mp4 TranscodedFile rendition with
+    stream copy when one exists (its keyframes are aligned to segment
+    boundaries), and otherwise encoded just in time from the original.
+    Segments live in a DiskCache keyed by media id, source version,
+    quality and index, so later viewers are served from disk; concurrent
+    requests for a segment share one ffmpeg run, and the next
+    HLS_PREFETCH_SEGMENTS segments are rendered ahead of the player.
+    """
+
+    def __init__(self, cache: Optional[DiskCache] = None, workers: Optional[int] = None):
+        self.cache = cache or DiskCache(get_cache_root(), settings.HLS_CACHE_MAX_BYTES)
+        self.workers = workers or get_worker_count()
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._renders = SingleFlight()
+        self._prefetches: Set[asyncio.Task] = set()
+
+    def segment_key(self, media_file, quality: str, index: int) -> str:
+        return f"{media_file.id}/{source_version(media_file)}/{quality}/{index:05d}.ts"
+
+    async def segment(self, db, media_file, quality: str, index: int) -> str:
+        """Cache key of a segment, rendering it first if needed"""
+        if quality not in variant_qualities(media_file.height):
+            raise ValidationError(f"Quality {quality} is not offered for this media file")
+        if not 0 <= index < segment_count(media_file.duration):
+            raise ValidationError(f"Segment {index} is out of range")
+
+        rendition = await self._ready_rendition(db, media_file.id, quality)
+        key = await self._ensure(media_file, quality, index, rendition)
+
+        last = segment_count(media_file.duration) - 1
+        for ahead in range(index + 1, min(index + settings.HLS_PREFETCH_SEGMENTS, last) + 1):
+            self._prefetch(media_file, quality, ahead, rendition)
+        return key
+
+    async def _ready_rendition(self, db, media_file_id: int, quality: str) -> Optional[str]:
+        result = await db.execute(
+            select(TranscodedFile.file_path).where(
+                TranscodedFile.original_file_id == media_file_id,
+                TranscodedFile.quality == quality,
+                TranscodedFile.format == "mp4",
+                TranscodedFile.is_ready.is_(True)
+            )
+        )
+        path = result.scalar_one_or_none()
+        return path if path and os.path.exists(path) else None
+
+    async def _ensure(self, media_file, quality: str, index: int, rendition: Optional[str]) -> str:
+        key = self.segment_key(media_file, quality, index)
+        if not self.cache.lookup(key):
+            await self._renders.do(key, lambda: self._render(media_file, quality, index, rendition, key))
+        return key
+
+    def _prefetch(self, media_file, quality: str, index: int, rendition: Optional[str]):
+        key = self.segment_key(media_file, quality, index)
+        if self._renders.in_flight(key) or os.path.exists(self.cache.path(key)):
+            return
+
+        async def prefetch():
+            try:
+                await self._ensure(media_file, quality, index, rendition)
+            except MediaProcessingError as e:
+                logger.warning("Prefetching HLS segment %s failed: %s", key, e.detail)
+
+        task = asyncio.create_task(prefetch())
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetches.discard)
+
+    async def _render(self, media_file, quality: str, index: int, rendition: Optional[str], key: str):
+        start, length = segment_bounds(media_file.duration, index)
+        output = self.cache.path(key)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(output), f".{os.path.basename(output)}.{os.getpid()}.part")
+
+        command = [
+            settings.FFMPEG_PATH,
+            "-v", "error",
+            "-y",
+            "-ss", f"{start:.3f}",
+            "-t", f"{length:.3f}",
+            "-i", rendition or media_file.file_path
+        ]
+        if rendition:
+            command += ["-map", "0", "-c", "copy"]
+        else:
+            preset = QUALITY_PRESETS["low"][0]  # real-time matters more than size here
+            command += encoder_args(quality, "mp4", threads=max(1, (os.cpu_count() or 1) // self.workers), preset=preset)
+        # Keep timestamps continuous across independently produced segments
+        command += ["-output_ts_offset", f"{start:.3f}", "-muxdelay", "0", "-f", "mpegts", temp_path]
+
+        async with self._semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except OSError as e:
+                raise MediaProcessingError(f"cannot run ffmpeg: {e}")
+            try:
+                _stdout, stderr = await asyncio.wait_for(process.communicate(), settings.HLS_SEGMENT_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                _remove(temp_path)
+                raise MediaProcessingError(f"ffmpeg timed out after {settings.HLS_SEGMENT_TIMEOUT}s on {key}")
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                _remove(temp_path)
+                raise
+
+        if process.returncode != 0:
+            _remove(temp_path)
+            raise MediaProcessingError(stderr.decode(errors="replace").strip()[-1000:] or f"ffmpeg exited with {process.returncode}")
+
+        os.replace(temp_path, output)
+        await asyncio.to_thread(self.cache.added, key)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+hls_packager = HLSPackager()
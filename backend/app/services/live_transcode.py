@@ -0,0 +1,282 @@
+"""
+Live transcoding: ffmpeg sessions started at a seek offset and streamed as fragmented MP4
+"""
+
+from typing import AsyncIterator, Dict, List, Optional
+import os
+import time
+import secrets
+import asyncio
+import logging
+import aiofiles
+
+from app.core.config import settings
+from app.core.exceptions import MediaProcessingError, TranscodeCapacityReached, ValidationError
+from app.services.transcoding import QUALITY_PRESETS, encoder_args, validate_rendition
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_max_sessions() -> int:
+    """Live sessions allowed at once on this host"""
+    return settings.LIVE_TRANSCODE_MAX_SESSIONS or max(1, (os.cpu_count() or 1) // 2)
+
+
+def get_session_root() -> str:
+    return os.path.join(settings.TRANSCODED_ROOT, "live")
+
+
+def build_live_command(source: str, quality: str, start: float, threads: int) -> List[str]:
+    return [
+        settings.FFMPEG_PATH,
+        "-v", "error",
+        "-nostdin",
+        "-ss", f"{start:.3f}",
+        "-i", source,
+        *encoder_args(quality, "mp4", threads, preset=QUALITY_PRESETS["low"][0]),
+        # Fragmented MP4 plays progressively without a seekable output
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4",
+        "pipe:1"
+    ]
+
+
+class LiveSession:
+    """One ffmpeg process whose output is spooled to disk and fanned out to readers
+
+    The spool lets any number of clients read the same output from the
+    beginning at their own pace. ffmpeg is paced by its furthest reader:
+    once it is LIVE_TRANSCODE_MAX_AHEAD_BYTES ahead, stdout is no longer
+    drained and the pipe blocks the encoder, so nobody pays for frames that
+    will not be watched.
+    """
+
+    def __init__(self, media_id: int, quality: str, start: float, spool_directory: str):
+        self.id = secrets.token_urlsafe(12)
+        self.media_id = media_id
+        self.quality = quality
+        self.start = start
+        self.spool_path = os.path.join(spool_directory, f".{self.id}.mp4")
+        self.size = 0
+        self.finished = False
+        self.error: Optional[str] = None
+        self.last_active = time.monotonic()
+        self._readers: Dict[int, int] = {}
+        self._next_reader = 0
+        self._changed = asyncio.Condition()
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def reader_count(self) -> int:
+        return len(self._readers)
+
+    def is_idle(self, timeout: float) -> bool:
+        return not self._readers and time.monotonic() - self.last_active > timeout
+
+    async def start_process(self, command: List[str]):
+        # Created up front so readers can open it before the first chunk
+        open(self.spool_path, "wb").close()
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            raise MediaProcessingError(f"cannot run ffmpeg: {e}")
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _far_enough_ahead(self) -> bool:
+        furthest = max(self._readers.values(), default=0)
+        return self.size - furthest >= settings.LIVE_TRANSCODE_MAX_AHEAD_BYTES
+
+    async def _pump(self):
+        stderr_task = asyncio.create_task(self._process.stderr.read())
+        try:
+            async with aiofiles.open(self.spool_path, "ab") as spool:
+                while True:
+                    async with self._changed:
+                        await self._changed.wait_for(lambda: not self._far_enough_ahead())
+                    chunk = await self._process.stdout.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await spool.write(chunk)
+                    await spool.flush()
+                    self.size += len(chunk)
+                    await self._notify()
+            await self._process.wait()
+            if self._process.returncode != 0:
+                stderr = await stderr_task
+                self.error = stderr.decode(errors="replace").strip()[-1000:] or f"ffmpeg exited with {self._process.returncode}"
+                logger.warning("Live transcode %s failed: %s", self.id, self.error)
+        finally:
+            stderr_task.cancel()
+            self.finished = True
+            self.last_active = time.monotonic()
+            await self._notify()
+
+    async def wait_started(self):
+        """Wait for the first output bytes, raising if ffmpeg failed before producing any"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.size > 0 or self.finished)
+        if self.size == 0 and self.error:
+            raise MediaProcessingError(self.error)
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Yield the session output from its beginning, following it while ffmpeg runs"""
+        reader = self._next_reader
+        self._next_reader += 1
+        self._readers[reader] = 0
+        position = 0
+        try:
+            async with aiofiles.open(self.spool_path, "rb") as spool:
+                while True:
+                    if position < self.size:
+                        data = await spool.read(min(READ_CHUNK_SIZE, self.size - position))
+                        if not data:
+                            break
+                        position += len(data)
+                        self._readers[reader] = position
+                        self.last_active = time.monotonic()
+                        await self._notify()
+                        yield data
+                        continue
+                    if self.finished:
+                        break
+                    async with self._changed:
+                        await self._changed.wait_for(lambda: self.size > position or self.finished)
+        finally:
+            self._readers.pop(reader, None)
+            self.last_active = time.monotonic()
+            await self._notify()
+
+    async def close(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+            try:
+                await asyncio.wait_for(self._process.wait(), 5)
+            except asyncio.TimeoutError:
+                logger.warning("Live transcode %s did not exit after being killed", self.id)
+        try:
+            os.remove(self.spool_path)
+        except FileNotFoundError:
+            pass
+
+
+class LiveTranscoder:
+    """Registry of live sessions, capped per host and reaped when idle
+
+    A request is attached to an existing session for the same file and
+    quality when its offset falls within LIVE_TRANSCODE_REUSE_WINDOW
+    seconds after that session's start; the client then receives the
+    stream from the session start (reported in X-Transcode-Start). When all
+    slots are taken, the longest idle session is closed to make room, and
+    if none is idle the request is refused rather than oversubscribing the
+    CPU. Sessions with no readers for LIVE_TRANSCODE_IDLE_TIMEOUT seconds
+    are killed, which is what happens to the old session when a viewer
+    scrubs elsewhere.
+    """
+
+    reap_interval = 5
+
+    def __init__(self, max_sessions: Optional[int] = None):
+        self.max_sessions = max_sessions or get_max_sessions()
+        self.sessions: Dict[str, LiveSession] = {}
+        self._lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _find_reusable(self, media_id: int, quality: str, start: float) -> Optional[LiveSession]:
+        for session in self.sessions.values():
+            if (
+                session.media_id == media_id
+                and session.quality == quality
+                and session.error is None
+                and session.start <= start <= session.start + settings.LIVE_TRANSCODE_REUSE_WINDOW
+            ):
+                return session
+        return None
+
+    async def open(self, media_file, quality: str, start: float) -> LiveSession:
+        """Return a session streaming ``media_file`` from about ``start`` seconds"""
+        validate_rendition(quality, "mp4")
+        if media_file.duration and start >= media_file.duration:
+            raise ValidationError(f"Start offset {start} is past the end of the file")
+
+        async with self._lock:
+            session = self._find_reusable(media_file.id, quality, start)
+            if session is not None:
+                session.last_active = time.monotonic()
+                return session
+
+            if len(self.sessions) >= self.max_sessions:
+                idle = [s for s in self.sessions.values() if s.reader_count == 0]
+                if not idle:
+                    raise TranscodeCapacityReached(self.max_sessions)
+                await self._close(min(idle, key=lambda s: s.last_active))
+
+            os.makedirs(get_session_root(), exist_ok=True)
+            session = LiveSession(media_file.id, quality, start, get_session_root())
+            threads = max(1, (os.cpu_count() or 1) // self.max_sessions)
+            try:
+                await session.start_process(build_live_command(media_file.file_path, quality, start, threads))
+            except BaseException:
+                # Removes the spool file start_process created before ffmpeg failed to start
+                await session.close()
+                raise
+            self.sessions[session.id] = session
+            logger.info(
+                "Live transcode %s started for media %d at %.1fs (%s), %d active",
+                session.id, media_file.id, start, quality, len(self.sessions)
+            )
+
+            if self._reaper is None or self._reaper.done():
+                self._reaper = asyncio.create_task(self._reap_loop())
+            return session
+
+    async def close(self, session_id: str) -> bool:
+        async with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return False
+            await self._close(session)
+            return True
+
+    async def _close(self, session: LiveSession):
+        self.sessions.pop(session.id, None)
+        await session.close()
+
+    async def reap(self) -> int:
+        """Close sessions nobody has read for LIVE_TRANSCODE_IDLE_TIMEOUT seconds"""
+        async with self._lock:
+            idle = [s for s in self.sessions.values() if s.is_idle(settings.LIVE_TRANSCODE_IDLE_TIMEOUT)]
+            for session in idle:
+                await self._close(session)
+        return len(idle)
+
+    async def _reap_loop(self):
+        while self.sessions:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Reaping live transcodes failed")
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        async with self._lock:
+            for session in list(self.sessions.values()):
+                await self._close(session)
+
+
+live_transcoder = LiveTranscoder()
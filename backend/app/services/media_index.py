@@ -0,0 +1,193 @@
+"""
+In-memory indexes for the lightweight (no database) media server
+"""
+
+from bisect import bisect_left, insort
+from datetime import datetime
+from heapq import nlargest
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase alphanumeric runs; separators such as '.', '_' and '/' split words"""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class SortedMediaIndex:
+    """Media IDs kept sorted by (created_at, id)
+
+    Uploads arrive in creation order, so inserts are appends in practice.
+    A page is served by slicing the tail of the list, newest first, without
+    copying or re-sorting the whole library.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[datetime, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, media_id: str, created_at: datetime):
+        """Insert a media ID at its sorted position"""
+        key = (created_at, media_id)
+        if self._keys and key > self._keys[-1]:
+            self._keys.append(key)
+        else:
+            insort(self._keys, key)
+
+    def discard(self, media_id: str, created_at: datetime):
+        """Remove a media ID if it is present"""
+        key = (created_at, media_id)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def page(self, offset: int, limit: int) -> List[str]:
+        """Return up to ``limit`` media IDs, newest first, skipping ``offset``"""
+        if offset < 0 or limit <= 0:
+            return []
+        end = len(self._keys) - offset
+        if end <= 0:
+            return []
+        start = max(end - limit, 0)
+        return [media_id for _, media_id in reversed(self._keys[start:end])]
+
+    def clear(self):
+        """Drop every entry"""
+        self._keys.clear()
+
+
+class MediaSearchIndex:
+    """Inverted index from words to media IDs, for search without a database
+
+    Each word maps to the media containing it and a weight for the field it
+    came from, so a query touches only the postings of its own words rather
+    than every record. Words are also kept in a sorted vocabulary, which
+    lets query words match as prefixes ("matr" finds "matrix") with a
+    bisect. Every query word must match; results are ranked by the summed
+    field weights, exact words counting double; ties go to the most
+    recently indexed.
+    """
+
+    field_weights = {"original_filename": 3.0, "filename": 2.0, "mime_type": 1.0}
+    # Bounds the work for one- or two-letter prefixes on a large vocabulary
+    max_prefix_expansions = 256
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._vocabulary: List[str] = []
+        # False after add_many appended words, until the next lookup sorts them
+        self._vocabulary_sorted = True
+        # media_id -> (media type such as "video", indexed words)
+        self._documents: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, media_id: str, record: dict):
+        """Index a media record, replacing any earlier version of it"""
+        self._index(media_id, record)
+
+    def add_many(self, records: Iterable[Tuple[str, dict]]):
+        """Index many (media_id, record) pairs, as when loading a library
+
+        New words are appended and sorted into the vocabulary once, by the
+        next search, instead of being inserted one at a time.
+        """
+        for media_id, record in records:
+            self._index(media_id, record, sort=False)
+
+    def _sort_vocabulary(self):
+        if not self._vocabulary_sorted:
+            self._vocabulary.sort()
+            self._vocabulary_sorted = True
+
+    def _index(self, media_id: str, record: dict, sort: bool = True):
+        self.discard(media_id)
+        weights: Dict[str, float] = {}
+        for field, weight in self.field_weights.items():
+            for token in tokenize(record.get(field)):
+                weights[token] = max(weights.get(token, 0.0), weight)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                if sort and self._vocabulary_sorted:
+                    insort(self._vocabulary, token)
+                else:
+                    self._vocabulary.append(token)
+                    self._vocabulary_sorted = False
+            postings[media_id] = weight
+        media_type = (record.get("mime_type") or "").split("/", 1)[0]
+        self._documents[media_id] = (media_type, tuple(weights))
+
+    def discard(self, media_id: str):
+        """Remove a media record if it is indexed"""
+        document = self._documents.pop(media_id, None)
+        if document is None:
+            return
+        self._sort_vocabulary()
+        for token in document[1]:
+            postings = self._postings[token]
+            del postings[media_id]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _expand(self, term: str) -> List[Tuple[Dict[str, float], float]]:
+        """Postings of the words ``term`` matches, with their score multiplier"""
+        self._sort_vocabulary()
+        matches = []
+        position = bisect_left(self._vocabulary, term)
+        end = min(position + self.max_prefix_expansions, len(self._vocabulary))
+        while position < end and self._vocabulary[position].startswith(term):
+            token = self._vocabulary[position]
+            matches.append((self._postings[token], 2.0 if token == term else 1.0))
+            position += 1
+        return matches
+
+    def search(
+        self, query: str, offset: int = 0, limit: int = 20, media_type: Optional[str] = None
+    ) -> Tuple[List[str], int]:
+        """Return a page of matching media IDs, best first, and the number of matches"""
+        terms = [self._expand(term) for term in dict.fromkeys(tokenize(query))]
+        if not terms or not all(terms):
+            return [], 0
+        # Start from the rarest term and probe the others per candidate, so the
+        # work follows the smallest posting lists rather than the largest
+        terms.sort(key=lambda matches: sum(len(postings) for postings, _multiplier in matches))
+        if len(terms) == 1 and len(terms[0]) == 1:
+            # A single word's postings already rank its matches; use them as is
+            scores = terms[0][0][0]
+        else:
+            scores = {}
+            for postings, multiplier in terms[0]:
+                for media_id, weight in postings.items():
+                    if weight * multiplier > scores.get(media_id, 0.0):
+                        scores[media_id] = weight * multiplier
+        for matches in terms[1:]:
+            narrowed = {}
+            for media_id, score in scores.items():
+                best = max((postings.get(media_id, 0.0) * multiplier for postings, multiplier in matches), default=0.0)
+                if best:
+                    narrowed[media_id] = score + best
+            scores = narrowed
+            if not scores:
+                return [], 0
+        if media_type:
+            documents = self._documents
+            scores = {media_id: score for media_id, score in scores.items() if documents[media_id][0] == media_type}
+        # nlargest keeps input order among equal scores, and postings are in
+        # indexing order, so walking them backwards puts the newest first
+        ranked = nlargest(offset + limit, reversed(scores), key=scores.__getitem__)
+        return ranked[offset:], len(scores)
+
+    def clear(self):
+        """Drop every entry"""
+        self._postings.clear()
+        self._vocabulary.clear()
+        self._vocabulary_sorted = True
+        self._documents.clear()
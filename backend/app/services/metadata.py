@@ -0,0 +1,203 @@
+"""
+Metadata extraction: ffprobe run over pending media files in parallel
+"""
+
+from sqlalchemy import select, update
+from typing import List, Optional
+import os
+import json
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, update_rows
+from app.core.exceptions import MediaProcessingError
+from app.models.media import MediaFile
+from app.services.cache import invalidate_media
+from app.services.facets import facet_aggregator
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_count() -> int:
+    """Number of ffprobe processes allowed to run at once"""
+    return settings.METADATA_WORKERS or os.cpu_count() or 1
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_probe_output(probe: dict) -> dict:
+    """Pick MediaFile columns out of ffprobe's JSON output"""
+    streams = probe.get("streams") or []
+    probe_format = probe.get("format") or {}
+
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    main_stream = video or audio or {}
+
+    duration = _to_float(probe_format.get("duration")) or _to_float(main_stream.get("duration"))
+    codec = main_stream.get("codec_name")
+    format_name = probe_format.get("format_name")
+
+    return {
+        "duration": duration,
+        "width": _to_int(video.get("width")) if video else None,
+        "height": _to_int(video.get("height")) if video else None,
+        "bitrate": _to_int(probe_format.get("bit_rate")) or _to_int(main_stream.get("bit_rate")),
+        "codec": codec[:50] if codec else None,
+        "container_format": format_name.split(",")[0][:20] if format_name else None
+    }
+
+
+async def probe_media(path: str, timeout: Optional[float] = None) -> dict:
+    """Run ffprobe on one file and return its parsed metadata
+
+    The process is killed if it runs longer than ``timeout`` seconds
+    (FFPROBE_TIMEOUT by default).
+    """
+    timeout = settings.FFPROBE_TIMEOUT if timeout is None else timeout
+    try:
+        process = await asyncio.create_subprocess_exec(
+            settings.FFPROBE_PATH,
+            "-v", "error",
+            "-print_format", "json",
+            "-show_format",
+            "-show_streams",
+            path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        raise MediaProcessingError(f"cannot run ffprobe: {e}")
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise MediaProcessingError(f"ffprobe timed out after {timeout}s on {path}")
+
+    if process.returncode != 0:
+        raise MediaProcessingError(stderr.decode(errors="replace").strip() or f"ffprobe failed on {path}")
+
+    try:
+        return parse_probe_output(json.loads(stdout))
+    except ValueError:
+        raise MediaProcessingError(f"ffprobe returned invalid JSON for {path}")
+
+
+class MetadataExtractor:
+    """Moves pending media files through ffprobe in batches
+
+    Each batch is claimed by switching ``processing_status`` from pending to
+    processing, probed with at most ``get_worker_count()`` ffprobe processes
+    at a time, and written back in bulk, ending as completed or failed. A
+    write that fails hands the batch back to pending.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, workers: Optional[int] = None):
+        self.batch_size = batch_size or settings.METADATA_BATCH_SIZE
+        self.workers = workers
+
+    async def recover(self):
+        """Return files left in processing by an interrupted run to pending"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(MediaFile)
+                .where(MediaFile.processing_status == "processing")
+                .values(processing_status="pending")
+            )
+            await db.commit()
+
+    async def _claim_batch(self) -> List[tuple]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(MediaFile.id, MediaFile.file_path)
+                .where(MediaFile.processing_status == "pending", MediaFile.is_available.is_(True))
+                .order_by(MediaFile.id)
+                .limit(self.batch_size)
+            )
+            rows = result.all()
+            if rows:
+                await db.execute(
+                    update(MediaFile)
+                    .where(MediaFile.id.in_([row.id for row in rows]))
+                    .values(processing_status="processing")
+                )
+                await db.commit()
+            return rows
+
+    async def _release(self, ids: List[int]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(MediaFile)
+                .where(MediaFile.id.in_(ids), MediaFile.processing_status == "processing")
+                .values(processing_status="pending")
+            )
+            await db.commit()
+
+    async def process_batch(self) -> int:
+        """Probe one batch of pending files; returns how many were claimed"""
+        rows = await self._claim_batch()
+        if not rows:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.workers or get_worker_count())
+
+        async def probe(row) -> dict:
+            async with semaphore:
+                try:
+                    values = await probe_media(row.file_path)
+                except MediaProcessingError as e:
+                    logger.warning("Metadata extraction failed for %s: %s", row.file_path, e.detail)
+                    return {"id": row.id, "processing_status": "failed"}
+            return {"id": row.id, "processing_status": "completed", "is_processed": True, **values}
+
+        results = await asyncio.gather(*(probe(row) for row in rows))
+
+        completed = [values for values in results if values["processing_status"] == "completed"]
+        failed = [values for values in results if values["processing_status"] == "failed"]
+        try:
+            async with AsyncSessionLocal() as db:
+                async with facet_aggregator.track(db, MediaFile.id.in_([row.id for row in rows])):
+                    await update_rows(db, MediaFile, results)
+                await db.commit()
+        except BaseException:
+            # Hand the batch back rather than leave it in processing until a restart
+            await self._release([row.id for row in rows])
+            raise
+
+        if completed:
+            await facet_aggregator.invalidate()
+        await invalidate_media([values["id"] for values in results])
+        logger.info("Metadata extracted for %d files, %d failed", len(completed), len(failed))
+        return len(rows)
+
+    async def run_forever(self):
+        """Process pending files as they appear"""
+        await self.recover()
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Metadata extraction batch failed")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(settings.METADATA_POLL_INTERVAL)
+
+
+metadata_extractor = MetadataExtractor()
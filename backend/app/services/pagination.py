@@ -0,0 +1,91 @@
+"""
+Keyset pagination: opaque cursors and cached totals for list endpoints
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Hashable, NamedTuple, Optional, Tuple
+import json
+import time
+import base64
+import binascii
+
+from app.core.exceptions import ValidationError
+
+
+class Cursor(NamedTuple):
+    """Where the next page starts: after the row (created_at, id), or at ``offset``
+
+    Orders other than by creation time are not unique enough to seek on
+    cheaply, so their cursors carry a row offset instead.
+    """
+    created_at: Optional[datetime] = None
+    id: Optional[int] = None
+    offset: int = 0
+
+    @property
+    def is_keyset(self) -> bool:
+        return self.id is not None
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque cursor pointing just past the row with this (created_at, id)"""
+    return _encode([created_at.isoformat(), row_id])
+
+
+def encode_offset_cursor(offset: int) -> str:
+    return _encode([offset])
+
+
+def _encode(position: list) -> str:
+    payload = json.dumps(position, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+        if len(position) == 1:
+            return Cursor(offset=max(0, int(position[0])))
+        created_at, row_id = position
+        return Cursor(created_at=datetime.fromisoformat(created_at), id=int(row_id))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValidationError("Invalid pagination cursor")
+
+
+class CountCache:
+    """Row counts per filter combination, kept for ``ttl`` seconds
+
+    Exact counts scan the whole table, which costs more than fetching a page
+    by cursor. A total a few seconds stale is fine for a "N items" label,
+    so each filter combination is counted at most once per ``ttl``.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, int]] = {}
+
+    def get(self, key: Hashable) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, count: int):
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[key] = (time.monotonic(), count)
+
+    def invalidate(self):
+        self._entries.clear()
+
+    async def count(self, db, key: Hashable, statement: Any) -> int:
+        """Cached result of the ``select(func.count(...))`` ``statement``"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        result = await db.execute(statement)
+        count = result.scalar() or 0
+        self.set(key, count)
+        return count
@@ -0,0 +1,102 @@
+"""
+Password hashing off the event loop, and limits on concurrent login attempts
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+import os
+import asyncio
+
+from passlib.context import CryptContext
+
+from app.core.config import settings
+from app.core.exceptions import TooManyLoginAttempts
+
+# Building a context parses its configuration and probes the bcrypt
+# backend, so one is shared by every request
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasher:
+    """Runs bcrypt in a small dedicated thread pool
+
+    A bcrypt hash takes a few hundred milliseconds of CPU by design. Run on
+    the event loop, a burst of logins would stall every stream and API
+    request in the process for that long per login. The pool is separate
+    from the default executor so file scans and hashing never wait on each
+    other, and at most ``max_pending`` hashes may be queued or running;
+    beyond that callers get ``TooManyLoginAttempts`` straight away instead
+    of joining a queue that only grows.
+    """
+
+    def __init__(self, context: CryptContext = pwd_context, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.context = context
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending or settings.PASSWORD_HASH_MAX_PENDING
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    async def _run(self, function: Callable, *args):
+        if self._pending >= self.max_pending:
+            raise TooManyLoginAttempts()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class LoginLimiter:
+    """Caps logins in progress per account name and per client address
+
+    One client retrying in a loop, or many clients guessing one account's
+    password, can then only occupy a few hashing slots; everyone else's
+    logins still get through.
+    """
+
+    def __init__(self, per_user: Optional[int] = None, per_ip: Optional[int] = None):
+        self.per_user = per_user or settings.LOGIN_MAX_CONCURRENT_PER_USER
+        self.per_ip = per_ip or settings.LOGIN_MAX_CONCURRENT_PER_IP
+        self._users: Counter = Counter()
+        self._ips: Counter = Counter()
+
+    @contextmanager
+    def attempt(self, username: str, ip: Optional[str]):
+        """Hold a login slot for ``username`` from ``ip`` while the block runs"""
+        username = username.strip().lower()
+        if self._users[username] >= self.per_user or (ip and self._ips[ip] >= self.per_ip):
+            raise TooManyLoginAttempts()
+        self._users[username] += 1
+        if ip:
+            self._ips[ip] += 1
+        try:
+            yield
+        finally:
+            _release(self._users, username)
+            if ip:
+                _release(self._ips, ip)
+
+
+def _release(counter: Counter, key: str):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+password_hasher = PasswordHasher()
+login_limiter = LoginLimiter()
@@ -0,0 +1,352 @@
+"""
+Record stores for the lightweight (no database) media server: in memory, or
+persisted as snapshot plus append-only log
+"""
+
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import re
+import json
+import asyncio
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LOG_NAME = re.compile(r"^(?P<name>.+)\.(?P<generation>\d+)\.log$")
+
+
+class RecordStore(MutableMapping):
+    """Dict records by string key, kept in memory only
+
+    This is the "memory" backend and the interface of the persistent ones.
+    Code that changes a record in place calls ``save`` afterwards so a
+    persistent store sees the change, and awaits ``commit`` where the change
+    must survive a crash before the request is answered.
+    """
+
+    def __init__(self, name: str, datetime_fields: Iterable[str] = ()):
+        self.name = name
+        self.datetime_fields = tuple(datetime_fields)
+        self._records: Dict[str, object] = {}
+
+    def __getitem__(self, key: str) -> dict:
+        return self._records[key]
+
+    def __setitem__(self, key: str, record: dict):
+        self._records[key] = record
+
+    def __delitem__(self, key: str):
+        del self._records[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def save(self, key: str):
+        """Persist changes made to the record ``key`` in place"""
+        self[key] = self[key]
+
+    def load(self):
+        """Read the stored records; called once at startup"""
+
+    async def commit(self):
+        """Wait until every change made so far is durable"""
+
+    async def close(self):
+        """Write out pending changes and release files"""
+
+
+class LogRecordStore(RecordStore):
+    """Records in memory, persisted as a snapshot plus an append-only log
+
+    Each change appends one line to ``<name>.<generation>.log``. Changes
+    are gathered for STORE_COMMIT_INTERVAL seconds and written with a
+    single fsync, so a burst of uploads shares one disk flush instead of
+    paying for one each. Once the log outgrows the snapshot, later changes
+    go to a new log while ``<name>.snapshot`` is rewritten from memory in a
+    thread and renamed into place; the logs it covers are then deleted.
+
+    Loading only splits the snapshot into lines. Each record stays encoded
+    until it is first read, so a restart costs about one pass over the file
+    however many records it holds. A line cut short by a crash mid-write
+    ends its log, and is truncated away.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        datetime_fields: Iterable[str] = (),
+        root: Optional[str] = None,
+        commit_interval: Optional[float] = None,
+        compact_min_bytes: Optional[int] = None
+    ):
+        super().__init__(name, datetime_fields)
+        self.root = root or settings.STORE_ROOT
+        self.commit_interval = settings.STORE_COMMIT_INTERVAL if commit_interval is None else commit_interval
+        self.compact_min_bytes = compact_min_bytes or settings.STORE_COMPACT_MIN_BYTES
+        self._generation = 0
+        self._log_file = None
+        self._log_bytes = 0
+        self._snapshot_bytes = 0
+        self._pending: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compaction: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    def __getitem__(self, key: str) -> dict:
+        record = self._records[key]
+        if record.__class__ is bytes:
+            record = self._records[key] = self._decode(record)
+        return record
+
+    def __setitem__(self, key: str, record: dict):
+        self._records[key] = record
+        self._append(_dumps([key, record]))
+
+    def __delitem__(self, key: str):
+        del self._records[key]
+        self._append(_dumps([key]))
+
+    def _decode(self, data) -> dict:
+        record = json.loads(data) if isinstance(data, bytes) else data
+        for field in self.datetime_fields:
+            value = record.get(field)
+            if value:
+                record[field] = datetime.fromisoformat(value)
+        return record
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.root, f"{self.name}.snapshot")
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.root, f"{self.name}.{generation}.log")
+
+    def _log_generations(self) -> List[int]:
+        generations = []
+        for filename in os.listdir(self.root):
+            match = LOG_NAME.match(filename)
+            if match and match.group("name") == self.name:
+                generations.append(int(match.group("generation")))
+        return sorted(generations)
+
+    def load(self):
+        os.makedirs(self.root, exist_ok=True)
+        records: Dict[str, object] = {}
+        generation = 0
+        try:
+            with open(self._snapshot_path(), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data:
+            # A header line, a line with every key, then one line per record
+            # in the same order, so none of this needs a loop in Python
+            header, keys, body = data.split(b"\n", 2)
+            generation = json.loads(header)["log"]
+            keys = json.loads(keys)
+            lines = body.splitlines()
+            if len(lines) != len(keys):
+                raise ValueError(f"{self._snapshot_path()} is damaged: {len(keys)} keys, {len(lines)} records")
+            records = dict(zip(keys, lines))
+        self._snapshot_bytes = len(data)
+        self._records = records
+
+        for log_generation in self._log_generations():
+            if log_generation < generation:
+                # Already in the snapshot; left behind by an interrupted compaction
+                os.remove(self._log_path(log_generation))
+            else:
+                self._replay(log_generation)
+                generation = log_generation
+        self._open_log(generation)
+        logger.info("Loaded %d %s records", len(records), self.name)
+
+    def _replay(self, generation: int):
+        path = self._log_path(generation)
+        with open(path, "rb") as f:
+            data = f.read()
+        records = self._records
+        good = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Truncating %s after %d bytes: last write was interrupted", path, good)
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+                break
+            if len(entry) == 2:
+                records[entry[0]] = self._decode(entry[1])
+            else:
+                records.pop(entry[0], None)
+            good += len(line)
+
+    def _open_log(self, generation: int):
+        if self._log_file is not None:
+            self._log_file.close()
+        self._generation = generation
+        self._log_file = open(self._log_path(generation), "ab", buffering=0)
+        self._log_bytes = self._log_file.tell()
+        _fsync_directory(self.root)
+
+    def _append(self, line: bytes):
+        self._pending.append(line)
+        if self._flush_task is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Outside the server (a script), write straight through
+                self._write(self._take_pending())
+                return
+            self._flush_task = loop.create_task(self._flush_later())
+
+    def _take_pending(self) -> List[bytes]:
+        lines, self._pending = self._pending, []
+        return lines
+
+    def _write(self, lines: List[bytes]):
+        data = memoryview(b"".join(lines))
+        try:
+            while data:
+                data = data[self._log_file.write(data):]
+            os.fsync(self._log_file.fileno())
+        except OSError:
+            # Drop any partial line so the next write starts on a line boundary
+            self._log_file.truncate(self._log_bytes)
+            raise
+        self._log_bytes = self._log_file.tell()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.commit_interval)
+        await self._flush()
+
+    async def _flush(self):
+        async with self._write_lock:
+            # Changes made from here on are picked up by the next flush
+            self._flush_task = None
+            lines, waiters = self._take_pending(), self._waiters
+            self._waiters = []
+            try:
+                if lines:
+                    await asyncio.to_thread(self._write, lines)
+            except Exception as e:
+                logger.exception("Writing %d %s changes failed", len(lines), self.name)
+                # Kept for the next flush; writing a line twice is harmless
+                self._pending[:0] = lines
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        if self._compaction is None and self._log_bytes >= max(self.compact_min_bytes, self._snapshot_bytes):
+            self._compaction = asyncio.create_task(self._compact_in_background())
+
+    async def commit(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        await waiter
+
+    async def compact(self):
+        """Rewrite the snapshot from memory and delete the logs it replaces"""
+        async with self._write_lock:
+            # Changes after this point go to the new log; replaying a few
+            # earlier ones on top of the snapshot as well is harmless, as
+            # each line sets or deletes a whole record
+            await asyncio.to_thread(self._open_log, self._generation + 1)
+            # Copied here because callers update records in place while the
+            # thread serializes them; bytes are records not decoded yet
+            items = [
+                (key, dict(record) if isinstance(record, dict) else record)
+                for key, record in self._records.items()
+            ]
+            generation = self._generation
+        self._snapshot_bytes = await asyncio.to_thread(self._write_snapshot, items, generation)
+        for log_generation in self._log_generations():
+            if log_generation < generation:
+                os.remove(self._log_path(log_generation))
+        logger.info("Compacted %s: %d records", self.name, len(items))
+
+    async def _compact_in_background(self):
+        try:
+            await self.compact()
+        except Exception:
+            logger.exception("Compacting %s failed", self.name)
+        finally:
+            self._compaction = None
+
+    def _write_snapshot(self, items: List[Tuple[str, object]], generation: int) -> int:
+        path = self._snapshot_path()
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(_dumps({"log": generation}))
+            f.write(_dumps([key for key, _ in items]))
+            f.writelines(
+                record + b"\n" if record.__class__ is bytes else _dumps(record)
+                for _, record in items
+            )
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(temporary, path)
+        _fsync_directory(self.root)
+        return size
+
+    async def close(self):
+        scheduled = self._flush_task
+        await self._flush()
+        if scheduled is not None:
+            # Only sleeping or waiting for the lock by now
+            scheduled.cancel()
+        if self._compaction is not None:
+            await self._compaction
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+
+STORE_BACKENDS = {"memory": RecordStore, "log": LogRecordStore}
+
+
+def open_store(name: str, datetime_fields: Iterable[str] = ()) -> RecordStore:
+    """A store named ``name`` on the configured STORE_BACKEND; call ``load`` before use"""
+    try:
+        backend = STORE_BACKENDS[settings.STORE_BACKEND]
+    except KeyError:
+        raise ValueError(f"STORE_BACKEND must be one of: {', '.join(STORE_BACKENDS)}")
+    return backend(name, datetime_fields)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot store {type(value).__name__} values")
+
+
+def _dumps(value) -> bytes:
+    # ASCII output never contains a raw newline, which ends each line
+    return (json.dumps(value, separators=(",", ":"), default=_default) + "\n").encode()
+
+
+def _fsync_directory(path: str):
+    """Make renames and new files in ``path`` durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,104 @@
+"""
+Rotating refresh tokens, so clients renew access tokens without a password
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import hashlib
+import logging
+import secrets
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.exceptions import AuthenticationError
+from app.models.user import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def refresh_token_lifetime() -> timedelta:
+    return timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+def issue(db: AsyncSession, user_id: int, family_id: Optional[str] = None) -> str:
+    """Add a refresh token for ``user_id`` to the session; the caller commits
+
+    A login starts a new family; rotations pass the family on. Only the
+    token's hash is stored.
+    """
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=refresh_token_hash(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_id=user_id,
+        expires_at=datetime.utcnow() + refresh_token_lifetime()
+    ))
+    return token
+
+
+async def rotate(db: AsyncSession, token: str) -> Tuple[int, str]:
+    """Spend ``token`` and issue its successor; returns (user_id, new token)
+
+    Spending is one UPDATE on the unique token_hash index that only matches
+    a live, unspent token, so of two requests racing with the same token
+    only one wins. A token that was already spent is being replayed, by the
+    client or by whoever copied it, so its whole family is revoked and the
+    legitimate client has to log in again.
+    """
+    token_hash = refresh_token_hash(token)
+    now = datetime.utcnow()
+    spent = await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.used_at.is_(None),
+            RefreshToken.revoked_at.is_(None),
+            RefreshToken.expires_at > now
+        )
+        .values(used_at=now)
+        .returning(RefreshToken.user_id, RefreshToken.family_id)
+    )
+    row = spent.first()
+    if row is None:
+        await _refuse(db, token_hash, now)
+    return row.user_id, issue(db, row.user_id, row.family_id)
+
+
+async def _refuse(db: AsyncSession, token_hash: str, now: datetime):
+    result = await db.execute(select(RefreshToken).where(RefreshToken.token_hash == token_hash))
+    record = result.scalar_one_or_none()
+    if record is not None and record.used_at is not None and record.revoked_at is None:
+        await db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.family_id == record.family_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+        )
+        await db.commit()
+        logger.warning("Refresh token reused for user %d, revoked its family %s", record.user_id, record.family_id)
+    raise AuthenticationError("Invalid or expired refresh token")
+
+
+async def revoke_family(db: AsyncSession, token: str, user_id: int):
+    """Revoke ``user_id``'s ``token`` and every other rotation of the same login; the caller commits"""
+    family = select(RefreshToken.family_id).where(
+        RefreshToken.token_hash == refresh_token_hash(token),
+        RefreshToken.user_id == user_id
+    )
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family.scalar_subquery(), RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+
+async def prune(db: AsyncSession, user_id: int):
+    """Delete the user's expired refresh tokens; the caller commits"""
+    await db.execute(
+        delete(RefreshToken).where(RefreshToken.user_id == user_id, RefreshToken.expires_at <= datetime.utcnow())
+    )
@@ -0,0 +1,289 @@
+"""
+Resumable uploads: chunks written at their offset into a preallocated file
+"""
+
+from typing import AsyncIterator, Dict, List, Optional
+from datetime import datetime, timedelta
+import os
+import re
+import json
+import asyncio
+import hashlib
+import secrets
+import shutil
+import aiofiles
+
+from app.core.exceptions import FileTooLarge, UploadChunkRejected, UploadSessionNotFound
+from app.services.uploads import hash_file
+
+# Largest chunk accepted in a single PUT
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Chunk size suggested to clients when a session is created
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Sessions not touched for this long are removed together with their data
+SESSION_TTL = timedelta(hours=24)
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+class UploadSession:
+    """State of one resumable upload"""
+
+    def __init__(
+        self,
+        upload_id: str,
+        filename: str,
+        file_size: int,
+        mime_type: str,
+        owner: Optional[str] = None,
+        received: Optional[List[List[int]]] = None,
+        created_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.owner = owner
+        self.received = received or []
+        self.created_at = created_at or datetime.utcnow()
+        self.updated_at = updated_at or self.created_at
+
+    @property
+    def bytes_received(self) -> int:
+        return sum(end - start for start, end in self.received)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """Whether any byte of [start, end) was already received"""
+        return any(range_start < end and start < range_end for range_start, range_end in self.received)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.received == [[0, self.file_size]] or self.file_size == 0
+
+    def add_range(self, start: int, end: int):
+        """Record [start, end) as received, merging overlapping ranges"""
+        ranges = sorted(self.received + [[start, end]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.received = merged
+        self.updated_at = datetime.utcnow()
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "file_size": self.file_size,
+            "mime_type": self.mime_type,
+            "owner": self.owner,
+            "received": self.received,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UploadSession":
+        return cls(
+            upload_id=data["upload_id"],
+            filename=data["filename"],
+            file_size=data["file_size"],
+            mime_type=data["mime_type"],
+            owner=data.get("owner"),
+            received=data["received"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            updated_at=datetime.fromisoformat(data["updated_at"])
+        )
+
+
+class UploadSessionStore:
+    """Resumable upload sessions kept next to their data in ``directory``
+
+    Each session has a preallocated ``.upload-<id>.part`` data file and a
+    ``.upload-<id>.json`` state file, so an interrupted upload can be resumed
+    after a server restart as well as after a dropped connection.
+    ``directory`` must not be served to clients.
+    """
+
+    def __init__(self, directory: str, max_file_size: Optional[int] = None):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self._sessions: Dict[str, UploadSession] = {}
+        # Held while a verified chunk is checked against and written into the data file
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def data_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f".upload-{upload_id}.part")
+
+    def _state_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f".upload-{upload_id}.json")
+
+    def _chunk_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f".upload-{upload_id}.{secrets.token_hex(8)}.chunk")
+
+    def _save(self, session: UploadSession):
+        state_path = self._state_path(session.upload_id)
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(session.to_dict(), f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def create(self, filename: str, file_size: int, mime_type: str, owner: Optional[str] = None) -> UploadSession:
+        """Start a session and preallocate its data file"""
+        if file_size < 0:
+            raise UploadChunkRejected("File size must not be negative")
+        if self.max_file_size is not None and file_size > self.max_file_size:
+            raise FileTooLarge(self.max_file_size)
+
+        self.purge_expired()
+        os.makedirs(self.directory, exist_ok=True)
+
+        session = UploadSession(
+            upload_id=secrets.token_urlsafe(16),
+            filename=os.path.basename(filename),
+            file_size=file_size,
+            mime_type=mime_type,
+            owner=owner
+        )
+
+        fd = os.open(self.data_path(session.upload_id), os.O_CREAT | os.O_WRONLY, 0o644)
+        try:
+            if file_size and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, file_size)
+                except OSError:
+                    os.ftruncate(fd, file_size)
+            else:
+                os.ftruncate(fd, file_size)
+        finally:
+            os.close(fd)
+
+        self._sessions[session.upload_id] = session
+        self._save(session)
+        return session
+
+    def get(self, upload_id: str, owner: Optional[str] = None) -> UploadSession:
+        """Look up a session, loading it from its state file if needed"""
+        if not _SESSION_ID_PATTERN.match(upload_id):
+            raise UploadSessionNotFound(upload_id)
+
+        session = self._sessions.get(upload_id)
+        if session is None:
+            try:
+                with open(self._state_path(upload_id)) as f:
+                    session = UploadSession.from_dict(json.load(f))
+            except (FileNotFoundError, ValueError, KeyError):
+                raise UploadSessionNotFound(upload_id)
+            self._sessions[upload_id] = session
+
+        if owner is not None and session.owner != owner:
+            raise UploadSessionNotFound(upload_id)
+        return session
+
+    async def write_chunk(
+        self,
+        session: UploadSession,
+        offset: int,
+        body: AsyncIterator[bytes],
+        expected_sha256: str
+    ) -> UploadSession:
+        """Write a chunk at ``offset`` and record it once its digest matches
+
+        The chunk is staged in a file of its own and only copied into the
+        data file after its digest matches, so a bad chunk never touches
+        bytes already received. Chunks overlapping received ranges are
+        rejected; a client that lost a response should ask for the session
+        state and continue from there.
+        """
+        if offset < 0 or offset > session.file_size:
+            raise UploadChunkRejected(f"Offset {offset} is outside the file")
+        if session.overlaps(offset, offset + 1):
+            raise UploadChunkRejected(f"Offset {offset} was already received")
+
+        digest = hashlib.sha256()
+        position = offset
+        chunk_path = self._chunk_path(session.upload_id)
+        try:
+            async with aiofiles.open(chunk_path, "wb") as f:
+                async for piece in body:
+                    if not piece:
+                        continue
+                    position += len(piece)
+                    if position > session.file_size:
+                        raise UploadChunkRejected("Chunk extends past the declared file size")
+                    if position - offset > MAX_CHUNK_SIZE:
+                        raise UploadChunkRejected(f"Chunk exceeds {MAX_CHUNK_SIZE} bytes")
+                    digest.update(piece)
+                    await f.write(piece)
+
+            if digest.hexdigest() != expected_sha256.strip().lower():
+                raise UploadChunkRejected("Chunk digest mismatch")
+            if position == offset:
+                return session
+
+            async with self._locks.setdefault(session.upload_id, asyncio.Lock()):
+                # Checked again here, a concurrent request may have filled the range meanwhile
+                if session.overlaps(offset, position):
+                    raise UploadChunkRejected(f"Bytes {offset}-{position - 1} overlap data already received")
+                await asyncio.to_thread(self._copy_chunk, chunk_path, session.upload_id, offset)
+                session.add_range(offset, position)
+                self._save(session)
+        finally:
+            try:
+                os.remove(chunk_path)
+            except FileNotFoundError:
+                pass
+        return session
+
+    def _copy_chunk(self, chunk_path: str, upload_id: str, offset: int):
+        with open(chunk_path, "rb") as src, open(self.data_path(upload_id), "r+b") as dst:
+            dst.seek(offset)
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    def ensure_complete(self, session: UploadSession):
+        """Raise UploadChunkRejected unless every byte has been received"""
+        if not session.is_complete:
+            raise UploadChunkRejected(
+                f"Upload incomplete: {session.bytes_received} of {session.file_size} bytes received"
+            )
+
+    async def finalize(self, session: UploadSession) -> str:
+        """Check the upload is complete and return the SHA-256 of the whole file"""
+        self.ensure_complete(session)
+        return await asyncio.to_thread(hash_file, self.data_path(session.upload_id))
+
+    def discard(self, session: UploadSession, keep_data: bool = False):
+        """Forget a session; the data file is kept when it was moved into place"""
+        self._sessions.pop(session.upload_id, None)
+        self._locks.pop(session.upload_id, None)
+        paths = [self._state_path(session.upload_id)]
+        if not keep_data:
+            paths.append(self.data_path(session.upload_id))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def purge_expired(self):
+        """Remove sessions that have not received data within SESSION_TTL"""
+        cutoff = datetime.utcnow() - SESSION_TTL
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not (entry.startswith(".upload-") and entry.endswith(".json")):
+                continue
+            upload_id = entry[len(".upload-"):-len(".json")]
+            try:
+                session = self.get(upload_id)
+            except UploadSessionNotFound:
+                continue
+            if session.updated_at < cutoff:
+                self.discard(session)
+
@@ -0,0 +1,226 @@
+"""
+Library scanner: indexes media already present under the library roots
+"""
+
+from sqlalchemy import select
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import time
+import asyncio
+import logging
+import mimetypes
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, dialect_insert, update_rows
+from app.models.media import MediaFile
+from app.services.cache import invalidate_media
+from app.services.facets import facet_aggregator
+from app.services.uploads import classify_extension
+
+logger = logging.getLogger(__name__)
+
+# (path, size, mtime, media_type)
+ScannedEntry = Tuple[str, int, float, str]
+
+
+def get_library_roots() -> List[str]:
+    """Configured library roots, defaulting to MEDIA_ROOT"""
+    return [os.path.abspath(root) for root in (settings.LIBRARY_ROOTS or [settings.MEDIA_ROOT])]
+
+
+def walk_media_files(root: str) -> Iterator[ScannedEntry]:
+    """Yield supported media files under ``root`` using os.scandir
+
+    Hidden files and directories (including in-progress uploads) are skipped
+    and directory symlinks are not followed, so link loops cannot recurse.
+    """
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                        media_type = classify_extension(os.path.splitext(entry.name)[1].lower())
+                        if media_type is None:
+                            continue
+                        stat_result = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat_result.st_size, stat_result.st_mtime, media_type
+        except OSError as e:
+            logger.warning("Cannot scan %s: %s", directory, e)
+
+
+def _scan_root(root: str) -> List[ScannedEntry]:
+    return list(walk_media_files(root))
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def media_file_values(path: str, size: int, mtime: float, media_type: str) -> dict:
+    """Column values for a MediaFile row created from a file on disk"""
+    filename = os.path.basename(path)
+    return {
+        "filename": filename,
+        "original_filename": filename,
+        "file_path": path,
+        "file_size": size,
+        "file_mtime": mtime,
+        "mime_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        "media_type": media_type,
+        "is_processed": False,
+        "is_available": True,
+        "processing_status": "pending"
+    }
+
+
+def plan_upserts(entries: List[ScannedEntry], known: Dict[str, tuple]) -> Tuple[List[dict], List[dict], int]:
+    """Split scanned files into rows to insert, rows to update and an unchanged count
+
+    ``known`` maps file paths to existing rows; matched paths are popped from
+    it, so whatever remains afterwards was not seen on disk.
+    """
+    inserts = []
+    updates = []
+    unchanged = 0
+    for path, size, mtime, media_type in entries:
+        row = known.pop(path, None)
+        if row is None:
+            inserts.append(media_file_values(path, size, mtime, media_type))
+        elif row.file_size == size and row.file_mtime in (mtime, None):
+            # Same content; uploads are recorded before their mtime is known
+            if row.file_mtime is None or not row.is_available:
+                updates.append({"id": row.id, "file_mtime": mtime, "is_available": True})
+            else:
+                unchanged += 1
+        else:
+            updates.append({
+                "id": row.id,
+                "file_size": size,
+                "file_mtime": mtime,
+                "file_hash": None,
+                "thumbnail_path": None,
+                "poster_path": None,
+                "is_available": True,
+                "is_processed": False,
+                "processing_status": "pending"
+            })
+    return inserts, updates, unchanged
+
+
+async def load_known_rows(db, condition) -> Dict[str, tuple]:
+    """Map file paths to the scan-relevant columns of matching MediaFile rows"""
+    result = await db.execute(
+        select(
+            MediaFile.id,
+            MediaFile.file_path,
+            MediaFile.file_size,
+            MediaFile.file_mtime,
+            MediaFile.is_available
+        ).where(condition)
+    )
+    return {row.file_path: row for row in result}
+
+
+async def write_batches(db, inserts: List[dict], updates: List[dict], batch_size: int):
+    """Insert and update MediaFile rows, committing once per batch
+
+    Paths the watcher or an upload recorded meanwhile are left as they are
+    rather than failing the batch on the file_path unique constraint.
+    """
+    new_file = dialect_insert(db, MediaFile.__table__).on_conflict_do_nothing(index_elements=["file_path"])
+    for batch in _chunks(inserts, batch_size):
+        async with facet_aggregator.track(db, MediaFile.file_path.in_([values["file_path"] for values in batch])):
+            await db.execute(new_file, batch)
+        await db.commit()
+    for batch in _chunks(updates, batch_size):
+        async with facet_aggregator.track(db, MediaFile.id.in_([values["id"] for values in batch])):
+            await update_rows(db, MediaFile, batch)
+        await db.commit()
+
+
+class LibraryScanner:
+    """Walks the library roots and upserts MediaFile rows in batches
+
+    Rescans are incremental: a file whose (path, size, mtime) matches its row
+    is left alone, changed files are reset to ``pending`` so later stages
+    re-process them, and rows whose file disappeared are marked unavailable
+    rather than deleted, keeping watch history and playlists intact.
+    """
+
+    def __init__(self, roots: Optional[List[str]] = None, batch_size: Optional[int] = None):
+        self.roots = roots
+        self.batch_size = batch_size or settings.LIBRARY_SCAN_BATCH_SIZE
+        self._lock = asyncio.Lock()
+
+    async def scan(self) -> dict:
+        """Scan every root once and return counts of what changed"""
+        async with self._lock:
+            started = time.perf_counter()
+            roots = self.roots or get_library_roots()
+            totals = {"scanned": 0, "added": 0, "updated": 0, "unchanged": 0, "missing": 0}
+            for root in roots:
+                result = await self._scan_root(root)
+                for key in totals:
+                    totals[key] += result[key]
+            totals["roots"] = roots
+            totals["duration"] = round(time.perf_counter() - started, 3)
+            logger.info("Library scan finished: %s", totals)
+            return totals
+
+    async def _scan_root(self, root: str) -> dict:
+        if not os.path.isdir(root):
+            logger.warning("Library root %s does not exist", root)
+            return {"scanned": 0, "added": 0, "updated": 0, "unchanged": 0, "missing": 0}
+
+        entries = await asyncio.to_thread(_scan_root, root)
+        prefix = root.rstrip(os.sep) + os.sep
+
+        async with AsyncSessionLocal() as db:
+            known = await load_known_rows(db, MediaFile.file_path.startswith(prefix, autoescape=True))
+
+            inserts, updates, unchanged = plan_upserts(entries, known)
+            missing = [
+                {"id": row.id, "is_available": False}
+                for row in known.values() if row.is_available
+            ]
+
+            await write_batches(db, inserts, updates + missing, self.batch_size)
+        if inserts or updates or missing:
+            await facet_aggregator.invalidate()
+            await invalidate_media([values["id"] for values in updates + missing])
+
+        return {
+            "scanned": len(entries),
+            "added": len(inserts),
+            "updated": len(updates),
+            "unchanged": unchanged,
+            "missing": len(missing)
+        }
+
+    async def run_periodically(self):
+        """Scan at startup and then every LIBRARY_SCAN_INTERVAL seconds"""
+        while True:
+            try:
+                await self.scan()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Library scan failed")
+            if settings.LIBRARY_SCAN_INTERVAL <= 0:
+                return
+            await asyncio.sleep(settings.LIBRARY_SCAN_INTERVAL)
+
+
+library_scanner = LibraryScanner()
@@ -0,0 +1,133 @@
+"""
+Library search: filters, full-text and trigram matching, and sort orders
+"""
+
+from sqlalchemy import String, Text, and_, cast, func, literal_column, or_, select, union
+from sqlalchemy.dialects.postgresql import JSONB
+from typing import List, Optional
+
+from app.core.exceptions import ValidationError
+from app.models.media import MEDIA_INFO_DOCUMENT, MediaFile, MediaInfo
+
+SORT_FIELDS = ("relevance", "created_at", "title", "year", "file_size")
+SORT_ORDERS = ("asc", "desc")
+
+
+def resolve_sort(query: Optional[str], sort_by: Optional[str], sort_order: Optional[str]):
+    """Validated (sort_by, sort_order); searches rank by relevance unless told otherwise"""
+    sort_by = sort_by or ("relevance" if query else "created_at")
+    sort_order = sort_order or "desc"
+    if sort_by not in SORT_FIELDS:
+        raise ValidationError(f"sort_by must be one of: {', '.join(SORT_FIELDS)}")
+    if sort_order not in SORT_ORDERS:
+        raise ValidationError("sort_order must be asc or desc")
+    if sort_by == "relevance" and not query:
+        sort_by = "created_at"
+    return sort_by, sort_order
+
+
+def needs_metadata(query=None, genre=None, year=None, tags=None, sort_by=None) -> bool:
+    return bool(query or genre or year is not None or tags or sort_by in ("relevance", "title", "year"))
+
+
+def join_metadata(stmt):
+    # Outer join: files without metadata are still found by filename
+    return stmt.outerjoin(MediaInfo, MediaInfo.media_file_id == MediaFile.id)
+
+
+def _tsquery(query: str):
+    return func.websearch_to_tsquery(literal_column("'simple'"), query)
+
+
+def _matching_ids(query: str, dialect: str):
+    """Ids of files matching ``query``, as a subquery the indexes can answer"""
+    if dialect == "postgresql":
+        # Each branch stays on one table so PostgreSQL can OR its GIN
+        # indexes together; %> is pg_trgm word similarity, which tolerates
+        # typos in any word of a title or filename
+        return union(
+            select(MediaInfo.media_file_id).where(or_(
+                literal_column(MEDIA_INFO_DOCUMENT).op("@@")(_tsquery(query)),
+                MediaInfo.title.op("%>")(query),
+                MediaInfo.title.icontains(query, autoescape=True)
+            )),
+            select(MediaFile.id).where(or_(
+                MediaFile.filename.op("%>")(query),
+                MediaFile.original_filename.op("%>")(query),
+                MediaFile.filename.icontains(query, autoescape=True),
+                MediaFile.original_filename.icontains(query, autoescape=True)
+            ))
+        )
+    # Other databases get plain substring matching
+    return union(
+        select(MediaInfo.media_file_id).where(or_(
+            MediaInfo.title.icontains(query, autoescape=True),
+            MediaInfo.description.icontains(query, autoescape=True),
+            cast(MediaInfo.cast, Text).icontains(query, autoescape=True),
+            cast(MediaInfo.tags, Text).icontains(query, autoescape=True)
+        )),
+        select(MediaFile.id).where(or_(
+            MediaFile.filename.icontains(query, autoescape=True),
+            MediaFile.original_filename.icontains(query, autoescape=True)
+        ))
+    )
+
+
+def apply_filters(
+    stmt,
+    dialect: str,
+    query: Optional[str] = None,
+    media_type: Optional[str] = None,
+    genre: Optional[str] = None,
+    year: Optional[int] = None,
+    tags: Optional[List[str]] = None
+):
+    """Restrict a statement over MediaFile (joined to MediaInfo when needed)"""
+    if media_type:
+        stmt = stmt.where(MediaFile.media_type == media_type)
+    if query:
+        stmt = stmt.where(MediaFile.id.in_(_matching_ids(query, dialect)))
+    if genre:
+        stmt = stmt.where(func.lower(MediaInfo.genre) == genre.lower())
+    if year is not None:
+        stmt = stmt.where(MediaInfo.year == year)
+    if tags:
+        if dialect == "postgresql":
+            stmt = stmt.where(cast(MediaInfo.tags, JSONB).contains(tags))
+        else:
+            stmt = stmt.where(and_(*(
+                cast(MediaInfo.tags, String).contains(f'"{tag}"', autoescape=True) for tag in tags
+            )))
+    return stmt
+
+
+def relevance(query: str, dialect: str):
+    """Score of a match, higher is better"""
+    if dialect != "postgresql":
+        return MediaFile.created_at
+    return func.greatest(
+        func.ts_rank(literal_column(MEDIA_INFO_DOCUMENT), _tsquery(query)),
+        func.word_similarity(query, MediaInfo.title),
+        func.word_similarity(query, MediaFile.filename)
+    )
+
+
+def sort_columns(sort_by: str, sort_order: str, query: Optional[str], dialect: str):
+    """ORDER BY clauses for a sort, ending with id so pages never overlap"""
+    if sort_by == "relevance":
+        key = relevance(query, dialect)
+    else:
+        key = {
+            "created_at": MediaFile.created_at,
+            "title": func.lower(func.coalesce(MediaInfo.title, MediaFile.filename)),
+            "year": MediaInfo.year,
+            "file_size": MediaFile.file_size
+        }[sort_by]
+    if key is MediaFile.created_at:
+        # NOT NULL, and ordered exactly as ix_media_files_created_at_id scans
+        if sort_order == "asc":
+            return [key.asc(), MediaFile.id.asc()]
+        return [key.desc(), MediaFile.id.desc()]
+    if sort_order == "asc":
+        return [key.asc().nulls_last(), MediaFile.id.asc()]
+    return [key.desc().nulls_last(), MediaFile.id.desc()]
@@ -0,0 +1,39 @@
+"""
+Single-flight: concurrent calls for the same key share one execution
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls per key
+
+    The first call for a key starts the function in a task that no caller
+    owns; every caller, the first included, waits for it through
+    ``asyncio.shield`` and shares its result or exception, so a caller that
+    is cancelled only stops waiting and the others still get the result.
+    Once it finishes the key is forgotten, so later calls run again (pair
+    it with a cache for anything worth keeping).
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, asyncio.Task] = {}
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, function: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieved here so a failure nobody waited for is not logged as unhandled
+        if not task.cancelled():
+            task.exception()
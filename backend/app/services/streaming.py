@@ -0,0 +1,320 @@
+"""
+HTTP range streaming for media files (RFC 9110 partial content)
+"""
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from email.utils import formatdate, parsedate
+from hashlib import md5
+from mimetypes import guess_type
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+import os
+import secrets
+import aiofiles
+
+from app.core.config import settings
+
+# Ranges beyond this (after merging) make the Range header be ignored
+MAX_RANGES = 32
+
+ByteRange = Tuple[int, int]  # inclusive start and end offsets
+
+
+def parse_range_header(range_header: str, file_size: int) -> Optional[List[ByteRange]]:
+    """Parse a ``Range: bytes=...`` header
+
+    Returns None when the header is malformed or uses another unit (the
+    header is then ignored and the full file served), an empty list when no
+    range can be satisfied, and otherwise the sorted, merged byte ranges.
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        start_text, dash, end_text = spec.partition("-")
+        if not dash:
+            return None
+        start_text, end_text = start_text.strip(), end_text.strip()
+        if start_text and not start_text.isdigit() or end_text and not end_text.isdigit():
+            return None
+
+        if not start_text:
+            # Suffix range: the last N bytes
+            if not end_text:
+                return None
+            suffix_length = int(end_text)
+            if suffix_length > 0 and file_size > 0:
+                ranges.append((max(file_size - suffix_length, 0), file_size - 1))
+            continue
+
+        start = int(start_text)
+        if end_text:
+            end = int(end_text)
+            if end < start:
+                return None
+        else:
+            end = file_size - 1
+        if start < file_size:
+            ranges.append((start, min(end, file_size - 1)))
+
+    ranges.sort()
+    merged: List[ByteRange] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """Strong validator derived from modification time and size"""
+    etag_base = f"{stat_result.st_mtime_ns}-{stat_result.st_size}"
+    return '"' + md5(etag_base.encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def _etag_matches(header_value: str, etag: str, weak: bool) -> bool:
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _is_not_modified(request_headers: Headers, etag: str, last_modified: str) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag, weak=True)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = parsedate(if_modified_since)
+        modified = parsedate(last_modified)
+        return since is not None and modified is not None and since >= modified
+    return False
+
+
+def _if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Range requires a strong comparison
+        return if_range == etag
+    return parsedate(if_range) is not None and parsedate(if_range) == parsedate(last_modified)
+
+
+class MediaFileResponse(Response):
+    """File response that serves the whole file or a set of byte ranges
+
+    The ranges are read in chunks through Python. This is the fallback;
+    the fast path is nginx offload (X_ACCEL_REDIRECT_ENABLED, see
+    ``build_offload_response``), where nginx sends the file with sendfile
+    and the worker only checks access.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        ranges: Optional[List[ByteRange]] = None,
+        headers: Optional[dict] = None,
+        media_type: Optional[str] = None,
+        method: Optional[str] = None
+    ):
+        self.path = path
+        self.file_size = stat_result.st_size
+        self.ranges = ranges
+        self.send_header_only = method is not None and method.upper() == "HEAD"
+        self.media_type = media_type
+        self.background = None
+        self.status_code = 206 if ranges else 200
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+
+        self._boundary = None
+        self._part_headers: List[bytes] = []
+        if not ranges:
+            self.headers["content-length"] = str(self.file_size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end}/{self.file_size}"
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            self._boundary = secrets.token_hex(16)
+            content_length = 0
+            for start, end in ranges:
+                part_header = (
+                    f"\r\n--{self._boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{self.file_size}\r\n\r\n"
+                ).encode("latin-1")
+                self._part_headers.append(part_header)
+                content_length += len(part_header) + end - start + 1
+            content_length += len(self._closing_boundary)
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self._boundary}"
+            self.headers["content-length"] = str(content_length)
+
+    @property
+    def _closing_boundary(self) -> bytes:
+        return f"\r\n--{self._boundary}--\r\n".encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        ranges = self.ranges or [(0, self.file_size - 1)]
+        async with aiofiles.open(self.path, "rb") as file:
+            await self._send_ranges(send, ranges, file)
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_ranges(self, send: Send, ranges: List[ByteRange], file):
+        for index, (start, end) in enumerate(ranges):
+            if self._boundary is not None:
+                await send({"type": "http.response.body", "body": self._part_headers[index], "more_body": True})
+
+            count = end - start + 1
+            if count <= 0:
+                continue
+            await file.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        if self._boundary is not None:
+            await send({"type": "http.response.body", "body": self._closing_boundary, "more_body": True})
+
+
+def _content_disposition(filename: str, content_disposition_type: str) -> str:
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"{content_disposition_type}; filename*=utf-8''{quoted_filename}"
+    return f'{content_disposition_type}; filename="{filename}"'
+
+
+def build_offload_response(
+    path: str,
+    root: str,
+    prefix: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition_type: str = "attachment"
+) -> Optional[Response]:
+    """Hand a file under ``root`` to nginx with an X-Accel-Redirect header
+
+    nginx maps ``prefix`` to ``root`` in an internal location and serves the
+    bytes itself (sendfile, Range, validators). Returns None when ``path``
+    is not inside ``root``, in which case the caller streams it instead.
+    """
+    real_root = os.path.realpath(root)
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([real_root, real_path]) != real_root or real_path == real_root:
+        return None
+
+    relative_path = os.path.relpath(real_path, real_root).replace(os.sep, "/")
+    headers = {"x-accel-redirect": prefix.rstrip("/") + "/" + quote(relative_path)}
+    if filename is not None:
+        headers["content-disposition"] = _content_disposition(filename, content_disposition_type)
+    return Response(headers=headers, media_type=media_type)
+
+
+def build_file_response(
+    path: str,
+    stat_result: os.stat_result,
+    request_headers: Headers,
+    method: str = "GET",
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition_type: str = "attachment"
+) -> Response:
+    """Pick the right response (200, 206, 304 or 416) for a file request"""
+    if media_type is None:
+        media_type = guess_type(filename or path)[0] or "application/octet-stream"
+
+    etag = make_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {"etag": etag, "last-modified": last_modified}
+    if filename is not None:
+        headers["content-disposition"] = _content_disposition(filename, content_disposition_type)
+
+    if _is_not_modified(request_headers, etag, last_modified):
+        return Response(status_code=304, headers={"etag": etag, "last-modified": last_modified})
+
+    ranges = None
+    range_header = request_headers.get("range")
+    if range_header and method.upper() in ("GET", "HEAD"):
+        if_range = request_headers.get("if-range")
+        if if_range is None or _if_range_matches(if_range, etag, last_modified):
+            ranges = parse_range_header(range_header, stat_result.st_size)
+            if ranges == []:
+                return Response(
+                    status_code=416,
+                    headers={"content-range": f"bytes */{stat_result.st_size}", "accept-ranges": "bytes"}
+                )
+
+    return MediaFileResponse(
+        path,
+        stat_result,
+        ranges=ranges,
+        headers=headers,
+        media_type=media_type,
+        method=method
+    )
+
+
+class RangeStaticFiles(StaticFiles):
+    """StaticFiles mount that honours Range, If-Range and conditional requests
+
+    With ``offload_prefix`` set and X_ACCEL_REDIRECT_ENABLED on, files are
+    handed to nginx through X-Accel-Redirect instead of being sent by Python.
+    """
+
+    def __init__(self, *args, offload_prefix: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.offload_prefix = offload_prefix
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200
+    ) -> Response:
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        if self.offload_prefix and self.directory is not None and settings.X_ACCEL_REDIRECT_ENABLED:
+            response = build_offload_response(str(full_path), str(self.directory), self.offload_prefix)
+            if response is not None:
+                return response
+        return build_file_response(
+            str(full_path),
+            stat_result,
+            Headers(scope=scope),
+            method=scope["method"]
+        )
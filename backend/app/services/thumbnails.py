@@ -0,0 +1,311 @@
+"""
+Thumbnails and posters: rendered once per source file and kept in an LRU cache
+"""
+
+from sqlalchemy import select
+from typing import Dict, List, Optional, Set, Tuple
+import os
+import asyncio
+import hashlib
+import logging
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, update_rows
+from app.core.exceptions import MediaProcessingError
+from app.models.media import MediaFile
+from app.services.cache import invalidate_media
+from app.services.disk_cache import DiskCache
+from app.services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+Size = Tuple[int, int]
+
+THUMBNAIL = "thumbnail"
+POSTER = "poster"
+
+# Output format name -> (file extension, Pillow format, content type)
+IMAGE_FORMATS = {
+    "jpeg": ("jpg", "JPEG", "image/jpeg"),
+    "webp": ("webp", "WEBP", "image/webp")
+}
+
+
+def get_worker_count() -> int:
+    """Number of thumbnails allowed to render at once"""
+    return settings.THUMBNAIL_WORKERS or os.cpu_count() or 1
+
+
+def variant_size(variant: str) -> Size:
+    return tuple(settings.POSTER_SIZE if variant == POSTER else settings.THUMBNAIL_SIZE)
+
+
+def derivative_size(width: Optional[int], height: Optional[int]) -> Size:
+    """Round a requested box up to IMAGE_SIZE_STEPS; a missing side stays 0 (free)
+
+    Keeps the number of derivatives per file small, so arbitrary sizes
+    cannot fill the cache and push out real thumbnails.
+    """
+    def snap(value: Optional[int]) -> int:
+        if not value:
+            return 0
+        steps = [step for step in settings.IMAGE_SIZE_STEPS if step <= settings.IMAGE_MAX_DIMENSION]
+        return next((step for step in sorted(steps) if step >= value), settings.IMAGE_MAX_DIMENSION)
+
+    return snap(width), snap(height)
+
+
+def cache_key(file_hash: str, size: Size, image_format: str = "jpeg") -> str:
+    """Path of a rendition relative to THUMBNAILS_ROOT
+
+    Keyed by content hash, size and format only, so copies of the same file
+    share their renditions and a rendition never has to be invalidated.
+    """
+    return f"{file_hash[:2]}/{file_hash}-{size[0]}x{size[1]}.{IMAGE_FORMATS[image_format][0]}"
+
+
+def source_hash(path: str, size: int, mtime: float) -> str:
+    """Stands in for the content hash of a file that was never hashed
+
+    Built from the path, size and mtime, so it changes whenever the file is
+    replaced or modified, without reading the file.
+    """
+    return hashlib.sha256(f"{path}\0{size}\0{mtime}".encode()).hexdigest()
+
+
+def key_hash(key: str) -> str:
+    """Content hash a cache key was built from"""
+    return os.path.basename(key).split("-", 1)[0]
+
+
+def ffmpeg_quality(quality: int) -> int:
+    """Map a 1-100 JPEG quality to ffmpeg's 2-31 mjpeg qscale (lower is better)"""
+    return max(2, min(31, round(31 - quality * 29 / 100)))
+
+
+def _temp_path(output: str) -> str:
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.{os.getpid()}.tmp{os.path.splitext(name)[1]}")
+
+
+def _pillow_format(output: str) -> str:
+    extension = os.path.splitext(output)[1].lstrip(".")
+    return next((fmt for ext, fmt, _type in IMAGE_FORMATS.values() if ext == extension), "JPEG")
+
+
+def render_image(source: str, outputs: List[Tuple[str, Size]], quality: int):
+    """Resize an image into each (path, size) with Pillow, largest first
+
+    A 0 in a size leaves that dimension free, so (400, 0) means 400 wide at
+    the source's aspect ratio. Images are only ever scaled down.
+    """
+    with Image.open(source) as image:
+        boxes = [(output, (size[0] or image.width, size[1] or image.height)) for output, size in outputs]
+        boxes.sort(key=lambda item: item[1][0] * item[1][1], reverse=True)
+        # Let the JPEG decoder downscale while decoding instead of after
+        image.draft("RGB", boxes[0][1])
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for output, box in boxes:
+            image.thumbnail(box, Image.LANCZOS)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            temp_path = _temp_path(output)
+            image.save(temp_path, _pillow_format(output), quality=quality, optimize=True)
+            os.replace(temp_path, output)
+
+
+async def render_video_frame(source: str, output: str, size: Size, offset: float, timeout: Optional[float] = None):
+    """Grab one frame at ``offset`` seconds with ffmpeg, scaled to fit ``size``
+
+    Audio files yield their embedded cover art, if any.
+    """
+    timeout = settings.THUMBNAIL_TIMEOUT if timeout is None else timeout
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    temp_path = _temp_path(output)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            settings.FFMPEG_PATH,
+            "-v", "error",
+            "-y",
+            "-ss", f"{offset:.3f}",
+            "-i", source,
+            "-frames:v", "1",
+            "-vf", f"scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease",
+            "-q:v", str(ffmpeg_quality(settings.THUMBNAIL_QUALITY)),
+            temp_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        raise MediaProcessingError(f"cannot run ffmpeg: {e}")
+
+    try:
+        _stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        _remove(temp_path)
+        raise MediaProcessingError(f"ffmpeg timed out after {timeout}s on {source}")
+
+    if process.returncode != 0 or not os.path.exists(temp_path):
+        _remove(temp_path)
+        raise MediaProcessingError(stderr.decode(errors="replace").strip() or f"no frame extracted from {source}")
+    os.replace(temp_path, output)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ThumbnailGenerator:
+    """Renders thumbnails and posters for media files
+
+    Renditions are keyed by content hash for uploads, which are hashed on
+    arrival, so copies share them. Scanned files are never read in full
+    for this; they are keyed by path, size and mtime instead. At most
+    ``get_worker_count()`` renders run at once; Pillow work runs in threads
+    and ffmpeg in subprocesses.
+    """
+
+    def __init__(self, cache: Optional[DiskCache] = None, batch_size: Optional[int] = None, workers: Optional[int] = None):
+        self.cache = cache or DiskCache(settings.THUMBNAILS_ROOT, settings.THUMBNAIL_CACHE_MAX_BYTES)
+        self.batch_size = batch_size or settings.THUMBNAIL_BATCH_SIZE
+        self._semaphore = asyncio.Semaphore(workers or get_worker_count())
+        self._renders = SingleFlight()
+        self._failed: Set[int] = set()
+
+    async def _content_hash(self, media_file) -> str:
+        if media_file.file_hash:
+            return media_file.file_hash
+        if media_file.thumbnail_path:
+            return key_hash(media_file.thumbnail_path)
+        if media_file.file_mtime is not None:
+            return source_hash(media_file.file_path, media_file.file_size, media_file.file_mtime)
+        stat_result = await asyncio.to_thread(os.stat, media_file.file_path)
+        return source_hash(media_file.file_path, stat_result.st_size, stat_result.st_mtime)
+
+    async def ensure(self, media_file) -> Dict[str, str]:
+        """Make sure both renditions of ``media_file`` exist; returns their cache keys
+
+        Stored ``thumbnail_path``/``poster_path`` are reused as keys, so a
+        rendition evicted from the cache is re-rendered without re-hashing.
+        """
+        if media_file.thumbnail_path and media_file.poster_path:
+            keys = {THUMBNAIL: media_file.thumbnail_path, POSTER: media_file.poster_path}
+        else:
+            file_hash = await self._content_hash(media_file)
+            keys = {variant: cache_key(file_hash, variant_size(variant)) for variant in (THUMBNAIL, POSTER)}
+
+        missing = [variant for variant, key in keys.items() if not self.cache.lookup(key)]
+        if missing:
+            # Concurrent requests for the same content wait for the first render
+            await self._renders.do(keys[POSTER], lambda: self._render(media_file, keys, missing))
+        return keys
+
+    async def derivative(self, media_file, size: Size, image_format: str = "jpeg") -> str:
+        """Make sure a resized copy of the file's artwork exists; returns its cache key
+
+        Images are resized from the original, other media from their poster.
+        """
+        keys = await self.ensure(media_file)
+        key = cache_key(key_hash(keys[POSTER]), size, image_format)
+        if not self.cache.lookup(key):
+            source = media_file.file_path if media_file.media_type == "image" else self.cache.path(keys[POSTER])
+            await self._renders.do(key, lambda: self._render_derivative(source, key, size))
+        return key
+
+    async def _render_derivative(self, source: str, key: str, size: Size):
+        async with self._semaphore:
+            try:
+                await asyncio.to_thread(render_image, source, [(self.cache.path(key), size)], settings.THUMBNAIL_QUALITY)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                raise MediaProcessingError(f"cannot render {source}: {e}")
+        await asyncio.to_thread(self.cache.added, key)
+
+    async def _render(self, media_file, keys: Dict[str, str], variants: List[str]):
+        async with self._semaphore:
+            await self._render_variants(media_file, keys, variants)
+
+    async def _render_variants(self, media_file, keys: Dict[str, str], variants: List[str]):
+        outputs = [(self.cache.path(keys[variant]), variant_size(variant)) for variant in variants]
+
+        if media_file.media_type == "image":
+            try:
+                await asyncio.to_thread(render_image, media_file.file_path, outputs, settings.THUMBNAIL_QUALITY)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                raise MediaProcessingError(f"cannot render {media_file.file_path}: {e}")
+        else:
+            # One ffmpeg run for the poster frame; smaller sizes are cut from it
+            poster = self.cache.path(keys[POSTER])
+            if POSTER in variants:
+                offset = (media_file.duration or 0) * 0.1 if media_file.media_type == "video" else 0
+                await render_video_frame(media_file.file_path, poster, variant_size(POSTER), offset)
+            smaller = [(path, size) for path, size in outputs if path != poster]
+            if smaller:
+                await asyncio.to_thread(render_image, poster, smaller, settings.THUMBNAIL_QUALITY)
+
+        for variant in variants:
+            await asyncio.to_thread(self.cache.added, keys[variant])
+
+    async def _claim_batch(self) -> list:
+        async with AsyncSessionLocal() as db:
+            query = (
+                select(MediaFile)
+                .where(
+                    MediaFile.thumbnail_path.is_(None),
+                    MediaFile.is_processed.is_(True),
+                    MediaFile.is_available.is_(True)
+                )
+                .order_by(MediaFile.id)
+                .limit(self.batch_size)
+            )
+            if self._failed:
+                query = query.where(MediaFile.id.notin_(self._failed))
+            result = await db.execute(query)
+            return list(result.scalars())
+
+    async def process_batch(self) -> int:
+        """Render art for one batch of processed files; returns how many were attempted"""
+        media_files = await self._claim_batch()
+        if not media_files:
+            return 0
+
+        async def generate(media_file) -> Optional[dict]:
+            try:
+                keys = await self.ensure(media_file)
+            except (MediaProcessingError, OSError) as e:
+                detail = e.detail if isinstance(e, MediaProcessingError) else str(e)
+                logger.warning("Thumbnail generation failed for %s: %s", media_file.file_path, detail)
+                self._failed.add(media_file.id)
+                return None
+            return {"id": media_file.id, "thumbnail_path": keys[THUMBNAIL], "poster_path": keys[POSTER]}
+
+        results = [values for values in await asyncio.gather(*(generate(m) for m in media_files)) if values]
+        if results:
+            async with AsyncSessionLocal() as db:
+                await update_rows(db, MediaFile, results)
+                await db.commit()
+            await invalidate_media([values["id"] for values in results])
+
+        logger.info("Generated art for %d files, %d failed", len(results), len(media_files) - len(results))
+        return len(media_files)
+
+    async def run_forever(self):
+        """Render art for files as metadata extraction completes"""
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Thumbnail batch failed")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(settings.METADATA_POLL_INTERVAL)
+
+
+thumbnail_generator = ThumbnailGenerator()
@@ -0,0 +1,115 @@
+"""
+Cache of verified access tokens, so repeat bearer requests skip jwt.decode
+"""
+
+from typing import Dict, Optional, Set
+import hashlib
+import logging
+import time
+
+from jose import JWTError, jwt
+
+from app.core.config import settings
+from app.services.cache import CacheUnavailable, LRUCache, SharedCache, shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """Claims of tokens whose signature and expiry were checked, by token digest
+
+    A repeat token costs a hash and a dict lookup instead of an HMAC check
+    and JSON parsing. Entries never outlive the token's ``exp`` nor
+    TOKEN_VERIFY_CACHE_TTL seconds, and the least recently used go first
+    past TOKEN_VERIFY_CACHE_MAX_ENTRIES. Raw tokens are never kept.
+
+    ``revoke`` drops a token here and lists it until it expires, in this
+    worker and in the shared cache; other workers see the shared list when
+    they next verify the token, so within TOKEN_VERIFY_CACHE_TTL seconds.
+    With ``shared=None`` revocations stay in this worker.
+    """
+
+    def __init__(self, shared: Optional[SharedCache] = shared_cache, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl or settings.TOKEN_VERIFY_CACHE_TTL
+        self.local = LRUCache(max_entries or settings.TOKEN_VERIFY_CACHE_MAX_ENTRIES, self.ttl)
+        self.shared = shared
+        # digest -> token exp (epoch seconds), kept until then
+        self._revoked: Dict[bytes, float] = {}
+        self._prune_at = 1024
+        # Revocations not yet written to the shared cache
+        self._pending: Set[bytes] = set()
+
+    def _key(self, digest: bytes) -> str:
+        return f"jwt:revoked:{digest.hex()}"
+
+    async def verify(self, token: str) -> Optional[dict]:
+        """The token's claims, or None if it is invalid, expired or revoked"""
+        digest = token_digest(token)
+        claims = self.local.get(digest)
+        if claims is not None:
+            return claims
+        if digest in self._revoked:
+            return None
+        try:
+            claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
+            return None
+        if await self._revoked_elsewhere(digest, claims):
+            return None
+        remaining = claims["exp"] - time.time() if "exp" in claims else self.ttl
+        if remaining > 0:
+            self.local.set(digest, claims, min(self.ttl, remaining))
+        return claims
+
+    async def revoke(self, token: str, claims: Optional[dict] = None):
+        """Refuse ``token`` from now on; ``claims`` saves decoding it again"""
+        if claims is None:
+            try:
+                claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            except JWTError:
+                return
+        digest = token_digest(token)
+        self.local.delete(digest)
+        expires = float(claims.get("exp", time.time() + self.ttl))
+        self._remember(digest, expires)
+        if self.shared is not None:
+            self._pending.add(digest)
+            try:
+                await self._replay()
+            except CacheUnavailable:
+                logger.debug("Could not list a revoked token in the shared cache yet")
+
+    async def _revoked_elsewhere(self, digest: bytes, claims: dict) -> bool:
+        if self.shared is None:
+            return False
+        try:
+            if self._pending:
+                await self._replay()
+            revoked = await self.shared.get(self._key(digest)) is not None
+        except CacheUnavailable:
+            return False
+        if revoked:
+            self._remember(digest, float(claims.get("exp", time.time() + self.ttl)))
+        return revoked
+
+    def _remember(self, digest: bytes, expires: float):
+        self._revoked[digest] = expires
+        if len(self._revoked) > self._prune_at:
+            now = time.time()
+            self._revoked = {key: exp for key, exp in self._revoked.items() if exp > now}
+            self._prune_at = max(1024, 2 * len(self._revoked))
+
+    async def _replay(self):
+        now = time.time()
+        for digest in list(self._pending):
+            remaining = self._revoked.get(digest, now) - now
+            if remaining > 0:
+                await self.shared.set(self._key(digest), b"1", ttl=remaining)
+            self._pending.discard(digest)
+
+
+verified_tokens = VerifiedTokenCache()
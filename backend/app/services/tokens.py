@@ -0,0 +1,147 @@
+"""
+Session tokens for the lightweight (no database) servers: expiry sweeping and
+per-user revocation
+"""
+
+from datetime import datetime, timedelta
+from heapq import heapify, heappop, heappush
+from typing import Callable, Dict, List, MutableMapping, Optional, Tuple
+import asyncio
+import logging
+import secrets
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore:
+    """Opaque bearer tokens, indexed by user and by expiry
+
+    ``records`` maps each token to {"username", "created_at", "expires_at"}
+    and may be a plain dict or a persistent RecordStore. Each user's tokens
+    are also kept in issue order, so logging a user out everywhere touches
+    only that user's tokens, and a heap orders tokens by expiry, so a sweep
+    removes the expired ones without looking at the rest.
+
+    A user holds at most ``max_per_user`` tokens; issuing one more revokes
+    the oldest. Revoked tokens leave their heap entry behind until it is
+    popped. The sweep rebuilds the heap once such entries outnumber live
+    tokens, and revoking does so itself only past twice that, so requests
+    rarely pay for a rebuild while memory stays proportional to the live
+    tokens however many logins the server has seen.
+    """
+
+    def __init__(
+        self,
+        records: MutableMapping[str, dict],
+        ttl: timedelta,
+        max_per_user: Optional[int] = None,
+        clock: Callable[[], datetime] = datetime.utcnow
+    ):
+        self.records = records
+        self.ttl = ttl
+        self.max_per_user = max_per_user or settings.TOKEN_MAX_PER_USER
+        self.clock = clock
+        # username -> tokens in issue order (a dict used as an ordered set)
+        self._by_user: Dict[str, Dict[str, None]] = {}
+        self._expiry: List[Tuple[datetime, str]] = []
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def load(self):
+        """Index the tokens already in ``records``, dropping expired ones"""
+        self._by_user.clear()
+        now = self.clock()
+        live = []
+        for token, record in sorted(self.records.items(), key=lambda item: item[1]["created_at"]):
+            if record["expires_at"] <= now:
+                del self.records[token]
+            else:
+                self._by_user.setdefault(record["username"], {})[token] = None
+                live.append((record["expires_at"], token))
+        heapify(live)
+        self._expiry = live
+        self._stale = 0
+
+    def issue(self, username: str) -> str:
+        """Create a token for ``username``, revoking its oldest beyond the limit"""
+        token = secrets.token_urlsafe(32)
+        now = self.clock()
+        expires_at = now + self.ttl
+        self.records[token] = {"username": username, "created_at": now, "expires_at": expires_at}
+        tokens = self._by_user.setdefault(username, {})
+        tokens[token] = None
+        heappush(self._expiry, (expires_at, token))
+        while len(tokens) > self.max_per_user:
+            self.revoke(next(iter(tokens)))
+        return token
+
+    def get(self, token: str) -> Optional[dict]:
+        """The token's record, expired or not, or None if unknown or revoked"""
+        return self.records.get(token)
+
+    def revoke(self, token: str) -> bool:
+        record = self.records.get(token)
+        if record is None:
+            return False
+        self._remove(token, record["username"])
+        self._stale += 1
+        if self._stale > 2 * len(self.records) + self.max_per_user:
+            self._rebuild()
+        return True
+
+    def revoke_user(self, username: str) -> int:
+        """Revoke every token of ``username``; returns how many there were"""
+        tokens = self._by_user.pop(username, {})
+        for token in tokens:
+            del self.records[token]
+        self._stale += len(tokens)
+        if self._stale > 2 * len(self.records) + self.max_per_user:
+            self._rebuild()
+        return len(tokens)
+
+    def tokens_of(self, username: str) -> List[str]:
+        return list(self._by_user.get(username, ()))
+
+    def sweep(self) -> int:
+        """Remove tokens past their expiry; returns how many"""
+        now = self.clock()
+        removed = 0
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            _, token = heappop(expiry)
+            record = self.records.get(token)
+            if record is None:
+                self._stale -= 1
+            else:
+                self._remove(token, record["username"])
+                removed += 1
+        if self._stale > len(self.records):
+            self._rebuild()
+        return removed
+
+    async def run_forever(self, interval: Optional[float] = None):
+        """Sweep every ``interval`` seconds (TOKEN_SWEEP_INTERVAL)"""
+        interval = interval or settings.TOKEN_SWEEP_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.info("Swept %d expired tokens, %d remain", removed, len(self))
+
+    def _remove(self, token: str, username: str):
+        del self.records[token]
+        tokens = self._by_user.get(username)
+        if tokens is not None:
+            tokens.pop(token, None)
+            if not tokens:
+                del self._by_user[username]
+
+    def _rebuild(self):
+        """Drop heap entries of revoked tokens"""
+        self._expiry = [entry for entry in self._expiry if entry[1] in self.records]
+        heapify(self._expiry)
+        self._stale = 0
@@ -0,0 +1,519 @@
+"""
+Transcoding scheduler: a persistent ffmpeg job queue on top of TranscodedFile
+"""
+
+from sqlalchemy import select, update, insert, or_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import os
+import time
+import socket
+import secrets
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.exceptions import MediaProcessingError, ValidationError
+from app.models.media import MediaFile, TranscodedFile
+from app.services.metadata import probe_media
+
+logger = logging.getLogger(__name__)
+
+# Job priorities: higher runs first
+PRIORITY_USER = 10
+PRIORITY_BACKFILL = 0
+
+# Rendition profiles: output height, audio bitrate and the bandwidth
+# advertised for the rendition in HLS master playlists
+PROFILES: Dict[str, dict] = {
+    "480p": {"height": 480, "audio_bitrate": "96k", "bandwidth": 1_500_000},
+    "720p": {"height": 720, "audio_bitrate": "128k", "bandwidth": 3_000_000},
+    "1080p": {"height": 1080, "audio_bitrate": "160k", "bandwidth": 6_000_000},
+    "2160p": {"height": 2160, "audio_bitrate": "192k", "bandwidth": 16_000_000}
+}
+
+# TRANSCODE_QUALITY -> (x264 preset, CRF)
+QUALITY_PRESETS = {
+    "low": ("veryfast", 28),
+    "medium": ("fast", 23),
+    "high": ("medium", 20)
+}
+
+CODECS = {
+    "mp4": ["-c:v", "libx264", "-c:a", "aac"],
+    "webm": ["-c:v", "libvpx-vp9", "-row-mt", "1", "-c:a", "libopus"]
+}
+
+
+def get_worker_count() -> int:
+    """Number of transcodes allowed to run at once
+
+    ffmpeg already uses several threads per encode, so by default a job is
+    given four cores rather than running one job per core.
+    """
+    return settings.TRANSCODE_WORKERS or max(1, (os.cpu_count() or 1) // 4)
+
+
+def get_thread_count(workers: int) -> int:
+    """ffmpeg threads per job so that all workers together use every core"""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def validate_rendition(quality: str, output_format: str):
+    if quality not in PROFILES:
+        raise ValidationError(f"Unknown transcode quality {quality}, expected one of {', '.join(PROFILES)}")
+    if output_format not in CODECS:
+        raise ValidationError(f"Unknown transcode format {output_format}, expected one of {', '.join(CODECS)}")
+
+
+def rendition_path(original_file_id: int, quality: str, output_format: str) -> str:
+    return os.path.join(settings.TRANSCODED_ROOT, str(original_file_id), f"{quality}.{output_format}")
+
+
+def _temp_path(output: str) -> str:
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.part{os.path.splitext(name)[1]}")
+
+
+def encoder_args(quality: str, output_format: str, threads: int, preset: Optional[str] = None) -> List[str]:
+    """ffmpeg output options that scale and encode to a rendition profile
+
+    Keyframes are forced every HLS_SEGMENT_SECONDS so finished renditions
+    can be cut into HLS segments without re-encoding.
+    """
+    profile = PROFILES[quality]
+    default_preset, crf = QUALITY_PRESETS.get(settings.TRANSCODE_QUALITY, QUALITY_PRESETS["medium"])
+    args = [
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        # Never upscale; -2 keeps the width even, as the encoders require
+        "-vf", f"scale=-2:'min({profile['height']},ih)'",
+        "-force_key_frames", f"expr:gte(t,n_forced*{settings.HLS_SEGMENT_SECONDS})",
+        "-threads", str(threads),
+        *CODECS[output_format],
+        "-crf", str(crf),
+        "-b:a", profile["audio_bitrate"],
+        "-ac", "2"
+    ]
+    if output_format == "mp4":
+        args += ["-preset", preset or default_preset, "-pix_fmt", "yuv420p"]
+    else:
+        args += ["-b:v", "0", "-deadline", "good", "-cpu-used", "4"]
+    return args
+
+
+def build_ffmpeg_command(source: str, output: str, quality: str, output_format: str, threads: int) -> List[str]:
+    command = [
+        settings.FFMPEG_PATH,
+        "-v", "error",
+        "-nostats",
+        "-progress", "pipe:1",
+        "-y",
+        "-i", source,
+        *encoder_args(quality, output_format, threads)
+    ]
+    if output_format == "mp4":
+        command += ["-movflags", "+faststart"]
+    return command + [output]
+
+
+async def enqueue(db, original_file_id: int, quality: str, output_format: Optional[str] = None, priority: int = PRIORITY_USER) -> TranscodedFile:
+    """Queue a rendition, or raise the priority of one already queued
+
+    Failed renditions are retried from scratch; ready ones are returned as is.
+    """
+    output_format = output_format or settings.TRANSCODE_FORMAT
+    validate_rendition(quality, output_format)
+
+    stmt = select(TranscodedFile).where(
+        TranscodedFile.original_file_id == original_file_id,
+        TranscodedFile.quality == quality,
+        TranscodedFile.format == output_format
+    )
+    job = (await db.execute(stmt)).scalar_one_or_none()
+
+    if job is None:
+        job = TranscodedFile(
+            original_file_id=original_file_id,
+            file_path=rendition_path(original_file_id, quality, output_format),
+            quality=quality,
+            format=output_format,
+            status="queued",
+            priority=priority
+        )
+        db.add(job)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Queued concurrently by another request
+            await db.rollback()
+            return (await db.execute(stmt)).scalar_one()
+    elif job.status == "failed":
+        job.status = "queued"
+        job.priority = max(job.priority or 0, priority)
+        job.attempts = 0
+        job.error_message = None
+        job.processing_progress = 0
+        await db.commit()
+    elif job.status == "queued" and (job.priority or 0) < priority:
+        job.priority = priority
+        await db.commit()
+    else:
+        return job
+
+    await db.refresh(job)
+    transcode_scheduler.wake()
+    return job
+
+
+class TranscodeScheduler:
+    """Runs queued TranscodedFile jobs with a bounded number of ffmpeg workers
+
+    The queue lives in the transcoded_files table, so it survives restarts
+    and is shared by every process. A claimed job records the claiming
+    process in ``worker_id`` and holds a lease that process renews in
+    ``heartbeat_at``; a job whose lease lapsed for TRANSCODE_LEASE_TIMEOUT
+    seconds was interrupted by a crash and is queued again (up to
+    TRANSCODE_MAX_ATTEMPTS), while jobs other live processes are running
+    are left alone. Partial outputs are written to hidden temp files that
+    are only renamed into place once ffmpeg succeeds. User-requested jobs
+    carry PRIORITY_USER and are always claimed before backfill jobs.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or get_worker_count()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def recover(self) -> int:
+        """Requeue running jobs whose lease expired; returns how many were requeued"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.TRANSCODE_LEASE_TIMEOUT)
+        expired = (
+            TranscodedFile.status == "running",
+            or_(TranscodedFile.heartbeat_at.is_(None), TranscodedFile.heartbeat_at < cutoff)
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(TranscodedFile)
+                .where(*expired, TranscodedFile.attempts >= settings.TRANSCODE_MAX_ATTEMPTS)
+                .values(status="failed", error_message="Interrupted too many times", worker_id=None)
+            )
+            requeued = await db.execute(
+                update(TranscodedFile)
+                .where(*expired)
+                .values(status="queued", processing_progress=0, worker_id=None, heartbeat_at=None)
+            )
+            await db.commit()
+        if requeued.rowcount:
+            logger.info("Requeued %d transcode jobs whose worker stopped renewing its lease", requeued.rowcount)
+        return requeued.rowcount
+
+    async def heartbeat(self):
+        """Renew the lease on this process's running jobs
+
+        A job that is no longer ours was requeued while this process was
+        stalled past its lease, so its ffmpeg is killed rather than left to
+        race the new run.
+        """
+        running = list(self._processes)
+        if not running:
+            return
+        async with AsyncSessionLocal() as db:
+            renewed = await db.execute(
+                update(TranscodedFile)
+                .where(
+                    TranscodedFile.id.in_(running),
+                    TranscodedFile.status == "running",
+                    TranscodedFile.worker_id == self.worker_id
+                )
+                .values(heartbeat_at=datetime.now(timezone.utc))
+                .returning(TranscodedFile.id)
+            )
+            held = set(renewed.scalars().all())
+            await db.commit()
+        for job_id in running:
+            process = self._processes.get(job_id)
+            if job_id not in held and process is not None and process.returncode is None:
+                logger.warning("Transcode %d was requeued elsewhere after its lease expired, stopping it", job_id)
+                process.kill()
+
+    async def start(self):
+        await self.recover()
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+        self._tasks.append(asyncio.create_task(self._lease_loop()))
+        if settings.TRANSCODE_PROFILES:
+            self._tasks.append(asyncio.create_task(self._backfill_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for process in list(self._processes.values()):
+            if process.returncode is None:
+                process.kill()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # A clean shutdown hands this process's jobs back without using up an attempt
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(TranscodedFile)
+                .where(TranscodedFile.status == "running", TranscodedFile.worker_id == self.worker_id)
+                .values(
+                    status="queued",
+                    processing_progress=0,
+                    attempts=TranscodedFile.attempts - 1,
+                    worker_id=None,
+                    heartbeat_at=None
+                )
+            )
+            await db.commit()
+
+    async def claim(self) -> Optional[TranscodedFile]:
+        """Atomically move the highest-priority queued job to running"""
+        async with AsyncSessionLocal() as db:
+            while True:
+                result = await db.execute(
+                    select(TranscodedFile)
+                    .where(TranscodedFile.status == "queued")
+                    .order_by(TranscodedFile.priority.desc(), TranscodedFile.id)
+                    .limit(1)
+                )
+                job = result.scalar_one_or_none()
+                if job is None:
+                    return None
+                now = datetime.now(timezone.utc)
+                claimed = await db.execute(
+                    update(TranscodedFile)
+                    .where(TranscodedFile.id == job.id, TranscodedFile.status == "queued")
+                    .values(
+                        status="running",
+                        attempts=TranscodedFile.attempts + 1,
+                        started_at=now,
+                        worker_id=self.worker_id,
+                        heartbeat_at=now,
+                        processing_progress=0
+                    )
+                )
+                await db.commit()
+                if claimed.rowcount == 1:
+                    await db.refresh(job)
+                    return job
+                # Another worker took it first
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Claiming a transcode job failed")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.TRANSCODE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                detail = e.detail if isinstance(e, MediaProcessingError) else str(e)
+                logger.warning("Transcode %d (%s %s) failed: %s", job.id, job.quality, job.format, detail)
+                await self._finish(job.id, status="failed", error_message=detail[:1000])
+
+    async def run_job(self, job: TranscodedFile):
+        async with AsyncSessionLocal() as db:
+            source = (await db.execute(
+                select(MediaFile.file_path, MediaFile.duration).where(MediaFile.id == job.original_file_id)
+            )).one_or_none()
+        if source is None:
+            raise MediaProcessingError("original media file no longer exists")
+
+        output = job.file_path
+        temp_path = _temp_path(output)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        command = build_ffmpeg_command(
+            source.file_path, temp_path, job.quality, job.format, get_thread_count(self.workers)
+        )
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            raise MediaProcessingError(f"cannot run ffmpeg: {e}")
+
+        self._processes[job.id] = process
+        try:
+            stderr_task = asyncio.create_task(process.stderr.read())
+            await self._track_progress(job.id, process, source.duration)
+            await process.wait()
+            stderr = await stderr_task
+        finally:
+            self._processes.pop(job.id, None)
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if process.returncode != 0:
+            _remove(temp_path)
+            raise MediaProcessingError(stderr.decode(errors="replace").strip()[-1000:] or f"ffmpeg exited with {process.returncode}")
+
+        os.replace(temp_path, output)
+        try:
+            values = await probe_media(output)
+        except MediaProcessingError:
+            values = {}
+        await self._finish(
+            job.id,
+            status="completed",
+            is_ready=True,
+            processing_progress=100,
+            file_size=os.path.getsize(output),
+            duration=values.get("duration"),
+            width=values.get("width"),
+            height=values.get("height"),
+            bitrate=values.get("bitrate"),
+            completed_at=datetime.now(timezone.utc),
+            error_message=None
+        )
+        logger.info("Transcoded %s to %s %s", source.file_path, job.quality, job.format)
+
+    async def _track_progress(self, job_id: int, process, duration: Optional[float]):
+        """Parse ``-progress`` key=value blocks into processing_progress
+
+        Writes are throttled to one per TRANSCODE_PROGRESS_INTERVAL seconds.
+        """
+        last_progress = 0
+        last_write = 0.0
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                return
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if key != "out_time_us" or not duration:
+                continue
+            try:
+                progress = min(99, int(int(value) / (duration * 1_000_000) * 100))
+            except ValueError:
+                continue
+            now = time.monotonic()
+            if progress > last_progress and now - last_write >= settings.TRANSCODE_PROGRESS_INTERVAL:
+                last_progress, last_write = progress, now
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(TranscodedFile)
+                        .where(TranscodedFile.id == job_id, TranscodedFile.worker_id == self.worker_id)
+                        .values(processing_progress=progress)
+                    )
+                    await db.commit()
+
+    async def _finish(self, job_id: int, **values):
+        # A job requeued after its lease expired belongs to its new run
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(TranscodedFile)
+                .where(TranscodedFile.id == job_id, TranscodedFile.worker_id == self.worker_id)
+                .values(**values)
+            )
+            await db.commit()
+
+    async def backfill(self) -> int:
+        """Queue TRANSCODE_PROFILES renditions for videos that lack them
+
+        Only profiles below the source height are queued, so nothing is
+        upscaled. Returns how many jobs were added.
+        """
+        added = 0
+        async with AsyncSessionLocal() as db:
+            for quality in settings.TRANSCODE_PROFILES:
+                if quality not in PROFILES:
+                    continue
+                existing = (
+                    select(TranscodedFile.id)
+                    .where(
+                        TranscodedFile.original_file_id == MediaFile.id,
+                        TranscodedFile.quality == quality,
+                        TranscodedFile.format == settings.TRANSCODE_FORMAT
+                    )
+                    .exists()
+                )
+                result = await db.execute(
+                    select(MediaFile.id)
+                    .where(
+                        MediaFile.media_type == "video",
+                        MediaFile.is_available.is_(True),
+                        MediaFile.processing_status == "completed",
+                        MediaFile.height > PROFILES[quality]["height"],
+                        ~existing
+                    )
+                    .limit(settings.TRANSCODE_BACKFILL_BATCH_SIZE)
+                )
+                ids = result.scalars().all()
+                if not ids:
+                    continue
+                await db.execute(insert(TranscodedFile), [
+                    {
+                        "original_file_id": file_id,
+                        "file_path": rendition_path(file_id, quality, settings.TRANSCODE_FORMAT),
+                        "quality": quality,
+                        "format": settings.TRANSCODE_FORMAT,
+                        "status": "queued",
+                        "priority": PRIORITY_BACKFILL
+                    }
+                    for file_id in ids
+                ])
+                await db.commit()
+                added += len(ids)
+        if added:
+            logger.info("Queued %d backfill transcodes", added)
+            self.wake()
+        return added
+
+    async def _lease_loop(self):
+        # Renew well inside the timeout, and pick up jobs of processes that died
+        while True:
+            await asyncio.sleep(settings.TRANSCODE_LEASE_TIMEOUT / 4)
+            try:
+                await self.heartbeat()
+                if await self.recover():
+                    self.wake()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Renewing transcode leases failed")
+
+    async def _backfill_loop(self):
+        while True:
+            try:
+                await self.backfill()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Queueing backfill transcodes failed")
+            await asyncio.sleep(settings.TRANSCODE_BACKFILL_INTERVAL)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+transcode_scheduler = TranscodeScheduler()
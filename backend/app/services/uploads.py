@@ -0,0 +1,89 @@
+"""
+Upload helpers: media type detection and streaming writes to MEDIA_ROOT
+"""
+
+from fastapi import UploadFile
+from typing import Optional, Tuple
+import os
+import hashlib
+import tempfile
+import aiofiles
+
+from app.core.config import settings
+from app.core.exceptions import FileTooLarge, UnsupportedMediaFormat
+
+# Bytes read from the request per iteration; memory per upload stays at this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def classify_extension(file_extension: str) -> Optional[str]:
+    """Map a lowercase file extension to video, audio or image, or None"""
+    if file_extension in settings.SUPPORTED_VIDEO_FORMATS:
+        return "video"
+    if file_extension in settings.SUPPORTED_AUDIO_FORMATS:
+        return "audio"
+    if file_extension in settings.SUPPORTED_IMAGE_FORMATS:
+        return "image"
+    return None
+
+
+def get_media_type(file_extension: str) -> str:
+    """Map a lowercase file extension to a media type, rejecting unknown ones"""
+    media_type = classify_extension(file_extension)
+    if media_type is None:
+        raise UnsupportedMediaFormat(file_extension)
+    return media_type
+
+
+def create_temp_path(directory: str) -> str:
+    """Reserve a hidden temporary file next to the final media files"""
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=directory)
+    os.close(fd)
+    return temp_path
+
+
+async def stream_upload_to_temp(file: UploadFile) -> Tuple[str, int, str]:
+    """Copy an upload into MEDIA_ROOT chunk by chunk
+
+    Returns the temporary path, the size in bytes and the SHA-256 hex digest.
+    The temporary file lives on the same filesystem as the final location so
+    it can be renamed into place atomically once the caller accepts it.
+    """
+    temp_path = create_temp_path(settings.MEDIA_ROOT)
+    digest = hashlib.sha256()
+    file_size = 0
+
+    try:
+        async with aiofiles.open(temp_path, 'wb') as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                if file_size > settings.MAX_FILE_SIZE:
+                    raise FileTooLarge(settings.MAX_FILE_SIZE)
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        discard_temp(temp_path)
+        raise
+
+    return temp_path, file_size, digest.hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """SHA-256 hex digest of a file already on disk"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def discard_temp(temp_path: str):
+    """Remove a temporary upload file if it still exists"""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,100 @@
+"""
+Cache of authenticated users, so bearer-token requests skip the users table
+"""
+
+from datetime import datetime
+from typing import Optional, Set
+import json
+import logging
+
+from sqlalchemy import DateTime
+
+from app.core.config import settings
+from app.models.user import User
+from app.services.cache import CacheUnavailable, LRUCache, SharedCache, shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Never cached, least of all in a store shared with other services
+EXCLUDED_COLUMNS = {"hashed_password"}
+
+
+def user_values(user: User) -> dict:
+    return {
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns if column.key not in EXCLUDED_COLUMNS
+    }
+
+
+def _dump(values: dict) -> bytes:
+    return json.dumps({
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in values.items()
+    }).encode()
+
+
+def _load(data: bytes) -> dict:
+    values = json.loads(data)
+    for column in User.__table__.columns:
+        if isinstance(column.type, DateTime) and values.get(column.key):
+            values[column.key] = datetime.fromisoformat(values[column.key])
+    return values
+
+
+class UserCache:
+    """Per-worker LRU in front of an optional shared cache, keyed by user id
+
+    A hit returns a detached ``User`` built from the cached columns (without
+    the password hash), so code that changes the user must load it into
+    its own session first. Changes made through the API call
+    ``invalidate``, which clears this worker and the shared cache at once;
+    other workers drop their copy within USER_CACHE_TTL seconds.
+    """
+
+    def __init__(self, shared: Optional[SharedCache] = None, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.local = LRUCache(max_entries or settings.USER_CACHE_MAX_ENTRIES, ttl or settings.USER_CACHE_TTL)
+        self.shared = shared if shared is not None else (shared_cache if settings.USER_CACHE_SHARED else None)
+        # Deletes that failed while the shared cache was down, retried before it is read again
+        self._pending: Set[int] = set()
+
+    def _key(self, user_id: int) -> str:
+        return f"user:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[User]:
+        values = self.local.get(user_id)
+        if values is None and self.shared is not None:
+            try:
+                if self._pending:
+                    await self._replay()
+                data = await self.shared.get(self._key(user_id))
+            except CacheUnavailable:
+                data = None
+            if data is not None:
+                values = _load(data)
+                self.local.set(user_id, values)
+        return User(**values) if values is not None else None
+
+    async def set(self, user: User):
+        values = user_values(user)
+        self.local.set(user.id, values)
+        if self.shared is not None:
+            try:
+                await self.shared.set(self._key(user.id), _dump(values), ttl=settings.USER_CACHE_SHARED_TTL)
+            except CacheUnavailable:
+                pass
+
+    async def invalidate(self, user_id: int):
+        self.local.delete(user_id)
+        if self.shared is not None:
+            self._pending.add(user_id)
+            try:
+                await self._replay()
+            except CacheUnavailable:
+                logger.debug("Could not drop user %d from the shared cache yet", user_id)
+
+    async def _replay(self):
+        await self.shared.delete(*(self._key(user_id) for user_id in self._pending))
+        self._pending.clear()
+
+
+user_cache = UserCache()
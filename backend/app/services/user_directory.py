@@ -0,0 +1,108 @@
+"""
+User accounts for the lightweight (no database) servers, with unique indexes on
+email and id
+"""
+
+from typing import Dict, Iterable, List, MutableMapping, Optional, Tuple
+
+from app.core.exceptions import UserAlreadyExists, UserNotFound
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+class UserDirectory:
+    """User dicts by username, also findable by email and by id
+
+    ``records`` maps username to the user dict and may be a plain dict or a
+    persistent RecordStore; reads can go to it directly, but every change
+    goes through this class so the email and id indexes stay in step.
+    Emails are unique regardless of case. Checking a new account is then
+    a few dict lookups rather than a pass over every user, which keeps
+    bulk imports linear.
+    """
+
+    def __init__(self, records: MutableMapping[str, dict]):
+        self.records = records
+        self._by_email: Dict[str, str] = {}
+        self._by_id: Dict[str, str] = {}
+
+    def __contains__(self, username) -> bool:
+        return username in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def load(self):
+        """Index the users already in ``records``"""
+        self._by_email = {normalize_email(user["email"]): username for username, user in self.records.items()}
+        self._by_id = {user["id"]: username for username, user in self.records.items()}
+
+    def get(self, username: str) -> Optional[dict]:
+        return self.records.get(username)
+
+    def by_email(self, email: str) -> Optional[dict]:
+        username = self._by_email.get(normalize_email(email))
+        return self.records[username] if username is not None else None
+
+    def by_id(self, user_id: str) -> Optional[dict]:
+        username = self._by_id.get(user_id)
+        return self.records[username] if username is not None else None
+
+    def check_available(self, username: str, email: str):
+        """Raise UserAlreadyExists if the username or email is taken"""
+        if username in self.records:
+            raise UserAlreadyExists("Username already registered")
+        if normalize_email(email) in self._by_email:
+            raise UserAlreadyExists("Email already registered")
+
+    def add(self, user: dict) -> dict:
+        self.check_available(user["username"], user["email"])
+        if user["id"] in self._by_id:
+            raise UserAlreadyExists("User id already in use")
+        self.records[user["username"]] = user
+        self._by_email[normalize_email(user["email"])] = user["username"]
+        self._by_id[user["id"]] = user["username"]
+        return user
+
+    def add_many(self, users: Iterable[dict]) -> Tuple[List[dict], List[Tuple[dict, str]]]:
+        """Add each user that is free to add; returns (added, [(user, reason)])
+
+        Accounts clash with existing ones and with earlier ones in the same
+        batch alike, and a clash skips only that account.
+        """
+        added, skipped = [], []
+        for user in users:
+            try:
+                added.append(self.add(user))
+            except UserAlreadyExists as e:
+                skipped.append((user, e.detail))
+        return added, skipped
+
+    def update(self, username: str, changes: dict) -> dict:
+        """Apply ``changes`` to a user, keeping the email unique
+
+        The username and id cannot change; they key the store and tokens.
+        """
+        user = self.records.get(username)
+        if user is None:
+            raise UserNotFound(username)
+        if "email" in changes:
+            old_email, new_email = normalize_email(user["email"]), normalize_email(changes["email"])
+            if new_email != old_email:
+                if new_email in self._by_email:
+                    raise UserAlreadyExists("Email already registered")
+                del self._by_email[old_email]
+                self._by_email[new_email] = username
+        user.update({key: value for key, value in changes.items() if key not in ("username", "id")})
+        self.records[username] = user
+        return user
+
+    def remove(self, username: str) -> dict:
+        user = self.records.pop(username, None)
+        if user is None:
+            raise UserNotFound(username)
+        self._by_email.pop(normalize_email(user["email"]), None)
+        self._by_id.pop(user["id"], None)
+        return user
@@ -0,0 +1,377 @@
+"""
+Live library watcher: inotify events, debounced and applied in batches
+"""
+
+from sqlalchemy import update
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import time
+import errno
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.media import MediaFile
+from app.services.cache import invalidate_media
+from app.services.facets import facet_aggregator
+from app.services.scanner import (
+    ScannedEntry,
+    get_library_roots,
+    library_scanner,
+    load_known_rows,
+    plan_upserts,
+    walk_media_files,
+    write_batches
+)
+from app.services.uploads import classify_extension
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Pending change kinds
+CHANGED = "changed"
+DELETED = "deleted"
+DELETED_TREE = "deleted_tree"
+
+
+class WatchLimitReached(Exception):
+    """Raised when the kernel refuses more inotify watches or instances"""
+
+
+class InotifyWatcher:
+    """Recursive inotify watch over a set of roots
+
+    Events are translated to (path, kind) notifications. New directories get
+    their own watches, and files already inside them are reported, since a
+    directory moved or copied in arrives with its contents. When the kernel
+    queue overflows and events were lost, ``on_overflow`` is called.
+    """
+
+    def __init__(
+        self,
+        roots: List[str],
+        notify: Callable[[str, str], None],
+        on_overflow: Optional[Callable[[], None]] = None
+    ):
+        self.roots = roots
+        self.notify = notify
+        self.on_overflow = on_overflow
+        self._fd: Optional[int] = None
+        self._paths: Dict[int, str] = {}
+        self._libc = None
+
+    def start(self):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise WatchLimitReached("inotify is not available on this platform")
+
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise WatchLimitReached(os.strerror(ctypes.get_errno()))
+        self._fd = fd
+        try:
+            for root in self.roots:
+                self._watch_tree(root)
+        except WatchLimitReached:
+            self.close()
+            raise
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._paths.clear()
+
+    def _add_watch(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchLimitReached(f"inotify watch limit reached at {path}")
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(error, os.strerror(error), path)
+        self._paths[wd] = path
+
+    def _watch_tree(self, root: str, report_files: bool = False):
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            self._add_watch(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif report_files:
+                            self.notify(entry.path, CHANGED)
+            except OSError:
+                continue
+
+    def read_events(self):
+        """Drain the inotify fd and dispatch its events"""
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name_bytes = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length]
+                offset += EVENT_HEADER.size + length
+                self._dispatch(wd, mask, os.fsdecode(name_bytes.rstrip(b"\0")))
+
+    def _dispatch(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed, scheduling a full library scan")
+            if self.on_overflow is not None:
+                self.on_overflow()
+            return
+        if mask & IN_IGNORED:
+            self._paths.pop(wd, None)
+            return
+
+        directory = self._paths.get(wd)
+        if directory is None or not name or name.startswith("."):
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path, report_files=True)
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                self.notify(path, DELETED_TREE)
+        elif mask & (IN_MOVED_FROM | IN_DELETE):
+            self.notify(path, DELETED)
+        else:
+            self.notify(path, CHANGED)
+
+
+class PollingWatcher:
+    """Fallback that diffs (size, mtime) snapshots of the roots"""
+
+    def __init__(self, roots: List[str], notify: Callable[[str, str], None]):
+        self.roots = roots
+        self.notify = notify
+        self._snapshot: Dict[str, Tuple[int, float]] = {}
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, float]]:
+        snapshot = {}
+        for root in self.roots:
+            for path, size, mtime, _media_type in walk_media_files(root):
+                snapshot[path] = (size, mtime)
+        return snapshot
+
+    async def run(self):
+        self._snapshot = await asyncio.to_thread(self._take_snapshot)
+        while True:
+            await asyncio.sleep(settings.WATCHER_POLL_INTERVAL)
+            snapshot = await asyncio.to_thread(self._take_snapshot)
+            for path, stat_key in snapshot.items():
+                if self._snapshot.get(path) != stat_key:
+                    self.notify(path, CHANGED)
+            for path in self._snapshot.keys() - snapshot.keys():
+                self.notify(path, DELETED)
+            self._snapshot = snapshot
+
+
+class LibraryWatcher:
+    """Keeps media_files in step with the library roots between scans
+
+    A file copy produces a burst of create/modify/close events; each path is
+    only applied once it has been quiet for WATCHER_DEBOUNCE_SECONDS, and all
+    paths that settle together are written in one batch.
+    """
+
+    flush_interval = 0.5
+
+    def __init__(self, roots: Optional[List[str]] = None, debounce: Optional[float] = None):
+        self.roots = roots
+        self.debounce = settings.WATCHER_DEBOUNCE_SECONDS if debounce is None else debounce
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._inotify: Optional[InotifyWatcher] = None
+        self._tasks: List[asyncio.Task] = []
+        self.mode: Optional[str] = None
+
+    def notify(self, path: str, kind: str):
+        """Record an event for ``path``; later events replace earlier ones"""
+        self._pending[path] = (kind, time.monotonic())
+
+    async def start(self):
+        roots = [root for root in (self.roots or get_library_roots()) if os.path.isdir(root)]
+        loop = asyncio.get_running_loop()
+
+        inotify = InotifyWatcher(roots, self.notify, on_overflow=self._schedule_scan)
+        try:
+            await asyncio.to_thread(inotify.start)
+        except (WatchLimitReached, OSError) as e:
+            logger.warning("Falling back to polling the library: %s", e)
+            self._start_polling(roots)
+        else:
+            self._inotify = inotify
+            self.mode = "inotify"
+            loop.add_reader(inotify.fileno(), self._on_readable)
+
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+
+    def _start_polling(self, roots: List[str]):
+        self.mode = "polling"
+        self._tasks.append(asyncio.create_task(PollingWatcher(roots, self.notify).run()))
+
+    def _on_readable(self):
+        try:
+            self._inotify.read_events()
+        except WatchLimitReached as e:
+            logger.warning("Falling back to polling the library: %s", e)
+            roots = self._inotify.roots
+            self._stop_inotify()
+            self._start_polling(roots)
+            # Catch up on anything that changed while the watches were incomplete
+            self._schedule_scan()
+
+    def _schedule_scan(self):
+        """Start a full library scan, keeping the task so it is neither collected nor silent"""
+        task = asyncio.create_task(library_scanner.scan())
+        self._tasks.append(task)
+        task.add_done_callback(self._scan_done)
+
+    def _scan_done(self, task: asyncio.Task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Library scan after lost watcher events failed", exc_info=task.exception())
+
+    def _stop_inotify(self):
+        if self._inotify is not None and self._inotify.fileno() is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fileno())
+            self._inotify.close()
+        self._inotify = None
+
+    async def stop(self):
+        self._stop_inotify()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Applying library changes failed")
+
+    async def flush(self, force: bool = False) -> int:
+        """Apply every pending path that has settled; returns how many were applied"""
+        cutoff = time.monotonic() - self.debounce
+        ready = [
+            (path, kind) for path, (kind, seen_at) in self._pending.items()
+            if force or seen_at <= cutoff
+        ]
+        if not ready:
+            return 0
+        for path, _kind in ready:
+            del self._pending[path]
+
+        changed = [path for path, kind in ready if kind == CHANGED]
+        deleted = [path for path, kind in ready if kind == DELETED]
+        deleted_trees = [path for path, kind in ready if kind == DELETED_TREE]
+
+        try:
+            entries, vanished = await asyncio.to_thread(_stat_paths, changed)
+            deleted.extend(vanished)
+            await self._apply(entries, deleted, deleted_trees)
+        except BaseException:
+            # Retried after another debounce period, unless a newer event replaced it meanwhile
+            retry_at = time.monotonic()
+            for path, kind in ready:
+                self._pending.setdefault(path, (kind, retry_at))
+            raise
+        return len(ready)
+
+    async def _apply(self, entries: List[ScannedEntry], deleted: List[str], deleted_trees: List[str]):
+        async with AsyncSessionLocal() as db:
+            paths = [entry[0] for entry in entries] + deleted
+            known = await load_known_rows(db, MediaFile.file_path.in_(paths)) if paths else {}
+
+            inserts, updates, _unchanged = plan_upserts(entries, known)
+            updates.extend(
+                {"id": row.id, "is_available": False}
+                for path, row in known.items() if path in deleted and row.is_available
+            )
+            await write_batches(db, inserts, updates, settings.LIBRARY_SCAN_BATCH_SIZE)
+
+            for tree in deleted_trees:
+                prefix = tree.rstrip(os.sep) + os.sep
+                in_tree = MediaFile.file_path.startswith(prefix, autoescape=True)
+                async with facet_aggregator.track(db, in_tree):
+                    await db.execute(update(MediaFile).where(in_tree).values(is_available=False))
+            if deleted_trees:
+                await db.commit()
+
+        if inserts or updates or deleted_trees:
+            await facet_aggregator.invalidate()
+            await invalidate_media([values["id"] for values in updates], every_file=bool(deleted_trees))
+            logger.info(
+                "Library watcher applied %d new, %d updated, %d removed directories",
+                len(inserts), len(updates), len(deleted_trees)
+            )
+
+
+def _stat_paths(paths: List[str]) -> Tuple[List[ScannedEntry], List[str]]:
+    """Split paths into supported media files that exist and paths that are gone"""
+    entries = []
+    vanished = []
+    for path in paths:
+        media_type = classify_extension(os.path.splitext(path)[1].lower())
+        if media_type is None:
+            continue
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            vanished.append(path)
+            continue
+        except OSError:
+            continue
+        if os.path.isfile(path):
+            entries.append((path, stat_result.st_size, stat_result.st_mtime, media_type))
+    return entries, vanished
+
+
+library_watcher = LibraryWatcher()
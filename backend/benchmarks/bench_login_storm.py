@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: event-loop latency during a login storm, bcrypt inline vs thread pool
+
+A heartbeat task stands in for in-flight stream requests: it asks to wake
+every few milliseconds and records how late it actually runs while a burst
+of concurrent logins verifies passwords, once on the event loop and once
+through the password hashing pool.
+
+Run from the backend directory:
+    python benchmarks/bench_login_storm.py
+    python benchmarks/bench_login_storm.py --logins 64 --rounds 12 --workers 4
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passlib.context import CryptContext
+
+from app.services.passwords import PasswordHasher
+
+PASSWORD = "correct horse battery staple"
+HEARTBEAT_INTERVAL = 0.005
+
+
+async def heartbeat(done, lags):
+    """Sleep in short steps until ``done``, recording how late each wakeup is"""
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        expected = loop.time() + HEARTBEAT_INTERVAL
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def storm(verify, logins):
+    """Run ``logins`` concurrent verifications next to the heartbeat"""
+    done = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(heartbeat(done, lags))
+    await asyncio.sleep(HEARTBEAT_INTERVAL * 2)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticker
+    assert all(results)
+    return elapsed, lags
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins in the storm")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=0, help="hashing threads, 0 uses the server default")
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.rounds)
+    hashed = context.hash(PASSWORD)
+    hasher = PasswordHasher(context, workers=args.workers or None, max_pending=args.logins)
+
+    async def inline():
+        # What the endpoints used to do
+        return context.verify(PASSWORD, hashed)
+
+    async def pooled():
+        return await hasher.verify(PASSWORD, hashed)
+
+    print(f"{args.logins} logins, bcrypt rounds {args.rounds}, {hasher.workers} hashing threads")
+    print(f"{'mode':>10} {'storm (s)':>10} {'logins/s':>10} {'lag p50 (ms)':>14} {'lag p99 (ms)':>14} {'lag max (ms)':>14}")
+    for mode, verify in (("inline", inline), ("pool", pooled)):
+        elapsed, lags = asyncio.run(storm(verify, args.logins))
+        lags = lags or [0.0]
+        print(
+            f"{mode:>10} {elapsed:>10.2f} {args.logins / elapsed:>10.1f} "
+            f"{statistics.median(lags) * 1000:>14.2f} {percentile(lags, 0.99) * 1000:>14.2f} {max(lags) * 1000:>14.2f}"
+        )
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
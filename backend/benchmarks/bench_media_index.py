@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark: media listing page latency, sort-per-request vs maintained index
+
+Run from the backend directory:
+    python benchmarks/bench_media_index.py
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.media_index import SortedMediaIndex
+
+PAGE_SIZE = 20
+LIBRARY_SIZES = [1_000, 10_000, 100_000, 300_000]
+
+
+def build_library(size):
+    """Create a media_db-like dict and the matching index"""
+    base = datetime(2024, 1, 1)
+    media_db = {}
+    index = SortedMediaIndex()
+    for i in range(size):
+        media_id = f"m{i:07d}"
+        created_at = base + timedelta(seconds=i)
+        media_db[media_id] = {"id": media_id, "created_at": created_at}
+        index.add(media_id, created_at)
+    return media_db, index
+
+
+def sort_per_request(media_db, page):
+    """The old listing: copy and sort everything for every page"""
+    start_idx = (page - 1) * PAGE_SIZE
+    media_list = list(media_db.values())
+    media_list.sort(key=lambda x: x["created_at"], reverse=True)
+    return media_list[start_idx:start_idx + PAGE_SIZE]
+
+
+def indexed(media_db, index, page):
+    """The new listing: slice the maintained index"""
+    start_idx = (page - 1) * PAGE_SIZE
+    return [media_db[media_id] for media_id in index.page(start_idx, PAGE_SIZE)]
+
+
+def main():
+    print(f"{'items':>10} {'sorted (ms)':>14} {'indexed (ms)':>14}")
+    for size in LIBRARY_SIZES:
+        media_db, index = build_library(size)
+        middle_page = size // PAGE_SIZE // 2 or 1
+        assert sort_per_request(media_db, middle_page) == indexed(media_db, index, middle_page)
+
+        runs = 5
+        sorted_ms = timeit.timeit(lambda: sort_per_request(media_db, middle_page), number=runs) / runs * 1000
+        runs = 2000
+        indexed_ms = timeit.timeit(lambda: indexed(media_db, index, middle_page), number=runs) / runs * 1000
+        print(f"{size:>10} {sorted_ms:>14.3f} {indexed_ms:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
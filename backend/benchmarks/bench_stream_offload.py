@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Load benchmark: concurrent viewers streaming through nginx, offload on vs off
+
+Each simulated viewer repeatedly requests a window of the file at a random
+offset (as a player does while buffering and seeking) and the script reports
+aggregate throughput and time-to-first-byte percentiles.
+
+Run it once against a deployment with X_ACCEL_REDIRECT_ENABLED=false and once
+with it set to true, using the same URL, file and viewer counts:
+
+    python benchmarks/bench_stream_offload.py \\
+        --url http://localhost:8080/api/v1/media/1/stream \\
+        --viewers 10 50 200 --duration 30
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+
+async def viewer(client, url, headers, file_size, window, deadline, stats):
+    """Fetch random byte windows until the deadline"""
+    while time.perf_counter() < deadline:
+        start = random.randrange(0, max(file_size - window, 1))
+        range_headers = {**headers, "Range": f"bytes={start}-{start + window - 1}"}
+        requested_at = time.perf_counter()
+        first_byte_at = None
+        received = 0
+        try:
+            async with client.stream("GET", url, headers=range_headers) as response:
+                if response.status_code not in (200, 206):
+                    stats["errors"] += 1
+                    continue
+                async for chunk in response.aiter_raw():
+                    if first_byte_at is None:
+                        first_byte_at = time.perf_counter()
+                    received += len(chunk)
+        except httpx.HTTPError:
+            stats["errors"] += 1
+            continue
+        stats["bytes"] += received
+        stats["requests"] += 1
+        if first_byte_at is not None:
+            stats["ttfb"].append(first_byte_at - requested_at)
+
+
+async def run(url, headers, viewers, duration, window):
+    limits = httpx.Limits(max_connections=viewers, max_keepalive_connections=viewers)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        head = await client.head(url, headers=headers)
+        head.raise_for_status()
+        file_size = int(head.headers["content-length"])
+
+        stats = {"bytes": 0, "requests": 0, "errors": 0, "ttfb": []}
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            viewer(client, url, headers, file_size, window, deadline, stats)
+            for _ in range(viewers)
+        ))
+        elapsed = time.perf_counter() - started
+    return stats, elapsed
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True, help="Stream URL of a large media file")
+    parser.add_argument("--token", help="Bearer token, if the endpoint needs one")
+    parser.add_argument("--viewers", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per viewer count")
+    parser.add_argument("--window", type=int, default=4 * 1024 * 1024, help="Bytes per request")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    print(f"{'viewers':>8} {'req/s':>8} {'MiB/s':>9} {'ttfb p50 ms':>12} {'ttfb p99 ms':>12} {'errors':>7}")
+    for viewers in args.viewers:
+        stats, elapsed = asyncio.run(run(args.url, headers, viewers, args.duration, args.window))
+        print(
+            f"{viewers:>8} {stats['requests'] / elapsed:>8.1f} "
+            f"{stats['bytes'] / elapsed / 1024 / 1024:>9.1f} "
+            f"{statistics.median(stats['ttfb']) * 1000 if stats['ttfb'] else float('nan'):>12.1f} "
+            f"{percentile(stats['ttfb'], 0.99) * 1000:>12.1f} "
+            f"{stats['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
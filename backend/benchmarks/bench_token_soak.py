@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Soak benchmark: memory of the login token store over millions of logins
+
+Simulates clients logging in at a steady rate on a fake clock, with the
+sweeper running as it would on the server, and prints process memory and
+token counts as the run goes. With sweeping and the per-user cap, live
+tokens level off at what the TTL and the users allow and memory flattens;
+--unswept keeps every token, as create_access_token used to.
+
+Run from the backend directory:
+    python benchmarks/bench_token_soak.py
+    python benchmarks/bench_token_soak.py --logins 5000000 --users 20000
+    python benchmarks/bench_token_soak.py --logins 1000000 --unswept
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.tokens import TokenStore
+
+
+def rss_mb():
+    """Resident memory of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--logins", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--rate", type=float, default=50.0, help="simulated logins per second")
+    parser.add_argument("--ttl-minutes", type=int, default=24 * 60)
+    parser.add_argument("--sweep-interval", type=int, default=60, help="simulated seconds between sweeps")
+    parser.add_argument("--max-per-user", type=int, default=20)
+    parser.add_argument("--unswept", action="store_true", help="never sweep or cap, for comparison")
+    args = parser.parse_args()
+
+    clock = FakeClock()
+    max_per_user = args.logins if args.unswept else args.max_per_user
+    store = TokenStore({}, ttl=timedelta(minutes=args.ttl_minutes), max_per_user=max_per_user, clock=clock)
+    step = timedelta(seconds=1 / args.rate)
+    logins_per_sweep = max(1, int(args.sweep_interval * args.rate))
+    report_every = max(1, args.logins // 10)
+
+    gc.collect()
+    baseline = rss_mb()
+    print(
+        f"{args.logins} logins by {args.users} users at {args.rate:g}/s simulated, "
+        f"TTL {args.ttl_minutes} min, {'unswept' if args.unswept else f'cap {args.max_per_user} per user'}"
+    )
+    print(f"{'logins':>10} {'sim hours':>10} {'live':>10} {'heap':>10} {'RSS (MB)':>10} {'us/login':>10}")
+    started = time.perf_counter()
+    last = started
+    for i in range(1, args.logins + 1):
+        clock.now += step
+        store.issue(f"user{i % args.users}")
+        if not args.unswept and i % logins_per_sweep == 0:
+            store.sweep()
+        if i % report_every == 0:
+            now = time.perf_counter()
+            hours = (clock.now - datetime(2024, 1, 1)).total_seconds() / 3600
+            print(
+                f"{i:>10} {hours:>10.1f} {len(store):>10} {len(store._expiry):>10} "
+                f"{rss_mb() - baseline:>10.1f} {(now - last) / report_every * 1e6:>10.2f}"
+            )
+            last = now
+
+    username = "user0"
+    count = len(store.tokens_of(username))
+    started = time.perf_counter()
+    revoked = store.revoke_user(username)
+    print(f"logout everywhere for {username}: {revoked} of {count} tokens in {(time.perf_counter() - started) * 1e6:.0f} us")
+
+    if not args.unswept:
+        live_bound = min(
+            args.users * args.max_per_user,
+            int(args.rate * args.ttl_minutes * 60) + logins_per_sweep
+        )
+        assert len(store) <= live_bound, f"{len(store)} live tokens, expected at most {live_bound}"
+        assert len(store._expiry) <= 3 * len(store) + args.max_per_user + logins_per_sweep, "expiry heap kept stale entries"
+        print(f"OK: {len(store)} live tokens (bound {live_bound})")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,26 @@ Watch1 Media Server - Main FastAPI Application
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 import uvicorn
 import os
+import asyncio
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import engine, create_schema
 from app.api.v1.api import api_router
 from app.core.exceptions import Watch1Exception
+from app.services.cache import response_cache
+from app.services.facets import facet_aggregator
+from app.services.metadata import metadata_extractor
+from app.services.passwords import password_hasher
+from app.services.scanner import library_scanner
+from app.services.streaming import RangeStaticFiles
+from app.services.thumbnails import thumbnail_generator
+from app.services.live_transcode import live_transcoder
+from app.services.transcoding import transcode_scheduler
+from app.services.watcher import library_watcher
 
 # Import models to register them with SQLAlchemy
 from app.models import user, media
@@ -28,19 +38,47 @@ async def lifespan(app: FastAPI):
     
     # Create database tables
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_schema)
     
     # Create media directories
     os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
     os.makedirs(settings.THUMBNAILS_ROOT, exist_ok=True)
     os.makedirs(settings.TRANSCODED_ROOT, exist_ok=True)
     
+    # Index media already present in the library roots
+    scanner_task = asyncio.create_task(library_scanner.run_periodically())
+    
+    # Probe new files for duration, resolution and codecs
+    metadata_task = asyncio.create_task(metadata_extractor.run_forever())
+    
+    # Render thumbnails and posters once metadata is in
+    thumbnail_task = asyncio.create_task(thumbnail_generator.run_forever())
+    
+    # Keep facet counts current as the library changes
+    facets_task = asyncio.create_task(facet_aggregator.run_forever())
+    
+    # Resume the transcode queue, including jobs interrupted by a restart
+    await transcode_scheduler.start()
+    
+    # Pick up files dropped into the library while running
+    if settings.WATCHER_ENABLED:
+        await library_watcher.start()
+    
     print("✅ Watch1 Media Server started successfully!")
     
     yield
     
     # Shutdown
     print("🛑 Shutting down Watch1 Media Server...")
+    await library_watcher.stop()
+    await transcode_scheduler.stop()
+    await live_transcoder.stop()
+    await response_cache.close()
+    password_hasher.shutdown()
+    scanner_task.cancel()
+    metadata_task.cancel()
+    thumbnail_task.cancel()
+    facets_task.cancel()
 
 
 # Create FastAPI application
@@ -73,9 +111,21 @@ app.add_middleware(
 app.include_router(api_router, prefix="/api/v1")
 
 # Mount static files
-app.mount("/media", StaticFiles(directory=settings.MEDIA_ROOT), name="media")
-app.mount("/thumbnails", StaticFiles(directory=settings.THUMBNAILS_ROOT), name="thumbnails")
-app.mount("/transcoded", StaticFiles(directory=settings.TRANSCODED_ROOT), name="transcoded")
+app.mount(
+    "/media",
+    RangeStaticFiles(directory=settings.MEDIA_ROOT, offload_prefix=settings.X_ACCEL_MEDIA_PREFIX),
+    name="media"
+)
+app.mount(
+    "/thumbnails",
+    RangeStaticFiles(directory=settings.THUMBNAILS_ROOT, offload_prefix=settings.X_ACCEL_THUMBNAILS_PREFIX),
+    name="thumbnails"
+)
+app.mount(
+    "/transcoded",
+    RangeStaticFiles(directory=settings.TRANSCODED_ROOT, offload_prefix=settings.X_ACCEL_TRANSCODED_PREFIX),
+    name="transcoded"
+)
 
 # Global exception handler
 @app.exception_handler(Watch1Exception)
@@ -2,13 +2,14 @@
 Watch1 Media Server - Backend with Full Media Management
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form, Query, Header, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 import uvicorn
+import asyncio
 import hashlib
 import secrets
 from datetime import datetime, timedelta
@@ -18,10 +19,38 @@ import shutil
 from pathlib import Path
 import mimetypes
 
-# Simple in-memory storage for demo (replace with database in production)
-users_db = {}
-tokens_db = {}
-media_db = {}
+from app.core.config import settings
+from app.core.exceptions import Watch1Exception, MediaProcessingError
+from app.services.media_index import MediaSearchIndex, SortedMediaIndex
+from app.services.metadata import probe_media
+from app.services.record_store import open_store
+from app.services.tokens import TokenStore
+from app.services.user_directory import UserDirectory
+from app.services.streaming import RangeStaticFiles
+from app.services.resumable_uploads import UploadSession, UploadSessionStore, DEFAULT_CHUNK_SIZE
+
+# Users, tokens and media records, kept across restarts under STORE_ROOT
+users_db = open_store("users", datetime_fields=("created_at",))
+tokens_db = open_store("tokens", datetime_fields=("created_at", "expires_at"))
+media_db = open_store("media", datetime_fields=("created_at",))
+
+# Accounts in users_db, also indexed by email and id; changes go through here
+user_directory = UserDirectory(users_db)
+ADMIN_USERNAME = "admin"
+
+# Login tokens in tokens_db, swept once expired and revocable per user
+token_store = TokenStore(tokens_db, ttl=timedelta(hours=24))
+
+# Media IDs ordered by creation date, kept in step with media_db
+media_index = SortedMediaIndex()
+
+# Words of filenames and mime types to media IDs, kept in step with media_db
+search_index = MediaSearchIndex()
+
+# Set once the stored media are in each index; they are built after startup
+media_index_ready = asyncio.Event()
+search_index_ready = asyncio.Event()
+INDEX_BATCH_SIZE = 5000
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -42,6 +71,18 @@ class User(BaseModel):
     is_active: bool = True
     created_at: datetime
 
+class UserImport(BaseModel):
+    users: List[UserCreate]
+
+class UserImportSkipped(BaseModel):
+    username: str
+    email: str
+    reason: str
+
+class UserImportResult(BaseModel):
+    created: int
+    skipped: List[UserImportSkipped]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -65,6 +106,28 @@ class MediaList(BaseModel):
     page: int
     page_size: int
 
+class UploadSessionStart(BaseModel):
+    filename: str
+    file_size: int
+    mime_type: str
+
+class UploadSessionInfo(BaseModel):
+    upload_id: str
+    filename: str
+    file_size: int
+    chunk_size: int
+    bytes_received: int
+    received: List[List[int]]
+    created_at: datetime
+    updated_at: datetime
+
+ALLOWED_MEDIA_TYPES = [
+    'video/mp4', 'video/avi', 'video/mkv', 'video/mov', 'video/wmv',
+    'video/flv', 'video/webm', 'video/m4v',
+    'audio/mp3', 'audio/wav', 'audio/flac', 'audio/aac', 'audio/ogg',
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp'
+]
+
 # Security
 security = HTTPBearer()
 
@@ -78,28 +141,22 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def create_access_token(username: str) -> str:
     """Create access token"""
-    token = secrets.token_urlsafe(32)
-    tokens_db[token] = {
-        "username": username,
-        "created_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(hours=24)
-    }
-    return token
+    return token_store.issue(username)
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Get current user from token"""
     token = credentials.credentials
     
-    if token not in tokens_db:
+    token_data = token_store.get(token)
+    if token_data is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    token_data = tokens_db[token]
     if datetime.utcnow() > token_data["expires_at"]:
-        del tokens_db[token]
+        token_store.revoke(token)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token expired",
@@ -142,9 +199,27 @@ THUMBNAILS_ROOT = Path("/app/thumbnails")
 MEDIA_ROOT.mkdir(exist_ok=True)
 THUMBNAILS_ROOT.mkdir(exist_ok=True)
 
+# Resumable upload sessions, spooled outside the directories served below
+upload_sessions = UploadSessionStore(settings.UPLOAD_SPOOL_ROOT)
+
 # Mount static files
-app.mount("/media", StaticFiles(directory=str(MEDIA_ROOT)), name="media")
-app.mount("/thumbnails", StaticFiles(directory=str(THUMBNAILS_ROOT)), name="thumbnails")
+app.mount(
+    "/media",
+    RangeStaticFiles(directory=str(MEDIA_ROOT), offload_prefix=settings.X_ACCEL_MEDIA_PREFIX),
+    name="media"
+)
+app.mount(
+    "/thumbnails",
+    RangeStaticFiles(directory=str(THUMBNAILS_ROOT), offload_prefix=settings.X_ACCEL_THUMBNAILS_PREFIX),
+    name="thumbnails"
+)
+
+@app.exception_handler(Watch1Exception)
+async def watch1_exception_handler(request, exc: Watch1Exception):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "error_code": exc.error_code}
+    )
 
 # Routes
 @app.get("/")
@@ -161,38 +236,24 @@ async def health():
     """Health check"""
     return {"status": "healthy", "service": "Watch1 Media Server"}
 
-@app.post("/api/v1/auth/register", response_model=User)
-async def register_user(user_data: UserCreate):
-    """Register a new user"""
-    if user_data.username in users_db:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Check if email is already used
-    for existing_user in users_db.values():
-        if existing_user["email"] == user_data.email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-    
-    # Create user
-    user_id = secrets.token_urlsafe(16)
-    hashed_password = hash_password(user_data.password)
-    
-    user = {
-        "id": user_id,
+def new_user_record(user_data: UserCreate) -> dict:
+    """Build the stored record for a new account"""
+    return {
+        "id": secrets.token_urlsafe(16),
         "username": user_data.username,
         "email": user_data.email,
         "full_name": user_data.full_name,
         "is_active": True,
         "created_at": datetime.utcnow(),
-        "password_hash": hashed_password
+        "password_hash": hash_password(user_data.password)
     }
-    
-    users_db[user_data.username] = user
+
+@app.post("/api/v1/auth/register", response_model=User)
+async def register_user(user_data: UserCreate):
+    """Register a new user"""
+    # Username and email must be unused; both are index lookups
+    user = user_directory.add(new_user_record(user_data))
+    await users_db.commit()
     
     # Return user without password
     user_response = user.copy()
@@ -224,6 +285,21 @@ async def login_user(login_data: UserLogin):
     access_token = create_access_token(login_data.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/api/v1/auth/logout")
+async def logout_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user)
+):
+    """Revoke the token used for this request"""
+    token_store.revoke(credentials.credentials)
+    return {"message": "Logged out"}
+
+@app.post("/api/v1/auth/logout-all")
+async def logout_everywhere(current_user: User = Depends(get_current_user)):
+    """Revoke every token of the current user"""
+    revoked = token_store.revoke_user(current_user.username)
+    return {"message": "Logged out everywhere", "revoked": revoked}
+
 @app.get("/api/v1/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     """Get current user information"""
@@ -239,6 +315,29 @@ async def get_users(current_user: User = Depends(get_current_user)):
         users.append(User(**user_response))
     return users
 
+@app.post("/api/v1/users/import", response_model=UserImportResult)
+async def import_users(
+    user_import: UserImport,
+    current_user: User = Depends(get_current_user)
+):
+    """Create many accounts at once, skipping any whose username or email is taken"""
+    if current_user.username != ADMIN_USERNAME:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the administrator can import users"
+        )
+    
+    added, skipped = user_directory.add_many(new_user_record(user_data) for user_data in user_import.users)
+    await users_db.commit()
+    
+    return UserImportResult(
+        created=len(added),
+        skipped=[
+            UserImportSkipped(username=user["username"], email=user["email"], reason=reason)
+            for user, reason in skipped
+        ]
+    )
+
 # Media endpoints
 @app.get("/api/v1/media/", response_model=MediaList)
 async def get_media_files(
@@ -247,19 +346,36 @@ async def get_media_files(
     current_user: User = Depends(get_current_user)
 ):
     """Get media files with pagination"""
+    await media_index_ready.wait()
     start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
     
-    media_list = list(media_db.values())
-    total = len(media_list)
+    # Newest first, straight from the maintained index
+    page_ids = media_index.page(start_idx, page_size)
+    total = len(media_index)
     
-    # Sort by creation date (newest first)
-    media_list.sort(key=lambda x: x["created_at"], reverse=True)
-    
-    paginated_media = media_list[start_idx:end_idx]
+    return MediaList(
+        media=[MediaFile(**media_db[media_id]) for media_id in page_ids],
+        total=total,
+        page=page,
+        page_size=page_size
+    )
+
+@app.get("/api/v1/media/search", response_model=MediaList)
+async def search_media_files(
+    query: str = Query(..., min_length=1, description="Words to find; the last one may be a prefix"),
+    media_type: Optional[str] = Query(None, description="video, audio or image"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Search media by filename and mime type, best matches first"""
+    await search_index_ready.wait()
+    page_ids, total = search_index.search(
+        query, offset=(page - 1) * page_size, limit=page_size, media_type=media_type
+    )
     
     return MediaList(
-        media=[MediaFile(**media) for media in paginated_media],
+        media=[MediaFile(**media_db[media_id]) for media_id in page_ids],
         total=total,
         page=page,
         page_size=page_size
@@ -281,20 +397,14 @@ async def get_media_file(
 
 @app.post("/api/v1/media/upload", response_model=MediaFile)
 async def upload_media_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
     """Upload a media file"""
     
     # Validate file type
-    allowed_types = [
-        'video/mp4', 'video/avi', 'video/mkv', 'video/mov', 'video/wmv',
-        'video/flv', 'video/webm', 'video/m4v',
-        'audio/mp3', 'audio/wav', 'audio/flac', 'audio/aac', 'audio/ogg',
-        'image/jpeg', 'image/png', 'image/gif', 'image/webp'
-    ]
-    
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_MEDIA_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"File type {file.content_type} not supported"
@@ -314,24 +424,9 @@ async def upload_media_file(
         # Get file size
         file_size = file_path.stat().st_size
         
-        # Create media record
-        media_record = {
-            "id": file_id,
-            "filename": safe_filename,
-            "original_filename": file.filename,
-            "file_path": str(file_path),
-            "file_size": file_size,
-            "mime_type": file.content_type,
-            "duration": None,  # TODO: Extract from video/audio files
-            "width": None,     # TODO: Extract from video/image files
-            "height": None,    # TODO: Extract from video/image files
-            "created_at": datetime.utcnow(),
-            "uploaded_by": current_user.username
-        }
-        
-        media_db[file_id] = media_record
-        
-        return MediaFile(**media_record)
+        media_record = add_media_record(
+            file_id, file_path, file.filename, file_size, file.content_type, current_user.username
+        )
         
     except Exception as e:
         # Clean up file if something went wrong
@@ -341,6 +436,143 @@ async def upload_media_file(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to upload file: {str(e)}"
         )
+    
+    # Shares one fsync with any other uploads finishing at the same time
+    await media_db.commit()
+    background_tasks.add_task(extract_media_metadata, file_id)
+    return MediaFile(**media_record)
+
+def add_media_record(
+    file_id: str,
+    file_path: Path,
+    original_filename: str,
+    file_size: int,
+    mime_type: str,
+    uploaded_by: str
+) -> dict:
+    """Create the media record for a file already stored in MEDIA_ROOT"""
+    media_record = {
+        "id": file_id,
+        "filename": file_path.name,
+        "original_filename": original_filename,
+        "file_path": str(file_path),
+        "file_size": file_size,
+        "mime_type": mime_type,
+        "duration": None,  # Filled in by extract_media_metadata
+        "width": None,
+        "height": None,
+        "created_at": datetime.utcnow(),
+        "uploaded_by": uploaded_by
+    }
+    
+    media_db[file_id] = media_record
+    media_index.add(file_id, media_record["created_at"])
+    search_index.add(file_id, media_record)
+    return media_record
+
+async def extract_media_metadata(file_id: str):
+    """Fill in duration and dimensions of a stored file using ffprobe"""
+    media_record = media_db.get(file_id)
+    if media_record is None:
+        return
+    
+    try:
+        metadata = await probe_media(media_record["file_path"])
+    except MediaProcessingError as e:
+        print(f"⚠️ Metadata extraction failed for {file_id}: {e.detail}")
+        return
+    
+    for field in ("duration", "width", "height"):
+        media_record[field] = metadata[field]
+    # Unless the file was deleted while it was being probed
+    if file_id in media_db:
+        media_db.save(file_id)
+
+def upload_session_response(session: UploadSession) -> UploadSessionInfo:
+    """Build the public view of a resumable upload session"""
+    return UploadSessionInfo(
+        upload_id=session.upload_id,
+        filename=session.filename,
+        file_size=session.file_size,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        bytes_received=session.bytes_received,
+        received=session.received,
+        created_at=session.created_at,
+        updated_at=session.updated_at
+    )
+
+@app.post("/api/v1/media/uploads", response_model=UploadSessionInfo)
+async def create_upload_session(
+    session_data: UploadSessionStart,
+    current_user: User = Depends(get_current_user)
+):
+    """Start a resumable upload"""
+    if session_data.mime_type not in ALLOWED_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type {session_data.mime_type} not supported"
+        )
+    
+    session = upload_sessions.create(
+        filename=session_data.filename,
+        file_size=session_data.file_size,
+        mime_type=session_data.mime_type,
+        owner=current_user.username
+    )
+    return upload_session_response(session)
+
+@app.get("/api/v1/media/uploads/{upload_id}", response_model=UploadSessionInfo)
+async def get_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the byte ranges received so far for a resumable upload"""
+    return upload_session_response(upload_sessions.get(upload_id, owner=current_user.username))
+
+@app.put("/api/v1/media/uploads/{upload_id}", response_model=UploadSessionInfo)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    chunk_sha256: str = Header(..., alias="X-Chunk-SHA256"),
+    current_user: User = Depends(get_current_user)
+):
+    """Write one chunk of a resumable upload at the given offset"""
+    session = upload_sessions.get(upload_id, owner=current_user.username)
+    session = await upload_sessions.write_chunk(session, offset, request.stream(), chunk_sha256)
+    return upload_session_response(session)
+
+@app.post("/api/v1/media/uploads/{upload_id}/complete", response_model=MediaFile)
+async def complete_upload_session(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Finish a resumable upload and create its media record"""
+    session = upload_sessions.get(upload_id, owner=current_user.username)
+    # Records here carry no content hash, so the file is not read again
+    upload_sessions.ensure_complete(session)
+    
+    file_id = secrets.token_urlsafe(16)
+    file_path = MEDIA_ROOT / f"{file_id}{Path(session.filename).suffix}"
+    await asyncio.to_thread(shutil.move, upload_sessions.data_path(upload_id), str(file_path))
+    upload_sessions.discard(session, keep_data=True)
+    
+    media_record = add_media_record(
+        file_id, file_path, session.filename, session.file_size, session.mime_type, current_user.username
+    )
+    await media_db.commit()
+    background_tasks.add_task(extract_media_metadata, file_id)
+    return MediaFile(**media_record)
+
+@app.delete("/api/v1/media/uploads/{upload_id}")
+async def abort_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Abort a resumable upload and remove its data"""
+    upload_sessions.discard(upload_sessions.get(upload_id, owner=current_user.username))
+    return {"message": "Upload aborted"}
 
 @app.delete("/api/v1/media/{media_id}")
 async def delete_media_file(
@@ -370,14 +602,27 @@ async def delete_media_file(
     
     # Remove from database
     del media_db[media_id]
+    media_index.discard(media_id, media_record["created_at"])
+    search_index.discard(media_id)
+    await media_db.commit()
     
     return {"message": "Media file deleted successfully"}
 
 # Create default admin user on startup
 @app.on_event("startup")
 async def startup_event():
-    """Create default admin user and sample media"""
-    admin_username = "admin"
+    """Load stored records, then create default admin user and sample media"""
+    for store in (users_db, tokens_db, media_db):
+        store.load()
+    token_store.load()
+    user_directory.load()
+    app.state.token_sweeper = asyncio.create_task(token_store.run_forever())
+    
+    # Stored media are indexed in the background so startup does not wait
+    # on the size of the library; media added below index themselves
+    app.state.index_task = asyncio.create_task(build_media_indexes(list(media_db)))
+    
+    admin_username = ADMIN_USERNAME
     admin_password = "admin123"
     
     if admin_username not in users_db:
@@ -394,7 +639,7 @@ async def startup_event():
             "password_hash": hashed_password
         }
         
-        users_db[admin_username] = admin_user
+        user_directory.add(admin_user)
         print(f"✅ Created default admin user: {admin_username} / {admin_password}")
     
     # Create sample media entries for demo
@@ -443,8 +688,40 @@ async def startup_event():
     for media in sample_media:
         if media["id"] not in media_db:
             media_db[media["id"]] = media
+            media_index.add(media["id"], media["created_at"])
+            search_index.add(media["id"], media)
     
     print(f"✅ Created {len(sample_media)} sample media files")
 
+async def build_media_indexes(media_ids: List[str]):
+    """Index stored media in batches, letting requests run in between
+
+    The listing index is built first, as it is the cheaper of the two and
+    what the library page needs.
+    """
+    for start in range(0, len(media_ids), INDEX_BATCH_SIZE):
+        for media_id in media_ids[start:start + INDEX_BATCH_SIZE]:
+            if media_id in media_db:
+                media_index.add(media_id, media_db[media_id]["created_at"])
+        await asyncio.sleep(0)
+    media_index_ready.set()
+    
+    for start in range(0, len(media_ids), INDEX_BATCH_SIZE):
+        search_index.add_many(
+            (media_id, media_db[media_id])
+            for media_id in media_ids[start:start + INDEX_BATCH_SIZE]
+            if media_id in media_db
+        )
+        await asyncio.sleep(0)
+    search_index_ready.set()
+    print(f"✅ Indexed {len(media_ids)} stored media files")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Write out pending changes"""
+    app.state.token_sweeper.cancel()
+    for store in (users_db, tokens_db, media_db):
+        await store.close()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -4,20 +4,32 @@ Watch1 Media Server - Backend with User Management
 
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 import uvicorn
+import asyncio
 import hashlib
 import secrets
 from datetime import datetime, timedelta
 import json
 import os
 
+from app.core.exceptions import Watch1Exception
+from app.services.tokens import TokenStore
+from app.services.user_directory import UserDirectory
+
 # Simple in-memory storage for demo (replace with database in production)
 users_db = {}
 tokens_db = {}
 
+# Accounts in users_db, also indexed by email and id; changes go through here
+user_directory = UserDirectory(users_db)
+
+# Login tokens in tokens_db, swept once expired and revocable per user
+token_store = TokenStore(tokens_db, ttl=timedelta(hours=24))
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -57,28 +69,22 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def create_access_token(username: str) -> str:
     """Create access token"""
-    token = secrets.token_urlsafe(32)
-    tokens_db[token] = {
-        "username": username,
-        "created_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(hours=24)
-    }
-    return token
+    return token_store.issue(username)
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Get current user from token"""
     token = credentials.credentials
     
-    if token not in tokens_db:
+    token_data = token_store.get(token)
+    if token_data is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    token_data = tokens_db[token]
     if datetime.utcnow() > token_data["expires_at"]:
-        del tokens_db[token]
+        token_store.revoke(token)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token expired",
@@ -115,6 +121,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Watch1Exception)
+async def watch1_exception_handler(request, exc: Watch1Exception):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "error_code": exc.error_code}
+    )
+
 # Routes
 @app.get("/")
 async def root():
@@ -133,21 +146,7 @@ async def health():
 @app.post("/api/v1/auth/register", response_model=User)
 async def register_user(user_data: UserCreate):
     """Register a new user"""
-    if user_data.username in users_db:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Check if email is already used
-    for existing_user in users_db.values():
-        if existing_user["email"] == user_data.email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-    
-    # Create user
+    # Create user; username and email must be unused, both index lookups
     user_id = secrets.token_urlsafe(16)
     hashed_password = hash_password(user_data.password)
     
@@ -161,7 +160,7 @@ async def register_user(user_data: UserCreate):
         "password_hash": hashed_password
     }
     
-    users_db[user_data.username] = user
+    user_directory.add(user)
     
     # Return user without password
     user_response = user.copy()
@@ -220,7 +219,9 @@ async def get_media(current_user: User = Depends(get_current_user)):
 # Create default admin user on startup
 @app.on_event("startup")
 async def startup_event():
-    """Create default admin user"""
+    """Create default admin user and start sweeping expired tokens"""
+    app.state.token_sweeper = asyncio.create_task(token_store.run_forever())
+    
     admin_username = "admin"
     admin_password = "admin123"
     
@@ -238,7 +239,7 @@ async def startup_event():
             "password_hash": hashed_password
         }
         
-        users_db[admin_username] = admin_user
+        user_directory.add(admin_user)
         print(f"✅ Created default admin user: {admin_username} / {admin_password}")
 
 if __name__ == "__main__":
@@ -21,7 +21,7 @@ export const mediaApi = {
   },
 
   async searchMedia(params: MediaSearchParams): Promise<MediaSearchResponse> {
-    const response = await apiClient.get('/media', { params })
+    const response = await apiClient.get('/media/search', { params })
     return response.data
   },
 